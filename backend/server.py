@@ -1,18 +1,39 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
-from fastapi.responses import Response, JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers, MutableHeaders
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
-from datetime import datetime
+import asyncio
+import codecs
+import gzip
+import hashlib
+import heapq
+import json
+import math
+import posixpath
+import tempfile
+import time
+import zlib
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict, deque
+from itertools import chain
+from operator import itemgetter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import httpx
 import re
-from urllib.parse import urljoin, urlparse, parse_qs, quote_plus
+from urllib.parse import urljoin, urlparse, urlsplit, urlunsplit, parse_qs, quote, quote_plus, unquote
 import base64
 
 
@@ -24,6 +45,40 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Upstream sites (overridable, e.g. to point benchmarks at a local stand-in)
+GN_MATH_PORTAL_URL = os.environ.get('GN_MATH_PORTAL_URL', 'https://gn-math.dev/')
+GN_MATH_MIRRORS = os.environ.get(
+    'GN_MATH_MIRRORS',
+    'https://gn-math.github.io/{game}/,'
+    'https://raw.githubusercontent.com/genizy/web-port/main/{game}/index.html,'
+    'https://genizy.github.io/web-port/{game}/',
+).split(',')
+SUGGESTION_API_URL = os.environ.get(
+    'SUGGESTION_API_URL',
+    'https://suggestqueries.google.com/complete/search?client=firefox&q={query}',
+)
+
+# HTTP/2 needs the optional `h2` package (installed via httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# orjson is optional; the standard library encoder is the fallback
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Brotli is optional; without it only gzip is negotiated
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -60,145 +115,4191 @@ class GameCreate(BaseModel):
     thumbnail: Optional[str] = None
 
 
+# Fast-path JSON
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_json(content) -> bytes:
+    """Encode plain dicts/lists (datetimes as ISO 8601, like pydantic) to JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content)
+    return json.dumps(
+        content, ensure_ascii=False, separators=(',', ':'), default=_json_default
+    ).encode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response for content that is already plain data, e.g. projected Mongo
+    documents: skips response_model validation and jsonable_encoder entirely"""
+
+    def render(self, content) -> bytes:
+        return dumps_json(content)
+
+
+# Metrics
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+def _label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def media_type(content_type: Optional[str]) -> str:
+    """`text/html; charset=utf-8` -> `text/html`, for use as a metric label"""
+    if not content_type:
+        return ''
+    return content_type.split(';', 1)[0].strip().lower()[:64]
+
+
+class Histogram:
+    """Prometheus histogram keyed by label values; one bisect and two adds per observation"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, values: tuple, amount: float):
+        series = self._series.get(values)
+        if series is None:
+            series = self._series[values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, amount)] += 1
+        series[1] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Prometheus counter keyed by label values"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._series: Dict[tuple, float] = defaultdict(float)
+
+    def inc(self, values: tuple, amount: float = 1):
+        self._series[values] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for values, total in self._series.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {total}")
+        return lines
+
+
+class RequestMetrics:
+    """Per-request state the pipeline stages read their labels from"""
+
+    __slots__ = ('scope', 'host')
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.host = ''
+
+    @property
+    def route(self) -> str:
+        # Route templates, not raw paths, keep the label set bounded
+        route = self.scope.get('route')
+        return getattr(route, 'path', None) or 'unmatched'
+
+
+_request_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar('request_metrics', default=None)
+
+
+class Metrics:
+    """Request and per-stage latency histograms plus byte counters, exported on /metrics.
+
+    Stages: ``queue`` (waiting for a per-host slot), ``connect`` (DNS + TCP),
+    ``tls``, ``ttfb`` (request sent to response headers), ``download``
+    (headers to body closed), ``decode``, ``rewrite`` and ``mongo``. Upstream
+    hosts beyond ``max_hosts`` distinct values are labeled ``other``.
+    """
+
+    def __init__(self, enabled: bool = True, max_hosts: int = 200):
+        self.enabled = enabled
+        self.max_hosts = max_hosts
+        self._hosts: set = set()
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Time to serve a request, including the streamed body',
+            ('route', 'method', 'status', 'content_type'),
+        )
+        self.stage_duration = Histogram(
+            'request_stage_duration_seconds', 'Time spent in each stage of the request pipeline',
+            ('stage', 'route', 'host', 'content_type'),
+        )
+        self.upstream_bytes_in = Counter(
+            'upstream_bytes_in_total', 'Bytes read from upstream servers (as sent on the wire)',
+            ('route', 'host', 'content_type'),
+        )
+        self.bytes_out = Counter(
+            'http_response_bytes_out_total', 'Response body bytes sent to clients',
+            ('route', 'host', 'content_type'),
+        )
+
+    def host_label(self, host: str) -> str:
+        if host in self._hosts or not host:
+            return host
+        if len(self._hosts) >= self.max_hosts:
+            return 'other'
+        self._hosts.add(host)
+        return host
+
+    def observe_stage(self, stage: str, seconds: float, host: str = '', content_type: str = ''):
+        if not self.enabled:
+            return
+        state = _request_metrics.get()
+        route = state.route if state is not None else 'background'
+        self.stage_duration.observe((stage, route, self.host_label(host), content_type), seconds)
+
+    def stage(self, stage: str, host: str = '', content_type: str = ''):
+        """Context manager timing a block as one pipeline stage"""
+        return _StageTimer(self, stage, host, content_type)
+
+    def set_upstream_host(self, host: str):
+        """Label the current request's outgoing bytes with the upstream it proxies"""
+        state = _request_metrics.get()
+        if state is not None and self.enabled:
+            state.host = self.host_label(host)
+
+    def observe_upstream(self, host: str, content_type: str, queued: float, stages: Dict[str, float]):
+        """Record how long an upstream request spent getting to its response headers"""
+        if not self.enabled:
+            return
+        self.observe_stage('queue', queued, host, content_type)
+        for stage, seconds in stages.items():
+            self.observe_stage(stage, seconds, host, content_type)
+
+    def observe_download(self, host: str, content_type: str, seconds: float, nbytes: int):
+        if not self.enabled:
+            return
+        self.observe_stage('download', seconds, host, content_type)
+        state = _request_metrics.get()
+        route = state.route if state is not None else 'background'
+        self.upstream_bytes_in.inc((route, self.host_label(host), content_type), nbytes)
+
+    def observe_request(
+        self, state: RequestMetrics, method: str, status: int, content_type: str, seconds: float, nbytes: int
+    ):
+        route = state.route
+        self.request_duration.observe((route, method, str(status), content_type), seconds)
+        self.bytes_out.inc((route, state.host, content_type), nbytes)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.request_duration, self.stage_duration, self.upstream_bytes_in, self.bytes_out):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'stage', 'host', 'content_type', 'start')
+
+    def __init__(self, metrics: Metrics, stage: str, host: str, content_type: str):
+        self.metrics = metrics
+        self.stage = stage
+        self.host = host
+        self.content_type = content_type
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe_stage(self.stage, time.perf_counter() - self.start, self.host, self.content_type)
+
+
+class _UpstreamTrace:
+    """httpcore trace hook accumulating connect/TLS/TTFB time (summed over redirects)"""
+
+    __slots__ = ('stages', '_started')
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self._started: Dict[str, float] = {}
+
+    def _add(self, stage: str, started: Optional[float]):
+        if started is not None:
+            self.stages[stage] = self.stages.get(stage, 0.0) + time.perf_counter() - started
+
+    async def __call__(self, event_name: str, info: dict):
+        step, _, phase = event_name.rpartition('.')
+        step = step.rpartition('.')[2]
+        if phase == 'started':
+            if step in ('connect_tcp', 'start_tls', 'send_request_headers'):
+                self._started[step] = time.perf_counter()
+        elif phase == 'complete':
+            if step == 'connect_tcp':
+                self._add('connect', self._started.pop(step, None))
+            elif step == 'start_tls':
+                self._add('tls', self._started.pop(step, None))
+            elif step == 'receive_response_headers':
+                self._add('ttfb', self._started.pop('send_request_headers', None))
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request and counting response body bytes"""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        state = RequestMetrics(scope)
+        token = _request_metrics.set(state)
+        status = 500
+        content_type = ''
+        content_length = 0
+        sent = 0
+
+        async def send_wrapper(message):
+            nonlocal status, content_type, content_length, sent
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                for name, value in message.get('headers', ()):
+                    if name == b'content-type':
+                        content_type = media_type(value.decode('latin-1'))
+                    elif name == b'content-length' and value.isdigit():
+                        content_length = int(value)
+            elif message['type'] == 'http.response.body':
+                sent += len(message.get('body', b''))
+            elif message['type'] == 'http.response.pathsend':
+                # The server sends the file itself; its size is the declared length
+                sent += content_length
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.metrics.observe_request(
+                state, scope['method'], status, content_type, time.perf_counter() - start, sent
+            )
+            _request_metrics.reset(token)
+
+
+metrics = Metrics(
+    enabled=os.environ.get('METRICS_ENABLED', 'true').lower() == 'true',
+    max_hosts=int(os.environ.get('METRICS_MAX_HOSTS', 200)),
+)
+
+
+# Response compression
+COMPRESSIBLE_MEDIA_TYPES = {
+    'application/json', 'application/javascript', 'application/x-javascript', 'application/xml',
+    'application/x-ndjson', 'application/manifest+json', 'application/wasm', 'image/svg+xml',
+}
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 500))
+# Fast settings for per-request compression, thorough ones for cached variants
+STREAM_COMPRESSION_LEVELS = {'br': 4, 'gzip': 6}
+CACHED_COMPRESSION_LEVELS = {'br': 9, 'gzip': 9}
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    media = media_type(content_type)
+    return (
+        media.startswith('text/') or media in COMPRESSIBLE_MEDIA_TYPES
+        or media.endswith('+json') or media.endswith('+xml')
+    )
+
+def parse_accept_encoding(value: Optional[str]) -> Dict[str, float]:
+    qualities = {}
+    for part in (value or '').split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, raw = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(raw)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Content coding to compress with: br, then gzip, or None for identity"""
+    qualities = parse_accept_encoding(accept_encoding)
+    wildcard = qualities.get('*', 0.0)
+    best, best_quality = None, 0.0
+    for encoding in (('br',) if BROTLI_AVAILABLE else ()) + ('gzip',):
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def encoding_accepted(accept_encoding: Optional[str], content_encoding: str) -> bool:
+    """Whether a body already encoded with ``content_encoding`` can be sent as-is"""
+    qualities = parse_accept_encoding(accept_encoding)
+    wildcard = qualities.get('*', 0.0)
+    codings = [coding.strip().lower() for coding in content_encoding.split(',') if coding.strip()]
+    return bool(codings) and all(
+        qualities.get(coding, qualities.get('x-gzip', wildcard) if coding == 'gzip' else wildcard) > 0
+        for coding in codings
+    )
+
+def compress_bytes(data: bytes, encoding: str, level: int) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class _StreamCompressor:
+    """Incremental br/gzip encoder; each chunk is flushed so streaming is not delayed"""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class CompressionMiddleware:
+    """Compresses compressible responses with the client's preferred br/gzip coding.
+
+    Responses that already carry a Content-Encoding (passed-through upstream
+    bodies, cached variants), partial content and small single-message
+    bodies are sent untouched. Streamed bodies are compressed chunk by chunk.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get('accept-encoding'))
+        start_message = None
+        compressor: Optional[_StreamCompressor] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message['type'] == 'http.response.start':
+                start_message = message
+                return
+            if message['type'] != 'http.response.body':
+                # e.g. http.response.pathsend: the server sends the file itself
+                if compressor is None:
+                    passthrough = True
+                    await send(start_message)
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start_message['headers'])
+                compressible = is_compressible(headers.get('content-type'))
+                if compressible and 'accept-encoding' not in headers.get('vary', '').lower():
+                    headers.add_vary_header('Accept-Encoding')
+                if (
+                    encoding is None
+                    or not compressible
+                    or 'content-encoding' in headers
+                    or 'content-range' in headers
+                    or start_message['status'] in (204, 206, 304)
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressor = _StreamCompressor(encoding, STREAM_COMPRESSION_LEVELS[encoding])
+                headers['Content-Encoding'] = encoding
+                etag = headers.get('etag')
+                if etag and etag.endswith('"') and not etag.startswith('W/'):
+                    # A strong ETag names one representation; tag the compressed one apart
+                    headers['ETag'] = f'{etag[:-1]}-{encoding}"'
+                if more_body:
+                    del headers['Content-Length']
+                    await send(start_message)
+                else:
+                    body = compressor.compress(body) + compressor.finish()
+                    headers['Content-Length'] = str(len(body))
+                    await send(start_message)
+                    await send({'type': 'http.response.body', 'body': body})
+                    return
+
+            chunk = compressor.compress(body) if body else b''
+            if not more_body:
+                chunk += compressor.finish()
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# Conditional GET for our own responses
+# Suffix CompressionMiddleware appends to the ETag of a representation it compressed
+ETAG_CODING_SUFFIX_RE = re.compile(r'-(?:br|gzip)"$')
+# Headers a 304 repeats from the 200 it stands for (RFC 9110, section 15.4.5)
+NOT_MODIFIED_HEADERS = (b'cache-control', b'content-location', b'date', b'etag', b'expires', b'vary')
+
+
+def content_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def matching_etag(if_none_match: str, etag: str) -> Optional[str]:
+    """The tag in an If-None-Match header that matches ``etag``, if any.
+
+    Comparison is weak, as If-None-Match requires, and ignores the coding
+    suffix of compressed representations, so the tag the client holds can
+    be echoed back in the 304.
+    """
+    if if_none_match.strip() == '*':
+        return etag
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if ETAG_CODING_SUFFIX_RE.sub('"', tag.removeprefix('W/')) == etag.removeprefix('W/'):
+            return tag
+    return None
+
+
+class CachePolicy:
+    """Cache-Control and Vary for one route, and optionally its current ETag"""
+
+    __slots__ = ('cache_control', 'vary', 'etag')
+
+    def __init__(self, cache_control: str, vary: tuple = ('Accept-Encoding',), etag=None):
+        self.cache_control = cache_control
+        self.vary = vary
+        # Callable taking the ASGI scope and returning the ETag the handler's
+        # response will have, for routes that can tell without running the handler
+        self.etag = etag
+
+
+class CachePolicies:
+    """Per-route cache policies, with counters of what conditional requests saved"""
+
+    def __init__(self):
+        self.routes: Dict[str, CachePolicy] = {}
+        self.counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def add(self, path: str, cache_control: str, vary: tuple = ('Accept-Encoding',), etag=None):
+        self.routes[path] = CachePolicy(cache_control, vary, etag)
+
+    def get(self, path: str) -> Optional[CachePolicy]:
+        return self.routes.get(path)
+
+    def stats(self) -> dict:
+        return {
+            path: {
+                "cache_control": policy.cache_control,
+                "vary": list(policy.vary),
+                "precomputed_etag": policy.etag is not None,
+                **{name: self.counters[path][name] for name in (
+                    'served', 'not_modified', 'not_modified_early', 'hashed', 'unvalidated',
+                )},
+            }
+            for path, policy in self.routes.items()
+        }
+
+
+class ConditionalGetMiddleware:
+    """Adds validators and caching headers to GET responses of the routes in ``policies``.
+
+    A route whose policy knows its current ETag is answered with 304 before
+    the handler runs, so nothing is queried or serialized. Otherwise the
+    handler's own ETag is used, or a strong one is hashed from a
+    single-message body; streamed bodies only get the caching headers.
+    """
+
+    def __init__(self, app, policies: CachePolicies):
+        self.app = app
+        self.policies = policies
+
+    async def __call__(self, scope, receive, send):
+        policy = self.policies.get(scope['path']) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+        counters = self.policies.counters[scope['path']]
+        if_none_match = Headers(scope=scope).get('if-none-match')
+        known_etag = (policy.etag(scope) or None) if policy.etag is not None else None
+        if known_etag and if_none_match:
+            matched = matching_etag(if_none_match, known_etag)
+            if matched:
+                counters['not_modified_early'] += 1
+                headers = MutableHeaders(raw=[])
+                self._apply(policy, headers)
+                headers['ETag'] = matched
+                await self._send_not_modified(send, headers.raw)
+                return
+
+        start_message = None
+        passthrough = False
+        swallow = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough, swallow
+            if passthrough:
+                await send(message)
+                return
+            if swallow:
+                return
+            if message['type'] == 'http.response.start':
+                if message['status'] != 200:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            headers = MutableHeaders(raw=start_message['headers'])
+            self._apply(policy, headers)
+            etag = headers.get('etag') or known_etag
+            if etag is None and message['type'] == 'http.response.body' and not message.get('more_body', False):
+                etag = content_etag(message.get('body', b''))
+                counters['hashed'] += 1
+            if etag is None:
+                counters['unvalidated'] += 1
+            else:
+                headers['ETag'] = etag
+                matched = matching_etag(if_none_match, etag) if if_none_match else None
+                if matched:
+                    counters['not_modified'] += 1
+                    headers['ETag'] = matched
+                    swallow = True
+                    await self._send_not_modified(send, headers.raw)
+                    return
+            counters['served'] += 1
+            passthrough = True
+            await send(start_message)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _apply(policy: CachePolicy, headers: MutableHeaders):
+        if 'cache-control' not in headers:
+            headers['Cache-Control'] = policy.cache_control
+        vary = headers.get('vary', '').lower()
+        for name in policy.vary:
+            if name.lower() not in vary:
+                headers.add_vary_header(name)
+
+    @staticmethod
+    async def _send_not_modified(send, raw_headers: list):
+        await send({
+            'type': 'http.response.start',
+            'status': 304,
+            'headers': [(name, value) for name, value in raw_headers if name in NOT_MODIFIED_HEADERS],
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+cache_policies = CachePolicies()
+
+
+# Shared upstream HTTP client
+class _SlotReleasingStream(httpx.AsyncByteStream):
+    """Response body stream that frees its per-host slot once closed.
+
+    Also records the ``download`` stage and wire bytes read for metrics, and
+    reports transport errors while reading (a stall or reset mid-body) to
+    ``on_error``.
+    """
+
+    def __init__(self, stream, release, host: str = '', content_type: str = '', on_error=None):
+        self._stream = stream
+        self._release = release
+        self._host = host
+        self._content_type = content_type
+        self._on_error = on_error
+        self._opened = time.perf_counter()
+        self._bytes = 0
+        self._closed = False
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                self._bytes += len(chunk)
+                yield chunk
+        except BaseException as exc:
+            if isinstance(exc, httpx.TransportError) and self._on_error is not None:
+                self._on_error(type(exc).__name__)
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+            if not self._closed:
+                self._closed = True
+                metrics.observe_download(
+                    self._host, self._content_type, time.perf_counter() - self._opened, self._bytes
+                )
+
+
+# Admission priorities, most urgent first
+PRIORITY_INTERACTIVE = 0  # pages and suggestions a user is waiting on
+PRIORITY_DEFAULT = 1
+PRIORITY_BULK = 2         # assets, media ranges
+PRIORITY_BACKGROUND = 3   # prefetch, warming, mirror sync, catalog refresh
+PRIORITY_NAMES = ('interactive', 'default', 'bulk', 'background')
+ASSET_EXTENSIONS = {
+    '.js', '.mjs', '.css', '.wasm', '.data', '.pck', '.bin', '.json', '.map', '.png', '.jpg', '.jpeg',
+    '.gif', '.webp', '.svg', '.ico', '.mp3', '.ogg', '.wav', '.mp4', '.webm', '.woff', '.woff2',
+    '.ttf', '.otf', '.zip', '.unityweb', '.swf',
+}
+
+def request_priority(url: str, headers: Optional[dict] = None) -> int:
+    """Guess a fetch's priority: byte ranges and asset paths are bulk, documents interactive"""
+    if headers and any(name.lower() == 'range' for name in headers):
+        return PRIORITY_BULK
+    extension = posixpath.splitext(urlsplit(url).path)[1].lower()
+    return PRIORITY_BULK if extension in ASSET_EXTENSIONS else PRIORITY_INTERACTIVE
+
+
+class UpstreamUnavailable(HTTPException):
+    """503 with Retry-After for an upstream fetch that was not attempted"""
+
+    state = 'unavailable'
+
+    def __init__(self, host: str, reason: str, retry_after: int):
+        super().__init__(
+            status_code=503,
+            detail=f"Upstream {host or 'fetches'} {self.state} ({reason}), retry later",
+            headers={'Retry-After': str(retry_after)},
+        )
+        self.host = host
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class UpstreamOverloaded(UpstreamUnavailable):
+    """Raised instead of queueing further when upstream admission is saturated"""
+
+    state = 'overloaded'
+
+
+class _Waiter:
+    __slots__ = ('priority', 'seq', 'host', 'future')
+
+    def __init__(self, priority: int, seq: int, host: str, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.host = host
+        self.future = future
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    """Global and per-host caps on concurrent upstream fetches, with bounded priority queues.
+
+    A fetch starts at once when both its host and the process are below
+    their caps. Otherwise it waits in a queue ordered by priority, then
+    arrival; a freed slot goes to the most urgent waiter whose host has
+    room. Waits are bounded by ``queue_timeout``, and when a host's queue
+    or the whole queue is full the least urgent request (possibly the new
+    one) is shed with ``UpstreamOverloaded`` so latency cannot grow without
+    limit. Bulk and background fetches can move to a separate per-host
+    budget of ``max_streams_per_host`` once their headers arrive (see
+    ``hand_off``), so a few long downloads cannot starve interactive fetches.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 100,
+        max_per_host: int = 20,
+        max_queued: int = 500,
+        max_queued_per_host: int = 100,
+        queue_timeout: float = 5.0,
+        max_streams_per_host: int = 20,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_per_host = max_per_host
+        self.max_queued = max_queued
+        self.max_queued_per_host = max_queued_per_host
+        self.queue_timeout = queue_timeout
+        self.max_streams_per_host = max_streams_per_host
+        self.in_flight = 0
+        self.host_in_flight: Dict[str, int] = defaultdict(int)
+        self.host_queued: Dict[str, int] = defaultdict(int)
+        self.host_streaming: Dict[str, int] = defaultdict(int)
+        self._waiters: List[_Waiter] = []
+        self._seq = 0
+        self._hold_time = 0.5
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def _has_room(self, host: str) -> bool:
+        return self.in_flight < self.max_in_flight and self.host_in_flight.get(host, 0) < self.max_per_host
+
+    def _grant(self, host: str):
+        self.in_flight += 1
+        self.host_in_flight[host] += 1
+
+    def _release(self, host: str):
+        self.in_flight -= 1
+        self.host_in_flight[host] -= 1
+        if not self.host_in_flight[host]:
+            del self.host_in_flight[host]
+        self._dispatch()
+
+    def retry_after(self) -> int:
+        """Seconds until the queue should have drained, from the average slot hold time"""
+        backlog = len(self._waiters) / max(1, self.max_in_flight)
+        return max(1, min(30, math.ceil(self._hold_time * (1 + backlog))))
+
+    async def acquire(self, host: str, priority: int = PRIORITY_DEFAULT):
+        """Wait for a slot; returns a ``release()`` callable to call exactly once"""
+        if self._has_room(host):
+            self._grant(host)
+        else:
+            await self._wait(host, priority)
+        self.counters[f'admitted_{PRIORITY_NAMES[priority]}'] += 1
+        granted_at = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self._hold_time = 0.9 * self._hold_time + 0.1 * (time.monotonic() - granted_at)
+            self._release(host)
+
+        return release
+
+    def hand_off(self, host: str, release):
+        """Trade an admitted fetch's slot for a streaming-body slot, if ``host`` has one free.
+
+        Returns the ``release()`` to call once the body is done: the new
+        one, or ``release`` itself when the streaming budget is full.
+        """
+        if self.host_streaming.get(host, 0) >= self.max_streams_per_host:
+            self.counters['hand_off_full'] += 1
+            return release
+        self.host_streaming[host] += 1
+        self.counters['handed_off'] += 1
+        release()
+        released = False
+
+        def release_stream():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self.host_streaming[host] -= 1
+            if not self.host_streaming[host]:
+                del self.host_streaming[host]
+
+        return release_stream
+
+    async def _wait(self, host: str, priority: int):
+        if self.host_queued.get(host, 0) >= self.max_queued_per_host:
+            self._shed_or_reject(host, priority, [w for w in self._waiters if w.host == host], 'host queue full')
+        if len(self._waiters) >= self.max_queued:
+            self._shed_or_reject(host, priority, self._waiters, 'queue full')
+        self._seq += 1
+        waiter = _Waiter(priority, self._seq, host, asyncio.get_running_loop().create_future())
+        insort(self._waiters, waiter)
+        self.host_queued[host] += 1
+        self.counters['queued'] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except BaseException as exc:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                # Granted just as we gave up: hand the slot on
+                self._release(host)
+            else:
+                self._forget(waiter)
+                if not waiter.future.done():
+                    waiter.future.cancel()
+            if isinstance(exc, asyncio.TimeoutError):
+                self.counters['timed_out'] += 1
+                raise UpstreamOverloaded(host, 'queue deadline exceeded', self.retry_after()) from None
+            raise
+
+    def _shed_or_reject(self, host: str, priority: int, candidates: List[_Waiter], reason: str):
+        victim = max(candidates, default=None)
+        if victim is None or victim.priority <= priority:
+            self.counters['rejected'] += 1
+            raise UpstreamOverloaded(host, reason, self.retry_after())
+        # A more urgent request displaces the least urgent waiter
+        self._forget(victim)
+        victim.future.set_exception(UpstreamOverloaded(victim.host, f'{reason}, displaced', self.retry_after()))
+        self.counters['displaced'] += 1
+
+    def _forget(self, waiter: _Waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            self.host_queued[waiter.host] -= 1
+            if not self.host_queued[waiter.host]:
+                del self.host_queued[waiter.host]
+
+    def _dispatch(self):
+        index = 0
+        while index < len(self._waiters) and self.in_flight < self.max_in_flight:
+            waiter = self._waiters[index]
+            if self.host_in_flight.get(waiter.host, 0) >= self.max_per_host:
+                index += 1
+                continue
+            self._forget(waiter)
+            if waiter.future.done():
+                continue
+            self._grant(waiter.host)
+            waiter.future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            **{name: self.counters[name] for name in (
+                'queued', 'timed_out', 'rejected', 'displaced', 'handed_off', 'hand_off_full',
+            )},
+            "admitted": {name: self.counters[f'admitted_{name}'] for name in PRIORITY_NAMES},
+            "in_flight": self.in_flight,
+            "queued_now": len(self._waiters),
+            "max_in_flight": self.max_in_flight,
+            "max_per_host": self.max_per_host,
+            "max_queued": self.max_queued,
+            "max_queued_per_host": self.max_queued_per_host,
+            "queue_timeout": self.queue_timeout,
+            "max_streams_per_host": self.max_streams_per_host,
+            "retry_after": self.retry_after(),
+            "hosts": {
+                host: {
+                    "in_flight": self.host_in_flight.get(host, 0),
+                    "queued": self.host_queued.get(host, 0),
+                    "streaming": self.host_streaming.get(host, 0),
+                }
+                for host in sorted(set(self.host_in_flight) | set(self.host_queued) | set(self.host_streaming))
+            },
+        }
+
+
+class _HostBreaker:
+    __slots__ = ('state', 'samples', 'open_until', 'open_duration', 'probes', 'times_opened',
+                 'rejected', 'last_error')
+
+    def __init__(self, max_samples: int, open_duration: float):
+        self.state = 'closed'
+        self.samples: deque = deque(maxlen=max_samples)  # [time, latency, failed]
+        self.open_until = 0.0
+        self.open_duration = open_duration
+        self.probes = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+
+
+class CircuitBreakers:
+    """Per-host circuit breakers over rolling error-rate and latency windows.
+
+    A host's breaker opens when, over the last ``window`` seconds and at
+    least ``min_requests`` requests, the share of failures (transport errors,
+    also while reading the body, and 5xx) or of calls slower than
+    ``slow_call`` seconds to their headers reaches its
+    threshold. While open, requests fail at once with ``UpstreamUnavailable``
+    instead of waiting out the timeout. After ``open_duration`` a limited
+    number of half-open probes go through: a success closes the breaker, a
+    failure reopens it for twice as long (up to ``max_open_duration``).
+    """
+
+    def __init__(
+        self,
+        window: float = 30.0,
+        min_requests: int = 10,
+        failure_rate: float = 0.5,
+        slow_call: float = 10.0,
+        slow_rate: float = 0.8,
+        open_duration: float = 15.0,
+        max_open_duration: float = 120.0,
+        half_open_probes: int = 1,
+        max_samples: int = 500,
+    ):
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_duration = open_duration
+        self.max_open_duration = max_open_duration
+        self.half_open_probes = half_open_probes
+        self.max_samples = max_samples
+        self._hosts: Dict[str, _HostBreaker] = {}
+
+    def _breaker(self, host: str) -> _HostBreaker:
+        breaker = self._hosts.get(host)
+        if breaker is None:
+            breaker = self._hosts[host] = _HostBreaker(self.max_samples, self.open_duration)
+        return breaker
+
+    def before_request(self, host: str) -> bool:
+        """Admit a request to ``host``; returns whether it is a half-open probe"""
+        breaker = self._breaker(host)
+        if breaker.state == 'closed':
+            return False
+        now = time.monotonic()
+        if breaker.state == 'open' and now >= breaker.open_until:
+            breaker.state = 'half_open'
+        if breaker.state == 'half_open' and breaker.probes < self.half_open_probes:
+            breaker.probes += 1
+            return True
+        breaker.rejected += 1
+        retry_after = max(1, math.ceil(breaker.open_until - now))
+        raise UpstreamUnavailable(host, 'circuit open', retry_after)
+
+    def record(self, host: str, probe: bool, latency: float, error: Optional[str]) -> list:
+        """Outcome of an admitted request; ``error`` is None on success.
+
+        Returns the recorded sample, for ``record_body_error``.
+        """
+        breaker = self._breaker(host)
+        now = time.monotonic()
+        if probe:
+            breaker.probes -= 1
+        sample = [now, latency, error is not None]
+        breaker.samples.append(sample)
+        if error is not None:
+            breaker.last_error = error
+        if breaker.state == 'half_open' and probe:
+            if error is None and latency < self.slow_call:
+                breaker.state = 'closed'
+                breaker.open_duration = self.open_duration
+                breaker.samples.clear()
+            else:
+                self._open(breaker, now, min(self.max_open_duration, breaker.open_duration * 2))
+            return sample
+        self._check(breaker, now)
+        return sample
+
+    def record_body_error(self, host: str, sample: list, error: str):
+        """Turn a request recorded as a success at its headers into a failure of its body"""
+        if sample[2]:
+            return
+        breaker = self._breaker(host)
+        sample[2] = True
+        breaker.last_error = error
+        self._check(breaker, time.monotonic())
+
+    def _check(self, breaker: _HostBreaker, now: float):
+        """Open a closed breaker whose window crossed a threshold"""
+        if breaker.state != 'closed':
+            return
+        total, failures, slow = self._window(breaker, now)
+        if total >= self.min_requests and (
+            failures / total >= self.failure_rate or slow / total >= self.slow_rate
+        ):
+            self._open(breaker, now, self.open_duration)
+
+    def cancelled(self, host: str, probe: bool):
+        """An admitted request ended without an outcome (e.g. the caller went away)"""
+        if probe:
+            self._breaker(host).probes -= 1
+
+    def _open(self, breaker: _HostBreaker, now: float, duration: float):
+        breaker.state = 'open'
+        breaker.open_duration = duration
+        breaker.open_until = now + duration
+        breaker.times_opened += 1
+
+    def _window(self, breaker: _HostBreaker, now: float) -> tuple:
+        while breaker.samples and breaker.samples[0][0] < now - self.window:
+            breaker.samples.popleft()
+        failures = sum(1 for _, _, failed in breaker.samples if failed)
+        slow = sum(1 for _, latency, _ in breaker.samples if latency >= self.slow_call)
+        return len(breaker.samples), failures, slow
+
+    def state(self, host: str) -> str:
+        breaker = self._hosts.get(host)
+        return breaker.state if breaker is not None else 'closed'
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        hosts = {}
+        for host, breaker in sorted(self._hosts.items()):
+            total, failures, slow = self._window(breaker, now)
+            latencies = sorted(latency for _, latency, _ in breaker.samples)
+            hosts[host] = {
+                "state": breaker.state,
+                "requests": total,
+                "error_rate": round(failures / total, 3) if total else 0.0,
+                "slow_rate": round(slow / total, 3) if total else 0.0,
+                "p50_latency": round(latencies[len(latencies) // 2], 4) if latencies else None,
+                "p99_latency": round(latencies[int(len(latencies) * 0.99)], 4) if latencies else None,
+                "retry_in": round(max(0.0, breaker.open_until - now), 1) if breaker.state == 'open' else 0.0,
+                "times_opened": breaker.times_opened,
+                "rejected": breaker.rejected,
+                "last_error": breaker.last_error,
+            }
+        return {
+            "window": self.window,
+            "min_requests": self.min_requests,
+            "failure_rate": self.failure_rate,
+            "slow_call": self.slow_call,
+            "slow_rate": self.slow_rate,
+            "hosts": hosts,
+        }
+
+
+class UpstreamClientManager:
+    """Application-lifetime pooled HTTP client shared by every proxy endpoint.
+
+    Keeps TCP/TLS connections alive between requests, negotiates HTTP/2 when
+    available and admits requests through an ``AdmissionController`` that
+    caps in-flight requests per host and overall. Hosts whose circuit
+    breaker is open are failed fast.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 200,
+        max_keepalive_connections: int = 50,
+        max_connections_per_host: int = 20,
+        keepalive_expiry: float = 30.0,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 30.0,
+        http2: bool = True,
+        admission: Optional[AdmissionController] = None,
+        breakers: Optional[CircuitBreakers] = None,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._client: Optional[httpx.AsyncClient] = None
+        self.admission = admission or AdmissionController(max_per_host=max_connections_per_host)
+        self.breakers = breakers or CircuitBreakers()
+
+    def timeout(self, read: Optional[float] = None) -> httpx.Timeout:
+        read = self.read_timeout if read is None else read
+        return httpx.Timeout(read, connect=min(self.connect_timeout, read))
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            http2=self.http2,
+            follow_redirects=True,
+            timeout=self.timeout(),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+        )
+
+    async def start(self):
+        if self._client is None:
+            self._client = self._build_client()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # Startup hook has not run (e.g. app used without lifespan events)
+            self._client = self._build_client()
+        return self._client
+
+    async def open(
+        self,
+        url: str,
+        headers: Optional[dict] = None,
+        timeout: Optional[float] = None,
+        follow_redirects: bool = True,
+        priority: Optional[int] = None,
+    ) -> httpx.Response:
+        """Send a GET and return as soon as the response headers arrive.
+
+        The body is left unread; the caller must consume it or call
+        ``aclose()``, which also frees the admission slot. ``priority``
+        defaults to a guess from the URL (see ``request_priority``).
+        Raises ``UpstreamUnavailable`` when the host's circuit is open and
+        ``UpstreamOverloaded`` when the request cannot be admitted.
+        """
+        host = urlparse(url).hostname or ''
+        if priority is None:
+            priority = request_priority(url, headers)
+        probe = self.breakers.before_request(host)
+        queued_at = time.perf_counter()
+        try:
+            release = await self.admission.acquire(host, priority)
+        except BaseException:
+            self.breakers.cancelled(host, probe)
+            raise
+        queued = time.perf_counter() - queued_at
+
+        trace = _UpstreamTrace() if metrics.enabled else None
+        started = time.monotonic()
+        try:
+            request = self.client.build_request(
+                "GET", url, headers=headers, timeout=self.timeout(timeout),
+                extensions={"trace": trace} if trace is not None else None,
+            )
+            response = await self.client.send(
+                request, stream=True, follow_redirects=follow_redirects
+            )
+        except BaseException as exc:
+            release()
+            if isinstance(exc, httpx.TransportError):
+                self.breakers.record(host, probe, time.monotonic() - started, type(exc).__name__)
+            else:
+                self.breakers.cancelled(host, probe)
+            if trace is not None:
+                metrics.observe_upstream(host, '', queued, trace.stages)
+            raise
+        sample = self.breakers.record(
+            host, probe, time.monotonic() - started,
+            f"HTTP {response.status_code}" if response.status_code >= 500 else None,
+        )
+        content_type = media_type(response.headers.get('content-type'))
+        if trace is not None:
+            metrics.observe_upstream(host, content_type, queued, trace.stages)
+        if priority >= PRIORITY_BULK:
+            # Long bodies of low-priority fetches must not hold slots interactive ones queue for
+            release = self.admission.hand_off(host, release)
+        response.stream = _SlotReleasingStream(
+            response.stream, release, host, content_type,
+            on_error=lambda error: self.breakers.record_body_error(host, sample, error),
+        )
+        return response
+
+    async def get(
+        self,
+        url: str,
+        headers: Optional[dict] = None,
+        timeout: Optional[float] = None,
+        follow_redirects: bool = True,
+        priority: Optional[int] = None,
+    ) -> httpx.Response:
+        response = await self.open(
+            url, headers=headers, timeout=timeout, follow_redirects=follow_redirects, priority=priority
+        )
+        try:
+            await response.aread()
+        finally:
+            await response.aclose()
+        return response
+
+    def stats(self) -> dict:
+        """Active/idle pooled connections and in-flight requests per host"""
+        hosts: Dict[str, dict] = defaultdict(lambda: {"active": 0, "idle": 0, "in_flight": 0})
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        for conn in getattr(pool, "connections", []):
+            origin = getattr(conn, "_origin", None)
+            host = origin.host.decode() if origin is not None else "unknown"
+            hosts[host]["idle" if conn.is_idle() else "active"] += 1
+        for host, count in self.admission.host_in_flight.items():
+            hosts[host]["in_flight"] = count
+        return {
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self.max_keepalive_connections,
+            "max_connections_per_host": self.max_connections_per_host,
+            "hosts": dict(hosts),
+            "admission": self.admission.stats(),
+        }
+
+
+upstream_pool = UpstreamClientManager(
+    max_connections=int(os.environ.get('UPSTREAM_MAX_CONNECTIONS', 200)),
+    max_keepalive_connections=int(os.environ.get('UPSTREAM_MAX_KEEPALIVE', 50)),
+    max_connections_per_host=int(os.environ.get('UPSTREAM_MAX_PER_HOST', 20)),
+    keepalive_expiry=float(os.environ.get('UPSTREAM_KEEPALIVE_EXPIRY', 30.0)),
+    connect_timeout=float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 10.0)),
+    read_timeout=float(os.environ.get('UPSTREAM_READ_TIMEOUT', 30.0)),
+    http2=os.environ.get('UPSTREAM_HTTP2', 'true').lower() == 'true',
+    breakers=CircuitBreakers(
+        window=float(os.environ.get('BREAKER_WINDOW', 30.0)),
+        min_requests=int(os.environ.get('BREAKER_MIN_REQUESTS', 10)),
+        failure_rate=float(os.environ.get('BREAKER_FAILURE_RATE', 0.5)),
+        slow_call=float(os.environ.get('BREAKER_SLOW_CALL', 10.0)),
+        slow_rate=float(os.environ.get('BREAKER_SLOW_RATE', 0.8)),
+        open_duration=float(os.environ.get('BREAKER_OPEN_SECONDS', 15.0)),
+        max_open_duration=float(os.environ.get('BREAKER_MAX_OPEN_SECONDS', 120.0)),
+    ),
+    admission=AdmissionController(
+        max_in_flight=int(os.environ.get('UPSTREAM_MAX_IN_FLIGHT', 100)),
+        max_per_host=int(os.environ.get('UPSTREAM_MAX_PER_HOST', 20)),
+        max_queued=int(os.environ.get('UPSTREAM_MAX_QUEUED', 500)),
+        max_queued_per_host=int(os.environ.get('UPSTREAM_MAX_QUEUED_PER_HOST', 100)),
+        queue_timeout=float(os.environ.get('UPSTREAM_QUEUE_TIMEOUT', 5.0)),
+        max_streams_per_host=int(os.environ.get('UPSTREAM_MAX_STREAMS_PER_HOST', 20)),
+    ),
+)
+
+
+# Shared HTTP response cache
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    directives: Dict[str, Optional[str]] = {}
+    for part in (value or '').split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def freshness_lifetime(headers: httpx.Headers) -> Optional[float]:
+    """Seconds a response stays fresh in a shared cache, or None if it must not be stored"""
+    cc = parse_cache_control(headers.get('cache-control'))
+    if 'no-store' in cc or 'private' in cc:
+        return None
+    if 'no-cache' in cc:
+        return 0.0
+    age = float(headers['age']) if headers.get('age', '').isdigit() else 0.0
+    for directive in ('s-maxage', 'max-age'):
+        if cc.get(directive) and cc[directive].isdigit():
+            return max(0.0, int(cc[directive]) - age)
+    try:
+        date = parsedate_to_datetime(headers['date']) if 'date' in headers else None
+    except (TypeError, ValueError):
+        date = None
+    now = date or datetime.now(timezone.utc)
+    if 'expires' in headers:
+        try:
+            return max(0.0, (parsedate_to_datetime(headers['expires']) - now).total_seconds() - age)
+        except (TypeError, ValueError):
+            return 0.0
+    if 'last-modified' in headers:
+        # Heuristic freshness: 10% of the time since last modification, capped at a day
+        try:
+            since = (now - parsedate_to_datetime(headers['last-modified'])).total_seconds()
+            return max(0.0, min(since / 10, 86400.0))
+        except (TypeError, ValueError):
+            return 0.0
+    return 0.0
+
+
+class CacheEntry:
+    """A stored upstream response; the body lives in memory or in a disk file"""
+
+    __slots__ = ('key', 'status_code', 'headers', 'body', 'path', 'size', 'expires_at', 'variants')
+
+    def __init__(self, key, status_code, headers, body, path, size, lifetime):
+        self.key = key
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.path = path
+        self.size = size
+        self.expires_at = time.time() + lifetime
+        # Precompressed copies of an identity body, by content coding (None: not worth it)
+        self.variants: Dict[str, Optional[bytes]] = {}
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    @property
+    def footprint(self) -> int:
+        return self.size + sum(len(variant) for variant in self.variants.values() if variant)
+
+    def header(self, name: str) -> Optional[str]:
+        return next((value for key, value in self.headers if key == name), None)
+
+    def validators(self) -> dict:
+        headers = {}
+        for name, value in self.headers:
+            if name == 'etag':
+                headers['If-None-Match'] = value
+            elif name == 'last-modified':
+                headers['If-Modified-Since'] = value
+        return headers
+
+
+class _FileByteStream(httpx.AsyncByteStream):
+    """Reads a cached body from an already-open file without blocking the loop"""
+
+    def __init__(self, handle, chunk_size: int = 65536):
+        self._handle = handle
+        self._chunk_size = chunk_size
+
+    async def __aiter__(self):
+        try:
+            while True:
+                chunk = await asyncio.to_thread(self._handle.read, self._chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self._handle.close()
+
+    async def aclose(self):
+        self._handle.close()
+
+
+class _CacheFillingStream(httpx.AsyncByteStream):
+    """Tees a raw upstream body into the cache while it is forwarded.
+
+    Bodies that outgrow the memory entry limit spill to a file in the disk
+    tier; anything larger than the disk limit, or not read to the end, is
+    dropped.
+    """
+
+    def __init__(self, stream, cache, key, status_code, headers, lifetime):
+        self._stream = stream
+        self._cache = cache
+        self._key = key
+        self._status_code = status_code
+        self._headers = headers
+        self._lifetime = lifetime
+        self._chunks: List[bytes] = []
+        self._size = 0
+        self._file = None
+        self._path: Optional[Path] = None
+        self._abandoned = False
+
+    async def _spill(self, chunk: bytes):
+        if self._file is None:
+            self._path = self._cache.disk_path(self._key, temporary=True)
+            self._file = open(self._path, 'wb')
+            pending, self._chunks = b''.join(self._chunks), []
+            await asyncio.to_thread(self._file.write, pending)
+        await asyncio.to_thread(self._file.write, chunk)
+
+    def _abandon(self):
+        self._abandoned = True
+        self._chunks = []
+        if self._file is not None:
+            self._file.close()
+            self._path.unlink(missing_ok=True)
+            self._file = None
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            if not self._abandoned:
+                self._size += len(chunk)
+                if self._size <= self._cache.max_entry_bytes and self._file is None:
+                    self._chunks.append(chunk)
+                elif self._cache.disk_enabled and self._size <= self._cache.disk_max_entry_bytes:
+                    await self._spill(chunk)
+                else:
+                    self._abandon()
+            yield chunk
+        if not self._abandoned:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._cache.store(self._key, self._status_code, self._headers,
+                                  None, self._path, self._size, self._lifetime)
+            else:
+                self._cache.store(self._key, self._status_code, self._headers,
+                                  b''.join(self._chunks), None, self._size, self._lifetime)
+            self._abandoned = True
+
+    async def aclose(self):
+        if not self._abandoned:
+            self._abandon()
+        await self._stream.aclose()
+
+
+class ResponseCache:
+    """Shared cache for proxied upstream responses.
+
+    Honors Cache-Control/Expires freshness, revalidates stale entries with
+    ETag/Last-Modified conditional GETs and bounds memory with size-aware
+    LRU eviction. Bodies too large for memory go to a disk-backed tier.
+    Bodies are stored exactly as received (still content-encoded).
+    """
+
+    _UNSTORED_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'set-cookie', 'x-cache'}
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_entry_bytes: int = 4 * 1024 * 1024,
+        disk_dir: Optional[Path] = None,
+        disk_max_bytes: int = 2 * 1024 * 1024 * 1024,
+        disk_max_entry_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_max_entry_bytes = disk_max_entry_bytes
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._disk: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.counters: Dict[str, int] = defaultdict(int)
+        self._change_listeners = []
+
+    @property
+    def disk_enabled(self) -> bool:
+        return self.disk_dir is not None
+
+    def start(self):
+        if self.disk_enabled:
+            # The index is not persisted, so files from a previous run are orphans
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            for path in self.disk_dir.glob('*.body*'):
+                path.unlink(missing_ok=True)
+
+    def on_change(self, callback):
+        """Register ``callback(key)`` for when revalidation finds a changed upstream body"""
+        self._change_listeners.append(callback)
+
+    def _notify_change(self, key: str):
+        for callback in self._change_listeners:
+            callback(key)
+
+    def disk_path(self, key: str, temporary: bool = False) -> Path:
+        name = hashlib.sha256(key.encode()).hexdigest() + '.body'
+        if temporary:
+            name += f'.{uuid.uuid4().hex}.tmp'
+        return self.disk_dir / name
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        for tier in (self._memory, self._disk):
+            entry = tier.get(key)
+            if entry is not None:
+                tier.move_to_end(key)
+                return entry
+        return None
+
+    def store(self, key, status_code, headers, body, path, size, lifetime):
+        previous = self._memory.get(key) or self._disk.get(key)
+        self._discard(key)
+        stored_headers = [
+            (name, value) for name, value in headers.items()
+            if name not in self._UNSTORED_HEADERS
+        ]
+        if path is not None:
+            final_path = self.disk_path(key)
+            os.replace(path, final_path)
+            entry = CacheEntry(key, status_code, stored_headers, None, final_path, size, lifetime)
+            self._disk[key] = entry
+            self.disk_bytes += size
+        else:
+            entry = CacheEntry(key, status_code, stored_headers, body, None, size, lifetime)
+            self._memory[key] = entry
+            self.memory_bytes += size
+        self.counters['stores'] += 1
+        self.counters['bytes_stored'] += size
+        self._evict()
+        if previous is not None and previous.validators() != entry.validators():
+            self._notify_change(key)
+
+    def _discard(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self.memory_bytes -= entry.footprint
+        entry = self._disk.pop(key, None)
+        if entry is not None:
+            self.disk_bytes -= entry.size
+            entry.path.unlink(missing_ok=True)
+
+    def _evict(self):
+        while self.memory_bytes > self.max_bytes and self._memory:
+            _, entry = self._memory.popitem(last=False)
+            self.memory_bytes -= entry.footprint
+            self.counters['evictions'] += 1
+        while self.disk_bytes > self.disk_max_bytes and self._disk:
+            _, entry = self._disk.popitem(last=False)
+            self.disk_bytes -= entry.size
+            entry.path.unlink(missing_ok=True)
+            self.counters['evictions'] += 1
+
+    def revalidated(self, entry: CacheEntry, headers: httpx.Headers):
+        """Refresh a stale entry after the upstream answered 304 Not Modified"""
+        lifetime = freshness_lifetime(headers)
+        if lifetime is None:
+            self._discard(entry.key)
+            self._notify_change(entry.key)
+            return
+        updated = dict(entry.headers)
+        for name in ('etag', 'last-modified', 'cache-control', 'expires', 'date'):
+            if name in headers:
+                updated[name] = headers[name]
+        entry.headers = list(updated.items())
+        entry.expires_at = time.time() + lifetime
+
+    async def compressed_variant(self, entry: CacheEntry, accept_encoding: Optional[str]) -> Optional[str]:
+        """Make sure a precompressed copy of a memory entry exists for the client.
+
+        Only identity-encoded, compressible, non-HTML bodies qualify (HTML is
+        rewritten, so its bytes never reach the client as stored). Returns the
+        content coding to serve, or None to serve the stored body.
+        """
+        encoding = negotiate_encoding(accept_encoding)
+        if (
+            encoding is None or entry.body is None or entry.status_code != 200
+            or entry.size < COMPRESSION_MIN_SIZE or entry.header('content-encoding')
+        ):
+            return None
+        content_type = entry.header('content-type')
+        if not is_compressible(content_type) or media_type(content_type) == 'text/html':
+            return None
+        if encoding not in entry.variants:
+            variant = await asyncio.to_thread(
+                compress_bytes, entry.body, encoding, CACHED_COMPRESSION_LEVELS[encoding]
+            )
+            if encoding in entry.variants:
+                pass  # a concurrent request compressed it first
+            elif len(variant) < entry.size:
+                entry.variants[encoding] = variant
+                self.counters['variant_compressions'] += 1
+                if self._memory.get(entry.key) is entry:
+                    self.memory_bytes += len(variant)
+                    self._evict()
+            else:
+                entry.variants[encoding] = None
+        return encoding if entry.variants.get(encoding) else None
+
+    def serve(self, entry: CacheEntry, state: str, encoding: Optional[str] = None) -> Optional[httpx.Response]:
+        """Build an unread httpx.Response from a cache entry, or from its ``encoding`` variant"""
+        headers = entry.headers
+        size = entry.size
+        if encoding is not None:
+            body = entry.variants[encoding]
+            size = len(body)
+            stream = httpx.ByteStream(body)
+            headers = [(name, value) for name, value in headers if name != 'content-length'] + [
+                ('content-length', str(size)), ('content-encoding', encoding),
+            ]
+            self.counters['variant_hits'] += 1
+        elif entry.path is not None:
+            try:
+                stream = _FileByteStream(open(entry.path, 'rb'))
+            except FileNotFoundError:
+                self._discard(entry.key)
+                return None
+        else:
+            stream = httpx.ByteStream(entry.body)
+        self.counters[{'HIT': 'hits', 'REVALIDATED': 'revalidated', 'STALE': 'stale'}[state]] += 1
+        self.counters['bytes_served'] += size
+        response = httpx.Response(
+            entry.status_code,
+            headers=headers + [('x-cache', state)],
+            stream=stream,
+            request=httpx.Request('GET', entry.key),
+        )
+        return response
+
+    def fill(self, key: str, response: httpx.Response):
+        """Tee a fresh upstream response into the cache if it is storable"""
+        self.counters['misses'] += 1
+        response.headers['x-cache'] = 'MISS'
+        if response.status_code != 200:
+            return
+        vary = response.headers.get('vary', '').lower()
+        if vary and vary.replace(' ', '') not in ('accept-encoding', 'origin', 'accept-encoding,origin'):
+            return
+        lifetime = freshness_lifetime(response.headers)
+        if lifetime is None:
+            return
+        if lifetime == 0 and 'etag' not in response.headers and 'last-modified' not in response.headers:
+            return
+        length = response.headers.get('content-length', '')
+        limit = self.disk_max_entry_bytes if self.disk_enabled else self.max_entry_bytes
+        if length.isdigit() and int(length) > limit:
+            return
+        response.stream = _CacheFillingStream(
+            response.stream, self, key, response.status_code, response.headers, lifetime
+        )
+
+    def stats(self) -> dict:
+        return {
+            **{name: self.counters[name] for name in (
+                'hits', 'misses', 'revalidated', 'stale', 'stores', 'evictions',
+                'bytes_served', 'bytes_stored', 'variant_compressions', 'variant_hits',
+            )},
+            "memory_entries": len(self._memory),
+            "memory_bytes": self.memory_bytes,
+            "memory_max_bytes": self.max_bytes,
+            "disk_enabled": self.disk_enabled,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self.disk_bytes,
+            "disk_max_bytes": self.disk_max_bytes,
+        }
+
+
+response_cache = ResponseCache(
+    max_bytes=int(os.environ.get('PROXY_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    max_entry_bytes=int(os.environ.get('PROXY_CACHE_MAX_ENTRY_BYTES', 4 * 1024 * 1024)),
+    disk_dir=(
+        Path(os.environ.get('PROXY_CACHE_DIR', Path(tempfile.gettempdir()) / 'betterplay-proxy-cache'))
+        if os.environ.get('PROXY_CACHE_DISK', 'true').lower() == 'true' else None
+    ),
+    disk_max_bytes=int(os.environ.get('PROXY_CACHE_DISK_MAX_BYTES', 2 * 1024 * 1024 * 1024)),
+    disk_max_entry_bytes=int(os.environ.get('PROXY_CACHE_DISK_MAX_ENTRY_BYTES', 512 * 1024 * 1024)),
+)
+
+# Endpoints whose upstream fetches go through the response cache
+CACHED_ENDPOINTS = set(
+    os.environ.get(
+        'PROXY_CACHE_ENDPOINTS',
+        'proxy_website,proxy_direct,gnmath_proxy,smart_proxy,gn_math_proxy',
+    ).split(',')
+)
+
+
+# Request coalescing (single-flight)
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL for cache and coalescing keys"""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parts.port}"
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+
+class _Flight:
+    """One in-flight upstream GET whose raw body is fanned out to every reader"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: Optional[asyncio.Task] = None
+        self.chunks: List[bytes] = []
+        self.offset = 0
+        self.buffered = 0
+        self.held = 0
+        self.joinable = True
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.readers: set = set()
+        self._changed = asyncio.Event()
+        self._drained = asyncio.Event()
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+    async def wait_drained(self):
+        await self._drained.wait()
+
+    def trim(self):
+        # Once nobody else can join, chunks every reader has passed can go
+        if self.joinable or not self.readers:
+            return
+        low = min(reader.position for reader in self.readers)
+        if low > self.offset:
+            self.held -= sum(len(chunk) for chunk in self.chunks[:low - self.offset])
+            del self.chunks[:low - self.offset]
+            self.offset = low
+            self._drained.set()
+            self._drained = asyncio.Event()
+
+
+class _FlightStream(httpx.AsyncByteStream):
+    """One reader's view of a shared in-flight body"""
+
+    def __init__(self, flight: _Flight, group: "SingleFlight"):
+        self._flight = flight
+        self._group = group
+        self.position = 0
+        self._closed = False
+        flight.readers.add(self)
+
+    async def __aiter__(self):
+        flight = self._flight
+        try:
+            while True:
+                index = self.position - flight.offset
+                if index < len(flight.chunks):
+                    chunk = flight.chunks[index]
+                    self.position += 1
+                    flight.trim()
+                    yield chunk
+                elif flight.error is not None:
+                    raise flight.error
+                elif flight.done:
+                    break
+                else:
+                    await flight.wait()
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._group.leave(self._flight, self)
+
+
+class SingleFlight:
+    """Collapses concurrent identical upstream GETs into one request.
+
+    The first caller for a key starts a background fetch; every caller,
+    including the first, reads the response through its own stream replaying
+    the shared chunks. New callers may join while the buffered body is below
+    ``join_limit`` bytes, so very large downloads are not held in memory.
+    After that the fetch reads at most ``read_ahead`` bytes past the slowest
+    reader, pausing the upstream until it catches up.
+    """
+
+    def __init__(self, join_limit: int = 8 * 1024 * 1024, read_ahead: int = 1024 * 1024):
+        self.join_limit = join_limit
+        self.read_ahead = read_ahead
+        self._flights: Dict[str, _Flight] = {}
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    async def fetch(self, key: str, opener) -> httpx.Response:
+        flight = self._flights.get(key)
+        if flight is not None and flight.joinable:
+            self.counters['collapsed'] += 1
+        else:
+            flight = _Flight(key)
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(flight, opener))
+            self.counters['flights'] += 1
+        stream = _FlightStream(flight, self)
+        try:
+            status_code, headers = await asyncio.shield(flight.ready)
+        except BaseException:
+            await stream.aclose()
+            raise
+        return httpx.Response(
+            status_code, headers=headers, stream=stream, request=httpx.Request('GET', key)
+        )
+
+    async def _run(self, flight: _Flight, opener):
+        response = None
+        try:
+            response = await opener()
+            flight.ready.set_result((response.status_code, response.headers.multi_items()))
+            async for chunk in response.stream:
+                flight.chunks.append(chunk)
+                flight.buffered += len(chunk)
+                flight.held += len(chunk)
+                if flight.joinable and flight.buffered > self.join_limit:
+                    self._close_joining(flight)
+                flight.notify()
+                if not flight.joinable and flight.held > self.read_ahead:
+                    self.counters['paused'] += 1
+                    while flight.readers and flight.held > self.read_ahead:
+                        await flight.wait_drained()
+            flight.done = True
+        except asyncio.CancelledError:
+            if not flight.ready.done():
+                flight.ready.cancel()
+            flight.error = ConnectionError("upstream fetch cancelled")
+            raise
+        except Exception as exc:
+            if not flight.ready.done():
+                flight.ready.set_exception(exc)
+                flight.ready.exception()  # mark retrieved so waiter-less failures don't warn
+            flight.error = exc
+        finally:
+            self._close_joining(flight)
+            flight.notify()
+            if response is not None:
+                # Let the connection go back to the pool even if we were cancelled
+                await asyncio.shield(response.aclose())
+
+    def _close_joining(self, flight: _Flight):
+        flight.joinable = False
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        flight.trim()
+
+    def leave(self, flight: _Flight, stream: _FlightStream):
+        flight.readers.discard(stream)
+        if not flight.readers:
+            # Every client went away; stop downloading for nobody
+            self._close_joining(flight)
+            if not flight.done and flight.task is not None and not flight.task.done():
+                flight.task.cancel()
+        else:
+            flight.trim()
+
+    def stats(self) -> dict:
+        return {
+            "flights": self.counters['flights'],
+            "collapsed": self.counters['collapsed'],
+            "paused": self.counters['paused'],
+            "in_flight": len(self._flights),
+        }
+
+
+single_flight = SingleFlight(
+    join_limit=int(os.environ.get('SINGLE_FLIGHT_JOIN_LIMIT', 8 * 1024 * 1024)),
+    read_ahead=int(os.environ.get('SINGLE_FLIGHT_READ_AHEAD', 1024 * 1024)),
+)
+
+
+async def _open_through_cache(
+    key: str, url: str, headers: dict, timeout: Optional[float], use_cache: bool,
+    priority: Optional[int] = None,
+) -> httpx.Response:
+    """Open an upstream GET, revalidating a stale cache entry and teeing the body into the cache"""
+    if not use_cache:
+        return await upstream_pool.open(url, headers=headers, timeout=timeout, priority=priority)
+
+    entry = response_cache.lookup(key)
+    if entry is not None and entry.fresh:
+        cached = response_cache.serve(entry, 'HIT')
+        if cached is not None:
+            return cached
+        entry = None
+
+    conditional = dict(headers, **entry.validators()) if entry is not None else headers
+    response = await upstream_pool.open(url, headers=conditional, timeout=timeout, priority=priority)
+    if entry is not None and response.status_code >= 500:
+        # stale-if-error: an old copy beats an upstream error page
+        stale = response_cache.serve(entry, 'STALE')
+        if stale is not None:
+            await response.aclose()
+            return stale
+    if entry is not None and response.status_code == 304:
+        await response.aclose()
+        response_cache.revalidated(entry, response.headers)
+        cached = response_cache.serve(entry, 'REVALIDATED')
+        if cached is not None:
+            return cached
+        response = await upstream_pool.open(url, headers=headers, timeout=timeout, priority=priority)
+    response_cache.fill(key, response)
+    return response
+
+
+async def fetch_upstream(
+    url: str,
+    headers: Optional[dict] = None,
+    timeout: Optional[float] = None,
+    endpoint: Optional[str] = None,
+    accept_encoding: Optional[str] = None,
+    priority: Optional[int] = None,
+) -> httpx.Response:
+    """GET through the shared response cache, request coalescing and pooled client.
+
+    Returns an unread response like ``UpstreamClientManager.open()``. Fresh
+    cache hits are served directly, as a precompressed variant when
+    ``accept_encoding`` (the client's header) allows; anything that needs the
+    network joins (or starts) a single-flight fetch for the same normalized
+    URL and range. ``priority`` is passed to upstream admission. When the
+    upstream cannot be reached (open circuit, overload, transport error) a
+    stale cached copy is served if there is one, marked ``x-cache: STALE``.
+    """
+    headers = dict(headers or {})
+    key = normalize_url(url)
+    metrics.set_upstream_host(urlsplit(url).hostname or '')
+    byte_range = next((value for name, value in headers.items() if name.lower() == 'range'), None)
+    use_cache = endpoint in CACHED_ENDPOINTS and byte_range is None
+
+    if use_cache:
+        entry = response_cache.lookup(key)
+        if entry is not None and entry.fresh:
+            encoding = await response_cache.compressed_variant(entry, accept_encoding)
+            cached = response_cache.serve(entry, 'HIT', encoding)
+            if cached is not None:
+                return cached
+
+    flight_key = key if byte_range is None else f"{key} range={byte_range}"
+    try:
+        return await single_flight.fetch(
+            flight_key, lambda: _open_through_cache(key, url, headers, timeout, use_cache, priority)
+        )
+    except (UpstreamUnavailable, httpx.TransportError):
+        entry = response_cache.lookup(key) if use_cache else None
+        stale = response_cache.serve(entry, 'STALE') if entry is not None else None
+        if stale is None:
+            raise
+        return stale
+
+
+# Streaming passthrough for non-HTML upstream bodies
+FORWARDED_REQUEST_HEADERS = ('range', 'if-range')
+PASSTHROUGH_RESPONSE_HEADERS = (
+    'content-length', 'content-range', 'accept-ranges', 'etag', 'last-modified', 'x-cache'
+)
+
+def forwarded_request_headers(http_request: Request) -> dict:
+    """Client headers worth replaying upstream (byte ranges for media/assets)"""
+    return {
+        name: http_request.headers[name]
+        for name in FORWARDED_REQUEST_HEADERS
+        if name in http_request.headers
+    }
+
+def rewritable_html(response: httpx.Response) -> bool:
+    """Whether a proxied response is a whole HTML page; a 206 slice of one is passed through untouched"""
+    return response.status_code != 206 and 'text/html' in response.headers.get('content-type', 'text/html')
+
+def stream_upstream_response(response: httpx.Response, accept_encoding: str = '') -> StreamingResponse:
+    """Forward an open upstream response to the client chunk by chunk.
+
+    The upstream body is never buffered; when the client disconnects the
+    generator is torn down and the upstream connection is closed. A body that
+    is already compressed in a coding the client accepts is forwarded as-is.
+    """
+    content_type = response.headers.get('content-type', 'application/octet-stream')
+    headers = {
+        name: response.headers[name]
+        for name in PASSTHROUGH_RESPONSE_HEADERS
+        if name in response.headers
+    }
+    content_encoding = response.headers.get('content-encoding', '')
+    passthrough = bool(content_encoding) and encoding_accepted(accept_encoding, content_encoding)
+    if passthrough:
+        headers['content-encoding'] = content_encoding
+        headers['vary'] = 'Accept-Encoding'
+    elif content_encoding:
+        # httpx hands us decoded bytes, so the upstream length no longer applies
+        headers.pop('content-length', None)
+
+    async def body():
+        try:
+            chunks = response.aiter_raw() if passthrough else response.aiter_bytes()
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await response.aclose()
+
+    return StreamingResponse(
+        body(),
+        status_code=response.status_code,
+        headers=headers,
+        media_type=content_type,
+        background=BackgroundTask(response.aclose),
+    )
+
+
+# Single-pass HTML URL rewriting
+class HtmlUrlRewriter:
+    """Rewrites href/src/action URLs of an HTML document in one regex pass.
+
+    Root-relative URLs (``/x``) are resolved against ``base_url``,
+    protocol-relative ones (``//host/x``) get ``https:`` and, when
+    ``relative_base`` is given, plain relative URLs (``img/a.png``) are
+    resolved against it. ``feed()`` accepts successive chunks of a streamed
+    document: a short tail that could be the start of an attribute split
+    across chunks is held back until the next call or ``flush()``.
+
+    ``feed_bytes()`` and ``rewrite_bytes()`` do the same on the raw body of
+    an ASCII-compatible document (see ``ascii_compatible_charset``), so it
+    never has to be decoded and re-encoded.
+    """
+
+    # Anchored on a literal "=" so the regex engine can skip ahead quickly;
+    # the attribute name is checked with look-behinds
+    _ATTR = r'=(?:(?<=href=)|(?<=src=)|(?<=action=))["\']'
+    _ROOT_RE = re.compile(_ATTR + r'//?')
+    _RELATIVE_RE = re.compile(_ATTR + r'(?://?|(?![a-zA-Z][a-zA-Z0-9+.\-]*:|[#"\']))')
+    # Suffix that may continue into a match in the next chunk
+    _TAIL_RE = re.compile(
+        r'(?:(?:href|src|action)=(?:["\'](?:/|[a-zA-Z][a-zA-Z0-9+.\-]*)?)?'
+        r'|h|hr|hre|href|s|sr|src|a|ac|act|acti|actio|action)$'
+    )
+    _TAIL_WINDOW = 64
+    _ROOT_BYTES_RE = re.compile(_ROOT_RE.pattern.encode('ascii'))
+    _RELATIVE_BYTES_RE = re.compile(_RELATIVE_RE.pattern.encode('ascii'))
+    _TAIL_BYTES_RE = re.compile(_TAIL_RE.pattern.encode('ascii'))
+
+    def __init__(self, base_url: str, relative_base: Optional[str] = None):
+        parsed = urlparse(base_url)
+        self.origin = f"{parsed.scheme}://{parsed.netloc}"
+        self.relative_base = relative_base.rstrip('/') + '/' if relative_base else None
+        self._pattern = self._RELATIVE_RE if relative_base else self._ROOT_RE
+        self._bytes_pattern = self._RELATIVE_BYTES_RE if relative_base else self._ROOT_BYTES_RE
+        self._pending = ''
+        self._pending_bytes = b''
+        # A match is only the URL prefix (e.g. `="//`), so its replacement
+        # can be looked up instead of built per match
+        table = {}
+        for mark in ('"', "'"):
+            prefix = f"={mark}"
+            table[prefix + '/'] = f"{prefix}{self.origin}/"
+            table[prefix + '//'] = f"{prefix}https://"
+            if self.relative_base:
+                table[prefix] = f"{prefix}{self.relative_base}"
+        self._replace = lambda match: table[match.group()]
+        # Replacements with non-ASCII characters (an IDN origin, say) would
+        # need the document's charset, so those rewriters only handle text
+        try:
+            self._bytes_table = {
+                prefix.encode('ascii'): replacement.encode('ascii') for prefix, replacement in table.items()
+            }
+        except UnicodeEncodeError:
+            self._bytes_table = None
+
+    @property
+    def bytes_safe(self) -> bool:
+        """Whether ``feed_bytes()``/``rewrite_bytes()`` can be used"""
+        return self._bytes_table is not None
+
+    @property
+    def cache_key(self) -> str:
+        """Identifies the rewrite rules, for memoizing rewritten output"""
+        return f"{self.origin}|{self.relative_base or ''}"
+
+    def feed(self, chunk: str) -> str:
+        """Rewrite the next chunk, returning the text that is safe to emit"""
+        buf = self._pending + chunk
+        tail = self._TAIL_RE.search(buf, max(0, len(buf) - self._TAIL_WINDOW))
+        cut = tail.start() if tail else len(buf)
+        self._pending = buf[cut:]
+        return self._pattern.sub(self._replace, buf[:cut])
+
+    def flush(self) -> str:
+        """Rewrite and return whatever is still held back"""
+        buf, self._pending = self._pending, ''
+        return self._pattern.sub(self._replace, buf)
+
+    def rewrite(self, content: str) -> str:
+        """Rewrite a whole document in one call"""
+        return self.feed(content) + self.flush()
+
+    def feed_bytes(self, chunk: bytes) -> bytes:
+        """``feed()`` for the raw bytes of an ASCII-compatible document"""
+        buf = self._pending_bytes + chunk if self._pending_bytes else chunk
+        tail = self._TAIL_BYTES_RE.search(buf, max(0, len(buf) - self._TAIL_WINDOW))
+        if tail is None:
+            self._pending_bytes = b''
+            return self.rewrite_bytes(buf)
+        self._pending_bytes = buf[tail.start():]
+        return self.rewrite_bytes(memoryview(buf)[:tail.start()])
+
+    def flush_bytes(self) -> bytes:
+        buf, self._pending_bytes = self._pending_bytes, b''
+        return self.rewrite_bytes(buf)
+
+    def rewrite_bytes(self, content) -> bytes:
+        """Rewrite a whole ASCII-compatible document without decoding it.
+
+        Unchanged spans are copied straight from a memoryview of ``content``
+        into one output buffer, and a document with nothing to rewrite is
+        returned as-is.
+        """
+        table = self._bytes_table
+        view = memoryview(content)
+        out = None
+        last = 0
+        for match in self._bytes_pattern.finditer(view):
+            if out is None:
+                out = bytearray()
+            start, end = match.span()
+            out += view[last:start]
+            out += table[match.group()]
+            last = end
+        if out is None:
+            return content if isinstance(content, bytes) else bytes(content)
+        out += view[last:]
+        return bytes(out)
+
+
+# Charsets in which every byte below 0x80 is the ASCII character, including
+# inside multi-byte sequences, on top of the single-byte ISO 8859 and
+# Windows code pages. Shift_JIS, GBK and Big5 reuse ASCII bytes as trail
+# bytes and UTF-16 is not byte-oriented at all, so those are decoded.
+ASCII_COMPATIBLE_CODECS = {'ascii', 'utf-8', 'utf-8-sig', 'euc_jp', 'euc_kr', 'koi8-r', 'koi8-u', 'mac-roman'}
+
+
+def ascii_compatible_charset(response: httpx.Response) -> Optional[str]:
+    """The charset of an upstream HTML response if it can be rewritten as bytes, else None.
+
+    Without a declared charset the body is treated as UTF-8, as the decoding
+    path does too.
+    """
+    charset = response.charset_encoding or 'utf-8'
+    try:
+        name = codecs.lookup(charset).name
+    except LookupError:
+        return None
+    if name in ASCII_COMPATIBLE_CODECS or name.startswith(('iso8859-', 'cp125')):
+        return charset
+    return None
+
+
+def stream_rewritten_html(response: httpx.Response, rewriter: HtmlUrlRewriter) -> StreamingResponse:
+    """Rewrite and forward an upstream HTML body as it arrives.
+
+    ASCII-compatible bodies are rewritten as bytes and keep their charset;
+    anything else is decoded and re-encoded as UTF-8.
+    """
+    host = urlsplit(rewriter.origin).hostname or ''
+    charset = ascii_compatible_charset(response) if rewriter.bytes_safe else None
+
+    async def rewrite_bytes():
+        rewriting = 0.0
+        try:
+            async for chunk in response.aiter_bytes():
+                started = time.perf_counter()
+                out = rewriter.feed_bytes(chunk)
+                rewriting += time.perf_counter() - started
+                if out:
+                    yield out
+            tail = rewriter.flush_bytes()
+            if tail:
+                yield tail
+        finally:
+            metrics.observe_stage('rewrite', rewriting, host, 'text/html')
+            await response.aclose()
+
+    async def decode_and_rewrite():
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        decoding = rewriting = 0.0
+        try:
+            async for chunk in response.aiter_bytes():
+                started = time.perf_counter()
+                text = decoder.decode(chunk)
+                decoded = time.perf_counter()
+                out = rewriter.feed(text).encode('utf-8')
+                decoding += decoded - started
+                rewriting += time.perf_counter() - decoded
+                if out:
+                    yield out
+            started = time.perf_counter()
+            tail = (rewriter.feed(decoder.decode(b'', final=True)) + rewriter.flush()).encode('utf-8')
+            rewriting += time.perf_counter() - started
+            if tail:
+                yield tail
+        finally:
+            metrics.observe_stage('decode', decoding, host, 'text/html')
+            metrics.observe_stage('rewrite', rewriting, host, 'text/html')
+            await response.aclose()
+
+    headers = {'x-cache': response.headers['x-cache']} if 'x-cache' in response.headers else None
+    return StreamingResponse(
+        rewrite_bytes() if charset else decode_and_rewrite(),
+        headers=headers,
+        media_type=f"text/html; charset={charset or 'utf-8'}",
+        background=BackgroundTask(response.aclose),
+    )
+
+
+class RewrittenHtmlCache:
+    """LRU memo of rewritten HTML bytes keyed by (upstream URL, validator, rewrite base).
+
+    The validator is the upstream ETag, or a hash of the body when there is
+    none. Only the newest validator per URL is kept, and entries for a URL
+    are dropped when the response cache reports that its content changed.
+    Compressed variants of each body are kept alongside it under the same
+    key plus the content coding, so hot pages are compressed once, and so
+    is the list of subresources the page loads.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._subresources: Dict[tuple, List[tuple]] = {}
+        self._keys_by_url: Dict[str, set] = defaultdict(set)
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def get(self, url: str, validator: str, rewrite_key: str, encoding: str = '') -> Optional[bytes]:
+        key = (url, validator, rewrite_key, encoding)
+        body = self._entries.get(key)
+        if body is None:
+            self.counters['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.counters['hits'] += 1
+        return body
+
+    def put(self, url: str, validator: str, rewrite_key: str, body: bytes, encoding: str = ''):
+        for key in [k for k in self._keys_by_url[url] if k[1] != validator]:
+            self._remove(key)
+        key = (url, validator, rewrite_key, encoding)
+        if key in self._entries:
+            self._remove(key)
+        if len(body) > self.max_bytes:
+            return
+        self._entries[key] = body
+        self._keys_by_url[url].add(key)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.counters['evictions'] += 1
+
+    def invalidate(self, url: str):
+        for key in list(self._keys_by_url.get(url, ())):
+            self._remove(key)
+            self.counters['invalidations'] += 1
+
+    def _remove(self, key: tuple):
+        body = self._entries.pop(key, None)
+        if body is not None:
+            self.bytes -= len(body)
+        self._subresources.pop(key, None)
+        keys = self._keys_by_url.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_url[key[0]]
+
+    def subresources(self, url: str, validator: str, rewrite_key: str, body: bytes) -> List[tuple]:
+        """Subresources of a rewritten body, parsed once while the body stays memoized"""
+        key = (url, validator, rewrite_key, '')
+        found = self._subresources.get(key)
+        if found is None:
+            found = collect_subresources(body.decode('utf-8', errors='replace'))
+            if key in self._entries:
+                self._subresources[key] = found
+        return found
+
+    async def compressed(self, url: str, validator: str, rewrite_key: str, body: bytes, encoding: str) -> bytes:
+        """The ``encoding`` variant of a rewritten body, compressing it off the loop on first use"""
+        key = (url, validator, rewrite_key, encoding)
+        variant = self._entries.get(key)
+        if variant is not None:
+            self._entries.move_to_end(key)
+            self.counters['variant_hits'] += 1
+            return variant
+        variant = await asyncio.to_thread(compress_bytes, body, encoding, CACHED_COMPRESSION_LEVELS[encoding])
+        self.counters['variant_compressions'] += 1
+        self.put(url, validator, rewrite_key, variant, encoding)
+        return variant
+
+    def stats(self) -> dict:
+        return {
+            **{name: self.counters[name] for name in (
+                'hits', 'misses', 'evictions', 'invalidations', 'variant_hits', 'variant_compressions',
+            )},
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+rewritten_html_cache = RewrittenHtmlCache(
+    max_bytes=int(os.environ.get('REWRITE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+)
+response_cache.on_change(rewritten_html_cache.invalidate)
+
+
+async def memoized_rewritten_html(
+    response: httpx.Response, url: str, rewriter: HtmlUrlRewriter, accept_encoding: str = '',
+    hints: bool = False,
+) -> Response:
+    """Serve rewritten HTML from the memo, rewriting only when the upstream changed.
+
+    With an upstream ETag a hit needs no body at all; otherwise the body is
+    read and hashed, which is still far cheaper than a rewrite. ASCII-compatible
+    bodies are rewritten as bytes, so a miss holds the upstream body plus the
+    rewritten one rather than two decoded copies on top.
+    The body is sent precompressed when the client accepts br or gzip. With
+    ``hints`` the page's subresources are prefetched in the background and
+    the critical ones announced in a ``Link`` preload header. Anything but a
+    200 (a partial body, say) is not the page and is passed through as-is.
+    """
+    if response.status_code != 200:
+        return stream_upstream_response(response, accept_encoding)
+    etag = response.headers.get('etag')
+    validator = etag
+    charset = ascii_compatible_charset(response) if rewriter.bytes_safe else None
+    body = rewritten_html_cache.get(url, etag, rewriter.cache_key) if etag else None
+    if body is None:
+        await response.aread()
+        validator = etag or 'sha256:' + hashlib.sha256(response.content).hexdigest()
+        body = None if etag else rewritten_html_cache.get(url, validator, rewriter.cache_key)
+        if body is None:
+            host = urlsplit(rewriter.origin).hostname or ''
+            if charset:
+                with metrics.stage('rewrite', host, 'text/html'):
+                    body = rewriter.rewrite_bytes(response.content)
+            else:
+                with metrics.stage('decode', host, 'text/html'):
+                    text = response.text
+                with metrics.stage('rewrite', host, 'text/html'):
+                    body = rewriter.rewrite(text).encode('utf-8')
+                del text
+            rewritten_html_cache.put(url, validator, rewriter.cache_key, body)
+            state = 'MISS'
+        else:
+            state = 'HIT'
+    else:
+        await response.aclose()
+        state = 'HIT'
+    headers = {'x-rewrite-cache': state, 'vary': 'Accept-Encoding'}
+    if 'x-cache' in response.headers:
+        headers['x-cache'] = response.headers['x-cache']
+    if hints and (PREFETCH_ENABLED or PRELOAD_HEADERS_ENABLED):
+        subresources = rewritten_html_cache.subresources(url, validator, rewriter.cache_key, body)
+        if PREFETCH_ENABLED:
+            subresource_prefetcher.prefetch(subresources)
+        link = preload_link_header(subresources) if PRELOAD_HEADERS_ENABLED else None
+        if link:
+            headers['link'] = link
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding is not None and len(body) >= COMPRESSION_MIN_SIZE:
+        body = await rewritten_html_cache.compressed(url, validator, rewriter.cache_key, body, encoding)
+        headers['content-encoding'] = encoding
+    else:
+        encoding = None
+    # Derived from the memo key, so a conditional request never hashes the body;
+    # a weak upstream validator only supports a weak one here
+    etag = content_etag(f"{url}|{validator}|{rewriter.cache_key}|{encoding or ''}".encode('utf-8'))
+    headers['etag'] = 'W/' + etag if validator.startswith('W/') else etag
+    return Response(content=body, media_type=f"text/html; charset={charset or 'utf-8'}", headers=headers)
+
+
+# GN-Math mirror racing
+class MirrorSelector:
+    """Learns which mirror serves each game best and races mirrors with hedging.
+
+    For every game it remembers the latency of each mirror that answered, so
+    the last fast mirror is tried first next time, and it keeps a negative
+    cache of (game, mirror) pairs that returned 404.
+    """
+
+    def __init__(
+        self,
+        hedge_delay: float = 0.5,
+        min_hedge_delay: float = 0.1,
+        negative_ttl: float = 600.0,
+        max_games: int = 10000,
+    ):
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.negative_ttl = negative_ttl
+        self.max_games = max_games
+        self._latency: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self._last_success: Dict[str, str] = {}
+        self._not_found: Dict[tuple, float] = {}
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def order(self, game: str, mirrors: List[str]) -> List[str]:
+        """Mirrors to try, best first, without known-404 ones"""
+        now = time.time()
+        candidates = []
+        for mirror in mirrors:
+            expires = self._not_found.get((game, mirror))
+            if expires is not None and expires > now:
+                self.counters['negative_cache_skips'] += 1
+                continue
+            self._not_found.pop((game, mirror), None)
+            candidates.append(mirror)
+        latency = self._latency.get(game, {})
+        last = self._last_success.get(game)
+        # Unknown mirrors keep their configured order after the measured ones
+        return sorted(
+            candidates,
+            key=lambda m: (m != last, latency.get(m, float('inf')), mirrors.index(m)),
+        )
+
+    def delay_after(self, game: str, mirror: str) -> float:
+        """How long to give a mirror before hedging with the next one"""
+        known = self._latency.get(game, {}).get(mirror)
+        if known is None:
+            return self.hedge_delay
+        return min(self.hedge_delay, max(self.min_hedge_delay, 2 * known))
+
+    def record_success(self, game: str, mirror: str, latency: float):
+        stats = self._latency.setdefault(game, {})
+        previous = stats.get(mirror)
+        stats[mirror] = latency if previous is None else 0.7 * previous + 0.3 * latency
+        self._latency.move_to_end(game)
+        self._last_success[game] = mirror
+        while len(self._latency) > self.max_games:
+            evicted, _ = self._latency.popitem(last=False)
+            self._last_success.pop(evicted, None)
+
+    def record_failure(self, game: str, mirror: str, status_code: Optional[int]):
+        if status_code == 404:
+            self._not_found[(game, mirror)] = time.time() + self.negative_ttl
+            if len(self._not_found) > self.max_games:
+                now = time.time()
+                self._not_found = {k: v for k, v in self._not_found.items() if v > now}
+        stats = self._latency.get(game)
+        if stats is not None:
+            stats.pop(mirror, None)
+        if self._last_success.get(game) == mirror:
+            del self._last_success[game]
+
+    async def race(self, game: str, mirrors: List[str], fetch, partial: bool = False) -> tuple:
+        """Return ``(mirror, response)`` for the first success, hedging across mirrors.
+
+        The preferred mirror starts alone; each further mirror starts when
+        the previous ones have been quiet for their hedge delay, or at once
+        when one fails. Losing requests are cancelled and closed. A 206 only
+        counts as a success when ``partial`` says a byte range was asked for.
+        """
+        accepted = (200, 206) if partial else (200,)
+        remaining = self.order(game, mirrors)
+        tasks: Dict[asyncio.Task, tuple] = {}
+
+        def launch():
+            mirror = remaining.pop(0)
+            tasks[asyncio.create_task(fetch(mirror))] = (mirror, time.monotonic())
+            if len(tasks) > 1:
+                self.counters['hedged'] += 1
+
+        winner = winning_mirror = overloaded = None
+        try:
+            while (remaining or tasks) and winner is None:
+                if not tasks:
+                    launch()
+                newest = list(tasks.values())[-1][0]
+                done, _ = await asyncio.wait(
+                    tasks,
+                    timeout=self.delay_after(game, newest) if remaining else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    mirror, started = tasks.pop(task)
+                    response = None if task.exception() else task.result()
+                    if isinstance(task.exception(), UpstreamUnavailable):
+                        overloaded = task.exception()
+                    if winner is None and response is not None and response.status_code in accepted:
+                        winner, winning_mirror = response, mirror
+                        self.record_success(game, mirror, time.monotonic() - started)
+                        continue
+                    self.record_failure(game, mirror, response.status_code if response is not None else None)
+                    if response is not None:
+                        await response.aclose()
+                    if remaining and winner is None:
+                        launch()
+        finally:
+            for task in tasks:
+                task.cancel()
+            for result in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(result, httpx.Response):
+                    await result.aclose()
+        if winner is None and overloaded is not None:
+            # Nothing was found to be missing; the mirrors just could not be tried
+            raise overloaded
+        return winning_mirror, winner
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "games": {
+                game: {
+                    "preferred": self._last_success.get(game),
+                    "latency": {mirror: round(value, 4) for mirror, value in latency.items()},
+                }
+                for game, latency in self._latency.items()
+            },
+            "not_found": sorted(
+                f"{game} @ {mirror}" for (game, mirror), expires in self._not_found.items()
+                if expires > now
+            ),
+            "hedged": self.counters['hedged'],
+            "negative_cache_skips": self.counters['negative_cache_skips'],
+        }
+
+
+gn_math_mirrors = MirrorSelector(
+    hedge_delay=float(os.environ.get('GN_MATH_HEDGE_DELAY', 0.5)),
+    negative_ttl=float(os.environ.get('GN_MATH_NOT_FOUND_TTL', 600)),
+)
+
+
+# GN-Math local mirror store
+GN_MATH_GAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+# Same-game references worth mirroring: HTML src/href attributes and CSS url()
+GN_MATH_REFERENCE_RE = re.compile(
+    r'''(?:\b(?:src|href)\s*=\s*["']|url\(\s*["']?)([^"'()\s?#]+)'''
+)
+GN_MATH_DISCOVERY_TYPES = ('text/html', 'text/css')
+HTML_PATH_EXTENSIONS = ('.html', '.htm')
+
+def store_path(path: str) -> str:
+    """Normalize a game-relative file path; ``..`` cannot climb above the game directory"""
+    directory = not path or path.endswith('/')
+    path = posixpath.normpath('/' + path).lstrip('/')
+    if directory:
+        path = posixpath.join(path, 'index.html')
+    return path
+
+def mirror_file_url(mirror_url: str, path: str) -> str:
+    """URL of a game file on a mirror whose template points at the game's entry page"""
+    return mirror_url if path == 'index.html' else urljoin(mirror_url, quote(path))
+
+
+class FileRangeResponse(Response):
+    """206 response for one byte range of a file, read with pread off the event loop"""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: Path, start: int, end: int, size: int,
+                 headers: dict, media_type: Optional[str] = None):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.status_code = 206
+        self.media_type = media_type
+        self.background = None
+        self.init_headers({
+            **headers,
+            'content-range': f'bytes {start}-{end}/{size}',
+            'content-length': str(end - start + 1),
+        })
+
+    async def __call__(self, scope, receive, send):
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        if scope['method'].upper() == 'HEAD':
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            position = self.start
+            while position <= self.end:
+                length = min(self.chunk_size, self.end - position + 1)
+                chunk = await asyncio.to_thread(os.pread, fd, length, position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': position <= self.end})
+        finally:
+            os.close(fd)
+
+
+def parse_byte_range(value: str, size: int) -> Optional[tuple]:
+    """``(start, end)`` of a single-range ``Range`` header; ``()`` if unsatisfiable, None to ignore it"""
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return ()
+    return start, end
+
+
+class GameMirrorStore:
+    """On-disk mirror of GN-Math games in content-addressed blobs.
+
+    A background sync downloads each game's entry page plus every same-game
+    file it references (and paths clients asked for that the store missed)
+    into ``blobs/<sha256>``, so files shared between games are stored once.
+    Each game gets a JSON manifest mapping its paths to blob digests;
+    manifests persist across restarts. Compressible blobs get br/gzip
+    variants next to them so compressed responses are plain file sends too.
+    Once the blobs outgrow ``max_bytes`` the least recently used games are
+    dropped and their unshared blobs collected.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        sync_interval: float = 21600.0,
+        max_files: int = 500,
+        max_file_bytes: int = 256 * 1024 * 1024,
+        max_bytes: int = 2 * 1024 * 1024 * 1024,
+        concurrency: int = 4,
+    ):
+        self.root = root
+        self.sync_interval = sync_interval
+        self.max_files = max_files
+        self.max_file_bytes = max_file_bytes
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self.manifests: Dict[str, dict] = {}
+        self.used: Dict[str, float] = {}
+        self.missed: Dict[str, set] = defaultdict(set)
+        self.synced_at: Optional[datetime] = None
+        self.counters: Dict[str, int] = defaultdict(int)
+        self._games = None
+        self._task: Optional[asyncio.Task] = None
+        self._syncing: Dict[str, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self._games is not None
+
+    @property
+    def blob_dir(self) -> Path:
+        return self.root / 'blobs'
+
+    @property
+    def manifest_dir(self) -> Path:
+        return self.root / 'manifests'
+
+    def blob_path(self, digest: str, encoding: Optional[str] = None) -> Path:
+        suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding, '')
+        return self.blob_dir / digest[:2] / (digest + suffix)
+
+    async def start(self, games):
+        """Load manifests and sync ``games()`` (a callable returning game names) periodically"""
+        self._games = games
+        self.manifests = await asyncio.to_thread(self._load_manifests)
+        if self._task is None and self.sync_interval > 0:
+            self._task = asyncio.create_task(self._sync_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _load_manifests(self) -> Dict[str, dict]:
+        for directory in (self.blob_dir, self.manifest_dir, self.root / 'tmp'):
+            directory.mkdir(parents=True, exist_ok=True)
+        for path in (self.root / 'tmp').iterdir():
+            path.unlink(missing_ok=True)
+        manifests = {}
+        for path in self.manifest_dir.glob('*.json'):
+            try:
+                manifest = json.loads(path.read_text())
+                manifests[manifest['game']] = manifest
+            except (ValueError, KeyError, OSError) as e:
+                logger.warning(f"Ignoring unreadable GN-Math manifest {path.name}: {e}")
+        return manifests
+
+    async def _sync_periodically(self):
+        while True:
+            try:
+                await self.sync(self._games())
+            except Exception as e:
+                logger.warning(f"GN-Math mirror sync failed: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    def lookup(self, game: str, path: str) -> Optional[dict]:
+        manifest = self.manifests.get(game)
+        if manifest is None:
+            return None
+        entry = manifest['files'].get(path)
+        if entry is None:
+            self.counters['misses'] += 1
+            return None
+        self.counters['hits'] += 1
+        self.used[game] = time.time()
+        return entry
+
+    def note_miss(self, game: str, path: str):
+        """Remember a path clients needed so the next sync mirrors it"""
+        if game in self.manifests and len(self.missed[game]) < self.max_files:
+            self.missed[game].add(path)
+
+    async def sync(self, games: List[str]):
+        failed = []
+        for game in games:
+            try:
+                if not await self.sync_game(game):
+                    failed.append(game)
+            except Exception as e:
+                logger.warning(f"GN-Math mirror sync of {game} failed: {e}")
+                failed.append(game)
+        await self._collect()
+        self.synced_at = datetime.now(timezone.utc)
+        if failed:
+            logger.warning(f"GN-Math mirror sync could not fetch {len(failed)} of {len(games)} games")
+
+    async def sync_game(self, game: str) -> bool:
+        """Mirror one game; returns False if no mirror served its entry page"""
+        if not GN_MATH_GAME_RE.match(game):
+            return False
+        self._syncing[game] = time.time()
+        try:
+            synced = await self._sync_game(game)
+        finally:
+            del self._syncing[game]
+        if synced:
+            await self._enforce_budget()
+        return synced
+
+    async def _sync_game(self, game: str) -> bool:
+        previous = self.manifests.get(game, {'files': {}})
+        for mirror_template in gn_math_mirrors.order(game, GN_MATH_MIRRORS):
+            mirror_url = mirror_template.format(game=game)
+            entry = await self._download(mirror_url, previous['files'].get('index.html'))
+            if entry is not None:
+                break
+        else:
+            return False
+
+        files = {'index.html': entry}
+        # Previously mirrored and client-requested paths are kept even if no page links them
+        queue = list(self._references('index.html', entry))
+        queue.extend(sorted(self.missed.pop(game, set()) | set(previous['files'])))
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(path):
+            async with semaphore:
+                return path, await self._download(mirror_file_url(mirror_url, path), previous['files'].get(path))
+
+        while queue and len(files) < self.max_files:
+            batch = []
+            for path in queue:
+                if path not in files and path not in batch:
+                    batch.append(path)
+            batch = batch[:self.max_files - len(files)]
+            queue = []
+            for path, file_entry in await asyncio.gather(*(fetch(path) for path in batch)):
+                if file_entry is not None:
+                    files[path] = file_entry
+                    queue.extend(self._references(path, file_entry))
+
+        manifest = {
+            'game': game,
+            'mirror': mirror_url,
+            'synced_at': datetime.now(timezone.utc).isoformat(),
+            'files': files,
+        }
+        await asyncio.to_thread(self._write_manifest, manifest)
+        self.manifests[game] = manifest
+        self.counters['games_synced'] += 1
+        return True
+
+    def stored_bytes(self) -> int:
+        """Disk used by the blobs the manifests reference, compressed variants included"""
+        blobs = {
+            entry['sha256']: entry.get('stored', entry['size'])
+            for manifest in self.manifests.values() for entry in manifest['files'].values()
+        }
+        return sum(blobs.values())
+
+    def _last_used(self, game: str) -> float:
+        if game in self.used:
+            return self.used[game]
+        try:
+            return datetime.fromisoformat(self.manifests[game]['synced_at']).timestamp()
+        except (KeyError, ValueError):
+            return 0.0
+
+    async def _enforce_budget(self):
+        """Drop least recently used games until the store fits ``max_bytes``"""
+        evicted = []
+        for game in sorted(self.manifests, key=self._last_used):
+            if self.stored_bytes() <= self.max_bytes:
+                break
+            if game in self._syncing:
+                continue
+            del self.manifests[game]
+            self.used.pop(game, None)
+            self.missed.pop(game, None)
+            evicted.append(game)
+        if not evicted:
+            return
+        self.counters['games_evicted'] += len(evicted)
+        await asyncio.to_thread(self._remove_manifests, evicted)
+        await self._collect()
+
+    def _remove_manifests(self, games: List[str]):
+        for game in games:
+            if game not in self.manifests:
+                (self.manifest_dir / f"{game}.json").unlink(missing_ok=True)
+
+    async def _collect(self):
+        referenced = {
+            entry['sha256'] for manifest in self.manifests.values() for entry in manifest['files'].values()
+        }
+        # Blobs written by syncs still running are not in any manifest yet; their mtimes protect them
+        cutoff = min(self._syncing.values(), default=time.time()) - 2
+        await asyncio.to_thread(self._collect_garbage, referenced, cutoff)
+
+    def _references(self, path: str, entry: dict) -> List[str]:
+        if media_type(entry['content_type']) not in GN_MATH_DISCOVERY_TYPES:
+            return []
+        try:
+            text = self.blob_path(entry['sha256']).read_text(encoding='utf-8', errors='replace')
+        except OSError:
+            return []
+        directory = posixpath.dirname(path)
+        references = []
+        for reference in GN_MATH_REFERENCE_RE.findall(text):
+            if reference.startswith(('/', 'data:')) or re.match(r'[a-zA-Z][a-zA-Z0-9+.\-]*:', reference):
+                continue
+            resolved = posixpath.normpath(posixpath.join(directory, unquote(reference)))
+            if not resolved.startswith('..') and resolved != '.':
+                references.append(resolved)
+        return references
+
+    async def _download(self, url: str, known: Optional[dict]) -> Optional[dict]:
+        """Fetch ``url`` into a blob; returns its manifest entry, or None on failure"""
+        headers = {}
+        if known is not None and known.get('etag') and self.blob_path(known['sha256']).exists():
+            headers['If-None-Match'] = known['etag']
+        try:
+            response = await upstream_pool.open(url, headers=headers, priority=PRIORITY_BACKGROUND)
+        except (httpx.HTTPError, UpstreamUnavailable):
+            return None
+        temporary = self.root / 'tmp' / uuid.uuid4().hex
+        try:
+            if response.status_code == 304:
+                self.counters['not_modified'] += 1
+                return known
+            length = response.headers.get('content-length', '')
+            if response.status_code != 200 or (length.isdigit() and int(length) > self.max_file_bytes):
+                return None
+            digest = hashlib.sha256()
+            size = 0
+            with open(temporary, 'wb') as handle:
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        break
+                    digest.update(chunk)
+                    await asyncio.to_thread(handle.write, chunk)
+            if size > self.max_file_bytes:
+                temporary.unlink(missing_ok=True)
+                return None
+        except httpx.HTTPError:
+            temporary.unlink(missing_ok=True)
+            return None
+        finally:
+            await response.aclose()
+
+        sha256 = digest.hexdigest()
+        content_type = response.headers.get('content-type', 'application/octet-stream')
+        encodings, stored = await asyncio.to_thread(self._commit_blob, temporary, sha256, size, content_type)
+        self.counters['bytes_downloaded'] += size
+        return {
+            'sha256': sha256,
+            'size': size,
+            'stored': stored,
+            'content_type': content_type,
+            'etag': response.headers.get('etag'),
+            'encodings': encodings,
+        }
+
+    def _commit_blob(self, temporary: Path, sha256: str, size: int, content_type: str) -> tuple:
+        """Move a download into place; returns its variant encodings and the bytes stored for it"""
+        blob = self.blob_path(sha256)
+        blob.parent.mkdir(exist_ok=True)
+        if blob.exists():
+            temporary.unlink(missing_ok=True)
+            os.utime(blob)  # newly in use again, so a concurrent collection leaves it
+            self.counters['deduplicated'] += 1
+        else:
+            os.replace(temporary, blob)
+            self.counters['blobs_written'] += 1
+        encodings = []
+        stored = size
+        if not is_compressible(content_type) or size < COMPRESSION_MIN_SIZE:
+            return encodings, stored
+        data = None
+        for encoding in (('br',) if BROTLI_AVAILABLE else ()) + ('gzip',):
+            variant = self.blob_path(sha256, encoding)
+            if not variant.exists():
+                data = data if data is not None else blob.read_bytes()
+                compressed = compress_bytes(data, encoding, CACHED_COMPRESSION_LEVELS[encoding])
+                if len(compressed) >= size:
+                    continue
+                partial = self.root / 'tmp' / uuid.uuid4().hex
+                partial.write_bytes(compressed)
+                os.replace(partial, variant)
+            encodings.append(encoding)
+            stored += variant.stat().st_size
+        return encodings, stored
+
+    def _write_manifest(self, manifest: dict):
+        partial = self.root / 'tmp' / uuid.uuid4().hex
+        partial.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+        os.replace(partial, self.manifest_dir / f"{manifest['game']}.json")
+
+    def _collect_garbage(self, referenced: set, cutoff: float):
+        """Delete blobs (and their variants) no manifest references that were last written before ``cutoff``"""
+        for path in self.blob_dir.glob('*/*'):
+            digest = path.name.split('.', 1)[0]
+            if digest in referenced:
+                continue
+            try:
+                if self.blob_path(digest).stat().st_mtime >= cutoff:
+                    continue
+            except FileNotFoundError:
+                pass
+            path.unlink(missing_ok=True)
+            self.counters['blobs_collected'] += 1
+
+    def response(self, http_request: Request, entry: dict) -> Response:
+        """Serve a stored file with validators, single byte ranges and precompressed variants.
+
+        Each variant is its own representation with its own strong ETag
+        (``"<sha256>-br"``); byte ranges are always cut from the identity blob.
+        """
+        etag = f'"{entry["sha256"]}"'
+        headers = {
+            'accept-ranges': 'bytes',
+            'cache-control': 'public, max-age=300',
+            'x-cache': 'STORE',
+        }
+        encoding = None
+        if entry['encodings']:
+            headers['vary'] = 'Accept-Encoding'
+            negotiated = negotiate_encoding(http_request.headers.get('accept-encoding'))
+            if negotiated in entry['encodings']:
+                encoding = negotiated
+        headers['etag'] = f'{etag[:-1]}-{encoding}"' if encoding else etag
+        if_none_match = http_request.headers.get('if-none-match')
+        matched = matching_etag(if_none_match, etag) if if_none_match else None
+        if matched:
+            return Response(status_code=304, headers={**headers, 'etag': matched})
+        blob = self.blob_path(entry['sha256'])
+        content_type = entry['content_type']
+        byte_range = http_request.headers.get('range')
+        # If-Range needs a strong match with the representation a range comes from
+        if byte_range and http_request.headers.get('if-range', etag) == etag:
+            selected = parse_byte_range(byte_range, entry['size'])
+            range_headers = {**headers, 'etag': etag}
+            if selected == ():
+                return Response(status_code=416, headers={**range_headers, 'content-range': f"bytes */{entry['size']}"})
+            if selected is not None:
+                return FileRangeResponse(blob, *selected, entry['size'], range_headers, media_type=content_type)
+        if encoding is not None:
+            headers['content-encoding'] = encoding
+            blob = self.blob_path(entry['sha256'], encoding)
+        # FileResponse hands the path to the server (sendfile) when it supports pathsend
+        return FileResponse(blob, headers=headers, media_type=content_type)
+
+    def stats(self) -> dict:
+        return {
+            **{name: self.counters[name] for name in (
+                'hits', 'misses', 'not_modified', 'games_synced', 'blobs_written',
+                'deduplicated', 'blobs_collected', 'bytes_downloaded', 'games_evicted',
+            )},
+            "games": len(self.manifests),
+            "stored_bytes": self.stored_bytes(),
+            "max_bytes": self.max_bytes,
+            "files": sum(len(manifest['files']) for manifest in self.manifests.values()),
+            "pending_misses": sum(len(paths) for paths in self.missed.values()),
+            "synced_at": self.synced_at.isoformat() if self.synced_at else None,
+            "enabled": self.enabled,
+        }
+
+
+gn_math_store = GameMirrorStore(
+    root=Path(os.environ.get('GN_MATH_STORE_DIR', Path(tempfile.gettempdir()) / 'betterplay-gn-math-store')),
+    sync_interval=float(os.environ.get('GN_MATH_SYNC_INTERVAL', 21600)),
+    max_files=int(os.environ.get('GN_MATH_STORE_MAX_FILES', 500)),
+    max_file_bytes=int(os.environ.get('GN_MATH_STORE_MAX_FILE_BYTES', 256 * 1024 * 1024)),
+    max_bytes=int(os.environ.get('GN_MATH_STORE_MAX_BYTES', 2 * 1024 * 1024 * 1024)),
+)
+
+
+async def serve_gn_math_store(http_request: Request, game: str, path: str) -> Optional[Response]:
+    """A GN-Math file from the local mirror store, or None when it is not mirrored"""
+    entry = gn_math_store.lookup(game, path)
+    if entry is None:
+        return None
+    if media_type(entry['content_type']) != 'text/html':
+        return gn_math_store.response(http_request, entry)
+    # Relative URLs go back through the store route; root-relative ones to the mirror's origin
+    rewriter = HtmlUrlRewriter(
+        gn_math_store.manifests[game]['mirror'],
+        relative_base=f"/api/gn-math/{game}/{posixpath.dirname(path)}",
+    )
+    try:
+        stream = _FileByteStream(open(gn_math_store.blob_path(entry['sha256']), 'rb'))
+    except FileNotFoundError:
+        return None
+    response = httpx.Response(
+        200,
+        headers={'etag': f'"{entry["sha256"]}"', 'content-type': entry['content_type'], 'x-cache': 'STORE'},
+        stream=stream,
+    )
+    return await memoized_rewritten_html(
+        response, f"gn-math-store:{game}/{path}", rewriter,
+        http_request.headers.get('accept-encoding', ''), hints=True,
+    )
+
+
+async def fetch_gn_math_file(
+    game: str, path: str, headers: dict, accept_encoding: str = '', priority: Optional[int] = None
+) -> tuple:
+    """Race the upstream mirrors for one game file; ``(mirror_url, response)`` or ``(None, None)``"""
+
+    async def fetch(mirror_url):
+        return await fetch_upstream(
+            mirror_file_url(mirror_url, path), headers=headers,
+            endpoint='gn_math_proxy', accept_encoding=accept_encoding, priority=priority,
+        )
+
+    # Files get their own race key so a file missing on one mirror doesn't mark the whole game
+    race_key = game if path == 'index.html' else f"{game}/{path}"
+    base_urls = [mirror.format(game=game) for mirror in GN_MATH_MIRRORS]
+    partial = any(name.lower() == 'range' for name in headers)
+    return await gn_math_mirrors.race(race_key, base_urls, fetch, partial=partial)
+
+
+# Subresource prefetch
+SUBRESOURCE_TAG_RE = re.compile(r'<(script|link|img)\b([^>]*)>', re.IGNORECASE)
+SUBRESOURCE_ATTR_RE = re.compile(r'''([a-zA-Z-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''')
+# Destinations worth a preload header: the page cannot render or run without them
+CRITICAL_DESTINATIONS = ('style', 'script', 'module')
+
+def collect_subresources(html: str) -> List[tuple]:
+    """``(url, destination)`` for the scripts, stylesheets, preloads and images a page loads"""
+    found = {}
+    for tag, raw_attrs in SUBRESOURCE_TAG_RE.findall(html):
+        attrs = {
+            name.lower(): next(value for value in values if value) if any(values) else ''
+            for name, *values in SUBRESOURCE_ATTR_RE.findall(raw_attrs)
+        }
+        tag = tag.lower()
+        if tag == 'script':
+            url, destination = attrs.get('src'), 'module' if attrs.get('type') == 'module' else 'script'
+        elif tag == 'img':
+            url, destination = attrs.get('src'), 'image'
+        else:
+            rel = attrs.get('rel', '').lower().split()
+            url = attrs.get('href')
+            if 'stylesheet' in rel:
+                destination = 'style'
+            elif 'modulepreload' in rel:
+                destination = 'module'
+            elif 'preload' in rel and attrs.get('as'):
+                destination = attrs['as'].lower()
+            else:
+                continue
+        if url and not url.startswith(('data:', 'blob:', 'javascript:', '#')):
+            found.setdefault(url, destination)
+    return list(found.items())
+
+def preload_link_header(subresources: List[tuple], limit: int = 8) -> Optional[str]:
+    """A ``Link`` header preloading the critical subresources and preconnecting their origins"""
+    links = []
+    origins = []
+    for url, destination in subresources:
+        if destination not in CRITICAL_DESTINATIONS or len(links) >= limit:
+            continue
+        if destination == 'module':
+            links.append(f'<{url}>; rel=modulepreload')
+        else:
+            links.append(f'<{url}>; rel=preload; as={destination}')
+        parts = urlsplit(url)
+        if parts.scheme in ('http', 'https') and f'{parts.scheme}://{parts.netloc}' not in origins:
+            origins.append(f'{parts.scheme}://{parts.netloc}')
+    links.extend(f'<{origin}>; rel=preconnect' for origin in origins[:4])
+    return ', '.join(links) or None
+
+
+class SubresourcePrefetcher:
+    """Warms the caches with the subresources of served game pages, in the background.
+
+    Only URLs that come back through this server can benefit, i.e. game
+    files under ``/api/gn-math/``: those missing from the local mirror store
+    are fetched from the upstream mirrors into the response cache (and noted
+    for the next store sync) before the browser asks for them. Concurrency
+    is bounded and a URL is not prefetched again within ``ttl`` seconds.
+    """
+
+    LOCAL_PREFIX = '/api/gn-math/'
+
+    def __init__(self, concurrency: int = 4, max_per_page: int = 32, max_pending: int = 256, ttl: float = 300.0):
+        self.max_per_page = max_per_page
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._recent: "OrderedDict[str, float]" = OrderedDict()
+        self._tasks: set = set()
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def prefetch(self, subresources: List[tuple]):
+        now = time.monotonic()
+        while self._recent and next(iter(self._recent.values())) < now - self.ttl:
+            self._recent.popitem(last=False)
+        for url, _ in subresources[:self.max_per_page]:
+            if not url.startswith(self.LOCAL_PREFIX) or url in self._recent:
+                continue
+            if len(self._tasks) >= self.max_pending:
+                self.counters['dropped'] += 1
+                continue
+            game, _, path = url[len(self.LOCAL_PREFIX):].partition('/')
+            self._recent[url] = now
+            task = asyncio.create_task(self._prefetch(game, store_path(unquote(path))))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch(self, game: str, path: str):
+        if not GN_MATH_GAME_RE.match(game) or gn_math_store.lookup(game, path) is not None:
+            self.counters['already_local'] += 1
+            return
+        gn_math_store.note_miss(game, path)
+        async with self._semaphore:
+            try:
+                _, response = await fetch_gn_math_file(game, path, {}, priority=PRIORITY_BACKGROUND)
+                if response is None:
+                    self.counters['failed'] += 1
+                    return
+                try:
+                    async for _ in response.aiter_raw():
+                        pass
+                finally:
+                    await response.aclose()
+                self.counters['prefetched'] += 1
+            except Exception:
+                self.counters['failed'] += 1
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            **{name: self.counters[name] for name in ('prefetched', 'already_local', 'failed', 'dropped')},
+            "in_flight": len(self._tasks),
+            "recent": len(self._recent),
+        }
+
+
+subresource_prefetcher = SubresourcePrefetcher(
+    concurrency=int(os.environ.get('PREFETCH_CONCURRENCY', 4)),
+    max_per_page=int(os.environ.get('PREFETCH_MAX_PER_PAGE', 32)),
+)
+PRELOAD_HEADERS_ENABLED = os.environ.get('PRELOAD_HEADERS', 'true').lower() == 'true'
+PREFETCH_ENABLED = os.environ.get('PREFETCH_SUBRESOURCES', 'true').lower() == 'true'
+
+
+# Search suggestion cache
+class SuggestionService:
+    """Prefix-aware, TTL/LRU-bounded cache in front of the suggestion API.
+
+    Identical lookups share one in-flight upstream request, and a cached
+    list that was shorter than the upstream maximum (so it is exhaustive)
+    answers any longer prefix locally by filtering.
+    """
+
+    def __init__(self, fetch, ttl: float = 600.0, max_entries: int = 5000, upstream_max: int = 10):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.upstream_max = upstream_max
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return ' '.join(query.lower().split())
+
+    def _cached(self, key: str, now: float) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _from_shorter_prefix(self, key: str, now: float) -> Optional[List[str]]:
+        for end in range(len(key) - 1, 0, -1):
+            entry = self._cached(key[:end], now)
+            if entry is not None:
+                _, suggestions, complete = entry
+                if complete:
+                    return [s for s in suggestions if s.lower().startswith(key)]
+                return None
+        return None
+
+    def _store(self, key: str, task: asyncio.Task):
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        suggestions = task.result()
+        complete = len(suggestions) < self.upstream_max
+        self._entries[key] = (time.monotonic() + self.ttl, suggestions, complete)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def suggest(self, query: str) -> List[str]:
+        key = self.normalize(query)
+        if not key:
+            return []
+        now = time.monotonic()
+        entry = self._cached(key, now)
+        if entry is not None:
+            self.counters['hits'] += 1
+            return entry[1]
+        local = self._from_shorter_prefix(key, now)
+        if local is not None:
+            self.counters['prefix_hits'] += 1
+            return local
+
+        task = self._pending.get(key)
+        if task is not None:
+            self.counters['coalesced'] += 1
+        else:
+            self.counters['misses'] += 1
+            # A task so that a client aborting its request doesn't cancel the others
+            task = asyncio.create_task(self._fetch(key))
+            task.add_done_callback(lambda done: self._store(key, done))
+            self._pending[key] = task
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            **{name: self.counters[name] for name in ('hits', 'prefix_hits', 'coalesced', 'misses')},
+            "entries": len(self._entries),
+            "in_flight": len(self._pending),
+        }
+
+
+async def fetch_google_suggestions(query: str) -> List[str]:
+    response = await upstream_pool.get(
+        SUGGESTION_API_URL.format(query=quote_plus(query)),
+        timeout=10.0,
+        follow_redirects=False,
+        priority=PRIORITY_INTERACTIVE,
+    )
+    response.raise_for_status()
+    return response.json()[1]
+
+
+suggestion_service = SuggestionService(
+    fetch_google_suggestions,
+    ttl=float(os.environ.get('SUGGESTION_CACHE_TTL', 600)),
+    max_entries=int(os.environ.get('SUGGESTION_CACHE_MAX_ENTRIES', 5000)),
+)
+
+
 # Proxy functionality
 @api_router.post("/proxy")
-async def proxy_website(request: ProxyRequest):
+async def proxy_website(request: ProxyRequest, http_request: Request):
     """Proxy a website to bypass blocks"""
     try:
         if not request.url.startswith(('http://', 'https://')):
             request.url = 'https://' + request.url
             
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = await client.get(request.url, headers=headers)
-            
-            # Get content type
-            content_type = response.headers.get('content-type', 'text/html')
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+        headers.update(forwarded_request_headers(http_request))
+        accept_encoding = http_request.headers.get('accept-encoding', '')
+        response = await fetch_upstream(
+            request.url, headers=headers, endpoint='proxy_website', accept_encoding=accept_encoding
+        )
             
-            if 'text/html' in content_type:
-                # Modify HTML to fix relative URLs
-                content = response.text
-                base_url = f"{urlparse(request.url).scheme}://{urlparse(request.url).netloc}"
-                
-                # Fix relative URLs in href and src attributes
-                content = re.sub(r'href="(/[^"]*)"', f'href="{base_url}\\1"', content)
-                content = re.sub(r'src="(/[^"]*)"', f'src="{base_url}\\1"', content)
-                content = re.sub(r"href='(/[^']*)'", f"href='{base_url}\\1'", content)
-                content = re.sub(r"src='(/[^']*)'", f"src='{base_url}\\1'", content)
-                
-                return Response(content=content, media_type="text/html")
-            else:
-                # For other content types, return as-is
-                return Response(content=response.content, media_type=content_type)
+        if rewritable_html(response):
+            # Modify HTML to fix relative URLs
+            return stream_rewritten_html(response, HtmlUrlRewriter(request.url))
+        else:
+            # For other content types, stream as-is
+            return stream_upstream_response(response, accept_encoding)
                 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error fetching website: {str(e)}")
 
 @api_router.get("/proxy-direct")
-async def proxy_direct(url: str = Query(...)):
+async def proxy_direct(http_request: Request, url: str = Query(...)):
     """Direct proxy endpoint for GET requests"""
     try:
         if not url.startswith(('http://', 'https://')):
             url = 'https://' + url
             
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = await client.get(url, headers=headers)
-            
-            content_type = response.headers.get('content-type', 'text/html')
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+        headers.update(forwarded_request_headers(http_request))
+        accept_encoding = http_request.headers.get('accept-encoding', '')
+        response = await fetch_upstream(
+            url, headers=headers, endpoint='proxy_direct', accept_encoding=accept_encoding
+        )
             
-            if 'text/html' in content_type:
-                content = response.text
-                base_url = f"{urlparse(url).scheme}://{urlparse(url).netloc}"
-                
-                # Fix relative URLs
-                content = re.sub(r'href="(/[^"]*)"', f'href="{base_url}\\1"', content)
-                content = re.sub(r'src="(/[^"]*)"', f'src="{base_url}\\1"', content)
-                
-                return Response(content=content, media_type="text/html")
-            else:
-                return Response(content=response.content, media_type=content_type)
+        if rewritable_html(response):
+            # Fix relative URLs
+            return stream_rewritten_html(response, HtmlUrlRewriter(url))
+        else:
+            return stream_upstream_response(response, accept_encoding)
                 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error fetching website: {str(e)}")
 
 # Games functionality
+GAME_SORT_FIELDS = ('created_at', 'title')
+GAME_INDEXES = [
+    ([("id", 1)], {"unique": True}),
+    ([("category", 1), ("created_at", 1), ("id", 1)], {}),
+    ([("created_at", 1), ("id", 1)], {}),
+    ([("category", 1), ("title", 1), ("id", 1)], {}),
+    ([("title", 1), ("id", 1)], {}),
+    # Natural key bulk imports upsert on
+    ([("game_url", 1)], {}),
+]
+
+async def ensure_game_indexes():
+    """Indexes backing id lookups and every keyset sort order, with and without a category filter"""
+    existing = await db.games.index_information()
+    if existing.get('game_url_1', {}).get('unique'):
+        # Made unique by an earlier version; POST /api/games may store duplicate URLs
+        await db.games.drop_index('game_url_1')
+    for keys, options in GAME_INDEXES:
+        await db.games.create_index(keys, **options)
+
+def encode_games_cursor(sort: str, doc: dict) -> str:
+    field = sort.lstrip('-')
+    value = doc.get(field)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, doc['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_games_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, last_id = json.loads(raw)
+        if cursor_sort != sort:
+            raise ValueError("cursor was issued for a different sort order")
+        if sort.lstrip('-') == 'created_at':
+            value = datetime.fromisoformat(value)
+        return value, last_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor") from None
+
+def games_query(category: Optional[str], sort: str, cursor: Optional[str]) -> dict:
+    """Filter for one keyset page: rows strictly after (sort value, id) of the cursor"""
+    query = {}
+    if category:
+        query["category"] = category
+    if cursor:
+        value, last_id = decode_games_cursor(cursor, sort)
+        field = sort.lstrip('-')
+        op = '$lt' if sort.startswith('-') else '$gt'
+        query["$or"] = [{field: {op: value}}, {field: value, "id": {op: last_id}}]
+    return query
+
+def games_projection(fields: Optional[str], sort: str) -> dict:
+    projection = {"_id": 0}
+    if fields:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in names if name not in Game.model_fields]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        # id and the sort key are always returned so the cursor can be built
+        projection.update({name: 1 for name in names + ['id', sort.lstrip('-')]})
+    return projection
+
+# Plain (non-factory) defaults of Game, filled in for documents stored without them
+GAME_FIELD_DEFAULTS = {
+    name: field.default for name, field in Game.model_fields.items()
+    if not field.is_required() and field.default_factory is None
+}
+GAMES_LIST_RESPONSES = {
+    200: {
+        "description": "One page of games; with `fields`, only those fields plus `id` and the sort key",
+        "content": {
+            "application/json": {"schema": {"type": "array", "items": Game.model_json_schema()}},
+            "application/x-ndjson": {"schema": {"type": "string", "description": "One game object per line"}},
+        },
+    },
+}
+
+def game_field_defaults(projection: dict) -> dict:
+    """Defaults for the projected fields a stored document may lack"""
+    if len(projection) == 1:
+        return GAME_FIELD_DEFAULTS
+    return {name: value for name, value in GAME_FIELD_DEFAULTS.items() if name in projection}
+
+def game_document(doc: dict) -> dict:
+    """Stored game document with JSON-ready values, without a pydantic round trip"""
+    created_at = doc.get('created_at')
+    if isinstance(created_at, datetime):
+        doc['created_at'] = created_at.isoformat()
+    return doc
+
+async def export_games_ndjson(query: dict, projection: dict, sort_spec: list):
+    """Stream the whole (filtered) catalog as NDJSON, a batch of lines per chunk"""
+    defaults = game_field_defaults(projection)
+    lines = []
+    size = 0
+    async for doc in db.games.find(query, projection).sort(sort_spec).batch_size(1000):
+        line = dumps_json({**defaults, **doc} if defaults else doc) + b'\n'
+        lines.append(line)
+        size += len(line)
+        if size >= 64 * 1024:
+            yield b''.join(lines)
+            lines, size = [], 0
+    if lines:
+        yield b''.join(lines)
+
+class CategoryCounts:
+    """Per-category game counts, materialized instead of aggregated per request.
+
+    Writers apply deltas to an in-memory dict (which serves reads) and to the
+    ``game_categories`` collection (so a restart loads O(categories) documents
+    instead of scanning ``games``). A periodic ``$group`` reconciliation
+    repairs any drift, e.g. from writes made by other processes.
+    """
+
+    def __init__(self, reconcile_interval: float = 300.0):
+        self.reconcile_interval = reconcile_interval
+        self.counts: Dict[str, int] = {}
+        self.reconciled_at: Optional[datetime] = None
+        self.drift_corrections = 0
+        self._etag: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        docs = await db.game_categories.find().to_list(None)
+        if docs:
+            self.counts = {doc["_id"]: doc["count"] for doc in docs if doc["count"] > 0}
+            self._etag = None
+        else:
+            await self.reconcile()
+        if self._task is None and self.reconcile_interval > 0:
+            self._task = asyncio.create_task(self._reconcile_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _reconcile_periodically(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning(f"Category count reconciliation failed: {e}")
+
+    async def apply(self, deltas: Dict[str, int]):
+        """Record games added (+n) or removed (-n) per category"""
+        operations = []
+        for category, delta in deltas.items():
+            if not delta:
+                continue
+            count = self.counts.get(category, 0) + delta
+            if count > 0:
+                self.counts[category] = count
+            else:
+                self.counts.pop(category, None)
+            operations.append(UpdateOne({"_id": category}, {"$inc": {"count": delta}}, upsert=True))
+        if operations:
+            self._etag = None
+            await db.game_categories.bulk_write(operations, ordered=False)
+
+    async def reconcile(self):
+        """Recount from ``games`` and overwrite the materialized counts"""
+        pipeline = [{"$group": {"_id": "$category", "count": {"$sum": 1}}}]
+        counts = {doc["_id"]: doc["count"] async for doc in db.games.aggregate(pipeline)}
+        if self.reconciled_at is not None and counts != self.counts:
+            self.drift_corrections += 1
+        self.counts = counts
+        self._etag = None
+        self.reconciled_at = datetime.utcnow()
+        if counts:
+            await db.game_categories.bulk_write(
+                [ReplaceOne({"_id": category}, {"count": count}, upsert=True)
+                 for category, count in counts.items()],
+                ordered=False,
+            )
+        await db.game_categories.delete_many({"_id": {"$nin": list(counts)}})
+
+    def categories(self) -> List[dict]:
+        return [
+            {"category": category, "count": count}
+            for category, count in sorted(self.counts.items(), key=lambda item: str(item[0]))
+        ]
+
+    @property
+    def etag(self) -> str:
+        """Strong validator of ``categories()``, hashed again only after the counts change"""
+        if self._etag is None:
+            self._etag = content_etag(dumps_json(self.categories()))
+        return self._etag
+
+    def stats(self) -> dict:
+        return {
+            "categories": len(self.counts),
+            "games": sum(self.counts.values()),
+            "reconciled_at": self.reconciled_at.isoformat() if self.reconciled_at else None,
+            "reconcile_interval": self.reconcile_interval,
+            "drift_corrections": self.drift_corrections,
+        }
+
+
+category_counts = CategoryCounts(
+    reconcile_interval=float(os.environ.get('CATEGORY_RECONCILE_INTERVAL', 300))
+)
+
+
+class GamesVersion:
+    """Counter of writes to ``games``, from which game listings get their ETags.
+
+    Creates, deletes and bulk imports bump it, as does every search index
+    rebuild, which is how writes made by other processes are noticed. The
+    random epoch keeps ETags from one run from matching after a restart.
+    """
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.version = 0
+
+    def bump(self):
+        self.version += 1
+
+    def etag(self, query_string: bytes) -> str:
+        """ETag of the listing a query string selects, as of the current version"""
+        return content_etag(f"{self.epoch}:{self.version}:".encode('ascii') + query_string)
+
+
+games_version = GamesVersion()
+
+# Game search index
+SEARCH_FIELDS = (('title', 3.0), ('category', 2.0), ('description', 1.0))
+SEARCH_TOKEN_RE = re.compile(r'[^\W_]+')
+SEARCH_MIN_PREFIX = 2
+SEARCH_MAX_PREFIX_TERMS = 50
+SEARCH_MIN_FUZZY = 4
+
+def search_tokens(text: str) -> List[str]:
+    return SEARCH_TOKEN_RE.findall(text.lower())
+
+def _deletion_variants(term: str) -> set:
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Optimal string alignment distance <= 1 (one insert, delete, substitute or transpose)"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    return a[i + 1:] == b[i + 1:] or (
+        i + 1 < len(a) and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:]
+    )
+
+
+class _InvertedIndex:
+    """Impact-ordered inverted index: term -> {weight: game ids}.
+
+    Weights are field-weighted term frequencies. Grouping postings by weight
+    lets the best matches for a term be read first without scoring every
+    game that contains it; per-game term weights serve random access.
+    """
+
+    def __init__(self):
+        self.docs: Dict[str, dict] = {}
+        self.doc_terms: Dict[str, Dict[str, float]] = {}
+        self.postings: Dict[str, Dict[float, set]] = {}
+        self.term_docs: Dict[str, set] = {}
+        self.by_category: Dict[str, set] = defaultdict(set)
+        self.by_url: Dict[str, str] = {}
+        self.vocabulary: List[str] = []
+        self.variants: Dict[str, set] = defaultdict(set)
+
+    def add(self, doc: dict):
+        doc_id = doc['id']
+        if doc_id in self.docs:
+            self.remove(doc_id)
+        weights: Dict[str, float] = {}
+        for field, weight in SEARCH_FIELDS:
+            for term in search_tokens(str(doc.get(field) or '')):
+                weights[term] = weights.get(term, 0.0) + weight
+        self.docs[doc_id] = game_document(dict(doc))
+        self.doc_terms[doc_id] = weights
+        self.by_category[doc.get('category')].add(doc_id)
+        self.by_url[doc.get('game_url')] = doc_id
+        for term, weight in weights.items():
+            groups = self.postings.get(term)
+            if groups is None:
+                groups = self.postings[term] = {}
+                self.term_docs[term] = set()
+                insort(self.vocabulary, term)
+                if len(term) >= SEARCH_MIN_FUZZY:
+                    for variant in _deletion_variants(term):
+                        self.variants[variant].add(term)
+            groups.setdefault(weight, set()).add(doc_id)
+            self.term_docs[term].add(doc_id)
+
+    def remove(self, doc_id: str):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        category = self.by_category[doc.get('category')]
+        category.discard(doc_id)
+        if not category:
+            del self.by_category[doc.get('category')]
+        if self.by_url.get(doc.get('game_url')) == doc_id:
+            del self.by_url[doc.get('game_url')]
+        for term, weight in self.doc_terms.pop(doc_id).items():
+            groups = self.postings[term]
+            groups[weight].discard(doc_id)
+            if not groups[weight]:
+                del groups[weight]
+            docs = self.term_docs[term]
+            docs.discard(doc_id)
+            if not docs:
+                del self.postings[term], self.term_docs[term]
+                del self.vocabulary[bisect_left(self.vocabulary, term)]
+                if len(term) >= SEARCH_MIN_FUZZY:
+                    for variant in _deletion_variants(term):
+                        self.variants[variant].discard(term)
+                        if not self.variants[variant]:
+                            del self.variants[variant]
+
+    def expand(self, term: str, prefix: bool) -> Dict[str, float]:
+        """Indexed terms matching a query term, with a match quality in (0, 1].
+
+        Prefixes are only expanded for the word being typed (``prefix``) and
+        typos are only tolerated for words that do not occur as typed.
+        """
+        matches: Dict[str, float] = {}
+        if prefix and len(term) >= SEARCH_MIN_PREFIX:
+            start = bisect_left(self.vocabulary, term)
+            for candidate in self.vocabulary[start:start + SEARCH_MAX_PREFIX_TERMS]:
+                if not candidate.startswith(term):
+                    break
+                matches[candidate] = 0.5 + 0.4 * len(term) / len(candidate)
+        if term in self.postings:
+            matches[term] = 1.0
+        elif len(term) >= SEARCH_MIN_FUZZY:
+            candidates = set(self.variants.get(term, ()))
+            for variant in _deletion_variants(term):
+                if variant in self.postings:
+                    candidates.add(variant)
+                candidates.update(self.variants.get(variant, ()))
+            for candidate in candidates:
+                if candidate not in matches and _within_one_edit(term, candidate):
+                    matches[candidate] = 0.5
+        return matches
+
+    def _sources(self, term: str, prefix: bool) -> List[tuple]:
+        """``(indexed term, score per unit of weight)`` for each match of a query term"""
+        total_docs = len(self.docs) or 1
+        return [
+            (match, quality * math.log(1 + total_docs / len(self.term_docs[match])))
+            for match, quality in self.expand(term, prefix).items()
+        ]
+
+    def _matching(self, sources: List[tuple]) -> set:
+        if len(sources) == 1:
+            return self.term_docs[sources[0][0]]
+        return set().union(*(self.term_docs[match] for match, _ in sources))
+
+    def search(self, terms: List[str], limit: int, category: Optional[str] = None) -> tuple:
+        per_term = [self._sources(term, position == len(terms) - 1) for position, term in enumerate(terms)]
+        if not all(per_term):
+            return 0, []
+
+        # Games matching every term (and the category), counted with set operations
+        if len(per_term) == 1 and len(per_term[0]) == 1 and category is None:
+            matched = None
+            total = len(self.term_docs[per_term[0][0][0]])
+        else:
+            sets = sorted((self._matching(sources) for sources in per_term), key=len)
+            if category is not None:
+                sets.insert(0, self.by_category.get(category, set()))
+            matched = sets[0].intersection(*sets[1:])
+            total = len(matched)
+        if not total:
+            return 0, []
+
+        # Threshold algorithm: consume impact groups from the highest score down
+        # (whichever term's next group scores highest), scoring each new game
+        # fully, until no unseen game can beat the current top results
+        streams = [
+            sorted(
+                ((weight * factor, docs) for match, factor in sources
+                 for weight, docs in self.postings[match].items()),
+                key=itemgetter(0),
+                reverse=True,
+            )
+            for sources in per_term
+        ]
+        positions = [0] * len(streams)
+
+        def level(stream: int) -> float:
+            groups = streams[stream]
+            return groups[positions[stream]][0] if positions[stream] < len(groups) else 0.0
+
+        def full_score(doc_id: str) -> float:
+            terms_of_doc = self.doc_terms[doc_id]
+            return sum(
+                max(terms_of_doc.get(match, 0.0) * factor for match, factor in sources)
+                for sources in per_term
+            )
+
+        top: List[tuple] = []
+        seen: set = set()
+        while True:
+            levels = [level(stream) for stream in range(len(streams))]
+            if not max(levels) or (len(top) == limit and top[0][0] >= sum(levels)):
+                break
+            stream = levels.index(max(levels))
+            docs = streams[stream][positions[stream]][1]
+            positions[stream] += 1
+            candidates = docs - seen if matched is None else (docs & matched) - seen
+            if not candidates:
+                continue
+            seen |= candidates
+            if len(streams) == 1:
+                # One term: every game first seen in this group scores the group's level
+                scored = zip([levels[0]] * limit, candidates)
+            else:
+                scored = zip(map(full_score, candidates), candidates)
+            top = heapq.nlargest(limit, chain(top, scored), key=itemgetter(0))
+            top.reverse()
+        top.sort(reverse=True)
+        return total, [(self.docs[doc_id], score) for score, doc_id in top]
+
+
+class GameSearchIndex:
+    """In-process full-text index over game title, category and description.
+
+    Built from Mongo at startup; creates, deletes and bulk imports made
+    through this process are applied incrementally, including while a
+    rebuild is in progress. Writes this process never sees (other API
+    workers, edits made directly in Mongo) are only picked up by a full
+    rebuild, so deployments with several workers can opt into one every
+    ``rebuild_interval`` seconds; 0 (the default) builds once. Results of
+    recent queries are kept until the next change to the index.
+    """
+
+    def __init__(self, rebuild_interval: float = 0.0, max_cached_queries: int = 1024):
+        self.rebuild_interval = rebuild_interval
+        self.max_cached_queries = max_cached_queries
+        self._results: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.ready = False
+        self.built_at: Optional[datetime] = None
+        self._index = _InvertedIndex()
+        self._changes: Optional[list] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._rebuild_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _rebuild_periodically(self):
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.warning(f"Game search index rebuild failed: {e}")
+            if self.rebuild_interval <= 0:
+                return
+            await asyncio.sleep(self.rebuild_interval)
+
+    async def rebuild(self):
+        index = _InvertedIndex()
+        self._changes = []
+        try:
+            async for doc in db.games.find({}, {"_id": 0}).batch_size(1000):
+                index.add(doc)
+            # Replay writes made while the catalog was being read
+            for method, arg in self._changes:
+                getattr(index, method)(arg)
+        finally:
+            self._changes = None
+        self._index = index
+        self._results.clear()
+        self.ready = True
+        self.built_at = datetime.utcnow()
+        games_version.bump()
+
+    def add(self, doc: dict):
+        self._index.add(doc)
+        self._results.clear()
+        if self._changes is not None:
+            self._changes.append(('add', doc))
+
+    def remove(self, doc_id: str):
+        self._index.remove(doc_id)
+        self._results.clear()
+        if self._changes is not None:
+            self._changes.append(('remove', doc_id))
+
+    def document(self, game_url: str) -> Optional[dict]:
+        """The indexed game with this ``game_url``, if any"""
+        doc_id = self._index.by_url.get(game_url)
+        return self._index.docs.get(doc_id) if doc_id is not None else None
+
+    def search(self, query: str, limit: int = 20, category: Optional[str] = None) -> tuple:
+        """``(total matches, [(game, score), ...])``, memoized until the index changes"""
+        terms = list(dict.fromkeys(search_tokens(query)))
+        if not terms:
+            return 0, []
+        key = (tuple(terms), limit, category)
+        result = self._results.get(key)
+        if result is None:
+            result = self._index.search(terms, limit, category)
+            self._results[key] = result
+            if len(self._results) > self.max_cached_queries:
+                self._results.popitem(last=False)
+        else:
+            self._results.move_to_end(key)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "games": len(self._index.docs),
+            "terms": len(self._index.postings),
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+            "rebuild_interval": self.rebuild_interval,
+        }
+
+
+game_search_index = GameSearchIndex(
+    # Only needed when other processes write games too, e.g. several API workers
+    rebuild_interval=float(os.environ.get('GAME_SEARCH_REBUILD_INTERVAL', 0))
+)
+
 @api_router.post("/games", response_model=Game)
 async def create_game(game: GameCreate):
     """Add a new game to the collection"""
     game_dict = game.dict()
     game_obj = Game(**game_dict)
-    await db.games.insert_one(game_obj.dict())
+    with metrics.stage('mongo'):
+        await db.games.insert_one(game_obj.dict())
+        await category_counts.apply({game_obj.category: 1})
+    games_version.bump()
+    game_search_index.add(game_obj.dict())
     return game_obj
 
-@api_router.get("/games", response_model=List[Game])
-async def get_games(category: Optional[str] = None):
-    """Get all games or games by category"""
-    query = {}
-    if category:
-        query["category"] = category
-    
-    games = await db.games.find(query).to_list(1000)
-    return [Game(**game) for game in games]
+# Bulk game import
+GAMES_BULK_CHUNK_SIZE = int(os.environ.get('GAMES_BULK_CHUNK_SIZE', 1000))
+GAMES_BULK_MAX_ERRORS = 1000
+NDJSON_MEDIA_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+async def iter_bulk_records(http_request: Request):
+    """Yield ``(index, record, error)`` from a JSON array body or a streamed NDJSON body"""
+    if media_type(http_request.headers.get('content-type')) in NDJSON_MEDIA_TYPES:
+        index = 0
+        pending = b''
+        async for chunk in http_request.stream():
+            *lines, pending = (pending + chunk).split(b'\n')
+            for line in lines:
+                if line.strip():
+                    try:
+                        yield index, json.loads(line), None
+                    except ValueError as e:
+                        yield index, None, f"Invalid JSON: {e}"
+                    index += 1
+        if pending.strip():
+            try:
+                yield index, json.loads(pending), None
+            except ValueError as e:
+                yield index, None, f"Invalid JSON: {e}"
+        return
+
+    try:
+        records = json.loads(await http_request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if not isinstance(records, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of games")
+    for index, record in enumerate(records):
+        yield index, record, None
+
+
+class BulkImport:
+    """Validates games chunk by chunk and upserts them on ``game_url``.
+
+    Each chunk is one unordered ``bulk_write``; the next chunk is validated
+    while the previous one is being written. Before writing, one indexed
+    query reads the chunk's games that already exist, which gives the old
+    categories for the counts and the documents for the search index.
+    Invalid records and write errors are reported per record without
+    aborting the import.
+    """
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.received = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+        self.category_deltas: Dict[str, int] = defaultdict(int)
+        self._chunk: Dict[str, tuple] = {}
+
+    def error(self, index: int, message: str):
+        self.failed += 1
+        if len(self.errors) < GAMES_BULK_MAX_ERRORS:
+            self.errors.append({"index": index, "error": message})
+
+    def add(self, index: int, record) -> bool:
+        """Validate one record; returns True once a full chunk is ready to write"""
+        self.received += 1
+        try:
+            game = GameCreate.model_validate(record)
+        except ValueError as e:
+            self.error(index, str(e))
+            return False
+        # Within a chunk the last record for a game_url wins
+        self._chunk[game.game_url] = (index, game)
+        return len(self._chunk) >= self.chunk_size
+
+    def take_chunk(self) -> List[tuple]:
+        chunk, self._chunk = list(self._chunk.values()), {}
+        return chunk
+
+    async def write(self, chunk: List[tuple]):
+        now = datetime.utcnow()
+        ids = [str(uuid.uuid4()) for _ in chunk]
+        fields = [game.model_dump() for _, game in chunk]
+        with metrics.stage('mongo'):
+            stored = {
+                doc['game_url']: doc
+                async for doc in db.games.find(
+                    {"game_url": {"$in": [game.game_url for _, game in chunk]}}, {"_id": 0}
+                )
+            }
+        operations = [
+            UpdateOne(
+                {"game_url": game.game_url},
+                {"$set": fields[position], "$setOnInsert": {"id": ids[position], "created_at": now}},
+                upsert=True,
+            )
+            for position, (_, game) in enumerate(chunk)
+        ]
+        failed = set()
+        try:
+            with metrics.stage('mongo'):
+                result = await db.games.bulk_write(operations, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for write_error in details.get('writeErrors', []):
+                position = write_error['index']
+                failed.add(position)
+                self.error(chunk[position][0], write_error.get('errmsg', 'write failed'))
+        upserted = {item['index'] for item in details.get('upserted', [])}
+        self.inserted += len(upserted)
+        self.updated += details.get('nModified', 0)
+        self.unchanged += details.get('nMatched', 0) - details.get('nModified', 0)
+
+        documents = []
+        unread = []
+        for position, (_, game) in enumerate(chunk):
+            if position in upserted:
+                self.category_deltas[game.category] += 1
+                documents.append({**fields[position], "id": ids[position], "created_at": now})
+            elif position in failed:
+                continue
+            elif game.game_url in stored:
+                previous = stored[game.game_url]
+                if previous.get('category') != game.category:
+                    self.category_deltas[previous.get('category')] -= 1
+                    self.category_deltas[game.category] += 1
+                documents.append({**previous, **fields[position]})
+            else:
+                unread.append(game.game_url)
+        if unread:
+            # Inserted by another writer between our read and our write
+            async for doc in db.games.find({"game_url": {"$in": unread}}, {"_id": 0}):
+                documents.append(doc)
+        for doc in documents:
+            game_search_index.add(doc)
+
+    def result(self) -> dict:
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+@api_router.post("/games/bulk")
+async def bulk_import_games(
+    http_request: Request,
+    chunk_size: int = Query(GAMES_BULK_CHUNK_SIZE, ge=1, le=10000),
+):
+    """Import many games from a JSON array or NDJSON body, upserting on game_url"""
+    job = BulkImport(chunk_size)
+    writing: Optional[asyncio.Task] = None
+    try:
+        async for index, record, error in iter_bulk_records(http_request):
+            if error is not None:
+                job.received += 1
+                job.error(index, error)
+            elif job.add(index, record):
+                if writing is not None:
+                    await writing
+                writing = asyncio.create_task(job.write(job.take_chunk()))
+        if writing is not None:
+            await writing
+            writing = None
+        chunk = job.take_chunk()
+        if chunk:
+            await job.write(chunk)
+    finally:
+        if writing is not None:
+            writing.cancel()
+        games_version.bump()
+
+    await category_counts.apply(job.category_deltas)
+    return job.result()
+
+@api_router.get("/games", responses=GAMES_LIST_RESPONSES)
+async def get_games(
+    http_request: Request,
+    category: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000),
+    sort: str = Query('created_at', pattern=r'^-?(created_at|title)$'),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = Query('json', pattern=r'^(json|ndjson)$'),
+):
+    """Get games (optionally by category) one keyset page at a time.
+
+    The cursor for the next page is returned in the ``X-Next-Cursor`` and
+    ``Link`` headers; ``format=ndjson`` streams the whole catalog instead.
+    """
+    projection = games_projection(fields, sort)
+    direction = -1 if sort.startswith('-') else 1
+    sort_spec = [(sort.lstrip('-'), direction), ("id", direction)]
+
+    if format == 'ndjson':
+        return StreamingResponse(
+            export_games_ndjson(games_query(category, sort, None), projection, sort_spec),
+            media_type="application/x-ndjson",
+        )
+
+    with metrics.stage('mongo'):
+        games = await db.games.find(games_query(category, sort, cursor), projection) \
+            .sort(sort_spec).limit(limit + 1).to_list(limit + 1)
+
+    headers = {}
+    if len(games) > limit:
+        games = games[:limit]
+        next_cursor = encode_games_cursor(sort, games[-1])
+        headers["X-Next-Cursor"] = next_cursor
+        next_url = http_request.url.include_query_params(cursor=next_cursor)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    defaults = game_field_defaults(projection)
+    if defaults:
+        games = [{**defaults, **game} for game in games]
+    return FastJSONResponse(content=games, headers=headers)
+
+@api_router.get("/games/search")
+async def search_games(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    category: Optional[str] = None,
+):
+    """Ranked full-text search over title, category and description.
+
+    Every query word must match a word of the game exactly, as a prefix or
+    with one typo; title matches rank above category and description ones.
+    """
+    with metrics.stage('search'):
+        total, hits = game_search_index.search(q, limit, category)
+    return {
+        "query": q,
+        "total": total,
+        "results": [dict(game, score=round(score, 4)) for game, score in hits],
+    }
 
 @api_router.get("/games/categories")
 async def get_game_categories():
     """Get all available game categories"""
-    pipeline = [
-        {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-        {"$sort": {"_id": 1}}
-    ]
-    categories = await db.games.aggregate(pipeline).to_list(100)
-    return [{"category": cat["_id"], "count": cat["count"]} for cat in categories]
+    return category_counts.categories()
+
+# Counts change with every write; the listing is revalidated on each use
+cache_policies.add(
+    '/api/games', 'public, no-cache', etag=lambda scope: games_version.etag(scope['query_string'])
+)
+cache_policies.add('/api/games/categories', 'public, max-age=30', etag=lambda scope: category_counts.etag)
 
 @api_router.delete("/games/{game_id}")
 async def delete_game(game_id: str):
     """Delete a game"""
-    result = await db.games.delete_one({"id": game_id})
-    if result.deleted_count == 0:
+    with metrics.stage('mongo'):
+        deleted = await db.games.find_one_and_delete({"id": game_id}, projection={"category": 1})
+        if deleted is not None:
+            await category_counts.apply({deleted["category"]: -1})
+            game_search_index.remove(game_id)
+            games_version.bump()
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Game not found")
     return {"message": "Game deleted successfully"}
 
 # GN-Math.dev proxy for direct access to games
 @api_router.get("/gnmath-proxy")
-async def gnmath_proxy():
+async def gnmath_proxy(http_request: Request):
     """Direct proxy to gn-math.dev for GN-Math games"""
     try:
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-            }
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        }
+        accept_encoding = http_request.headers.get('accept-encoding', '')
             
-            response = await client.get('https://gn-math.dev/', headers=headers)
+        response = await fetch_upstream(GN_MATH_PORTAL_URL, headers=headers, endpoint='gnmath_proxy')
             
-            if response.status_code == 200:
-                content = response.text
-                
-                # Fix relative URLs to work within iframe
-                content = re.sub(r'href="(/[^"]*)"', r'href="https://gn-math.dev\1"', content)
-                content = re.sub(r'src="(/[^"]*)"', r'src="https://gn-math.dev\1"', content)
-                content = re.sub(r"href='(/[^']*)'", r"href='https://gn-math.dev\1'", content)
-                content = re.sub(r"src='(/[^']*)'", r"src='https://gn-math.dev\1'", content)
-                
-                return Response(content=content, media_type="text/html")
-            else:
-                raise HTTPException(status_code=response.status_code, detail="Failed to load gn-math.dev")
+        if response.status_code == 200:
+            # Fix relative URLs to work within iframe
+            return await memoized_rewritten_html(
+                response, GN_MATH_PORTAL_URL, HtmlUrlRewriter(GN_MATH_PORTAL_URL), accept_encoding,
+                hints=True,
+            )
+        else:
+            await response.aclose()
+            raise HTTPException(status_code=response.status_code, detail="Failed to load gn-math.dev")
                 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"GN-Math proxy error: {str(e)}")
 
+cache_policies.add('/api/gnmath-proxy', 'public, max-age=60, stale-while-revalidate=600')
+
 # Remove the games initialization - we'll just have the GN-Math portal
 
 # Smart proxy that handles both search queries and URLs
 @api_router.post("/smart-proxy")
-async def smart_proxy(request: ProxyRequest):
+async def smart_proxy(request: ProxyRequest, http_request: Request):
     """Smart proxy that handles both search queries and direct URLs"""
+    return await smart_proxy_response(request.url, http_request)
+
+@api_router.get("/smart-proxy")
+async def smart_proxy_page(http_request: Request, q: str = Query(...)):
+    """GET form of the smart proxy, addressable as an iframe src so the page renders as it streams in"""
+    return await smart_proxy_response(q, http_request)
+
+async def smart_proxy_response(query: str, http_request: Request):
     try:
-        query = request.url.strip()
+        query = query.strip()
         import urllib.parse
 
         # Detect if input looks like a URL
@@ -216,32 +4317,22 @@ async def smart_proxy(request: ProxyRequest):
             encoded_query = urllib.parse.quote_plus(query)
             target_url = f"https://duckduckgo.com/html/?q={encoded_query}"
 
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-            }
-            response = await client.get(target_url, headers=headers)
-            content_type = response.headers.get('content-type', 'text/html')
-
-            if 'text/html' in content_type:
-                content = response.text
-                base_url = f"{urlparse(target_url).scheme}://{urlparse(target_url).netloc}"
-
-                # Fix relative URLs
-                content = re.sub(r'href="(/[^"]*)"', f'href="{base_url}\\1"', content)
-                content = re.sub(r'src="(/[^"]*)"', f'src="{base_url}\\1"', content)
-                content = re.sub(r"href='(/[^']*)'", f"href='{base_url}\\1'", content)
-                content = re.sub(r"src='(/[^']*)'", f"src='{base_url}\\1'", content)
-                content = re.sub(r'action="(/[^"]*)"', f'action="{base_url}\\1"', content)
-
-                # Fix protocol-relative URLs
-                content = re.sub(r'href="//', 'href="https://', content)
-                content = re.sub(r'src="//', 'src="https://', content)
-
-                return Response(content=content, media_type="text/html")
-            else:
-                return Response(content=response.content, media_type=content_type)
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        }
+        headers.update(forwarded_request_headers(http_request))
+        accept_encoding = http_request.headers.get('accept-encoding', '')
+        response = await fetch_upstream(
+            target_url, headers=headers, endpoint='smart_proxy', accept_encoding=accept_encoding
+        )
+        if rewritable_html(response):
+            # Fix relative and protocol-relative URLs
+            return stream_rewritten_html(response, HtmlUrlRewriter(target_url))
+        else:
+            return stream_upstream_response(response, accept_encoding)
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Smart proxy error: {str(e)}")
 # Get search suggestions (optional enhancement)
@@ -249,79 +4340,566 @@ async def smart_proxy(request: ProxyRequest):
 async def get_search_suggestions(q: str = Query(...)):
     """Get search suggestions for autocomplete"""
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            # Use Google's suggestion API
-            response = await client.get(
-                f"https://suggestqueries.google.com/complete/search?client=firefox&q={q}"
-            )
-            if response.status_code == 200:
-                return {"suggestions": response.json()[1][:5]}  # Return top 5 suggestions
-            return {"suggestions": []}
+        # Use Google's suggestion API behind the prefix cache
+        suggestions = await suggestion_service.suggest(q)
+        return {"suggestions": suggestions[:5]}  # Return top 5 suggestions
     except:
         return {"suggestions": []}
 
 # GN-Math specific proxy
 @api_router.get("/gn-math-proxy")
-async def gn_math_proxy(game: str = Query(...)):
+async def gn_math_proxy(http_request: Request, game: str = Query(...)):
     """Specific proxy for GN-Math games"""
     try:
+        stored = await serve_gn_math_store(http_request, game, 'index.html')
+        if stored is not None:
+            return stored
+
         # Try to access the game directly from the repository
-        base_urls = [
-            f"https://gn-math.github.io/{game}/",
-            f"https://raw.githubusercontent.com/genizy/web-port/main/{game}/index.html",
-            f"https://genizy.github.io/web-port/{game}/"
-        ]
+        base_urls = [mirror.format(game=game) for mirror in GN_MATH_MIRRORS]
         
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-            }
+        # The entry page is always fetched whole: a byte range of it must never be rewritten or memoized
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        }
+        accept_encoding = http_request.headers.get('accept-encoding', '')
             
-            for url in base_urls:
-                try:
-                    response = await client.get(url, headers=headers)
-                    if response.status_code == 200:
-                        content_type = response.headers.get('content-type', 'text/html')
-                        
-                        if 'text/html' in content_type:
-                            content = response.text
-                            # Fix relative URLs for the game
-                            game_base = f"https://gn-math.github.io/{game}"
-                            content = re.sub(r'href="([^http][^"]*)"', f'href="{game_base}/\\1"', content)
-                            content = re.sub(r'src="([^http][^"]*)"', f'src="{game_base}/\\1"', content)
-                            
-                            return Response(content=content, media_type="text/html")
-                        else:
-                            return Response(content=response.content, media_type=content_type)
-                except:
-                    continue
+        async def fetch(url):
+            return await fetch_upstream(
+                url, headers=headers, endpoint='gn_math_proxy', accept_encoding=accept_encoding
+            )
+
+        # Race the mirrors, fastest-known first, skipping known 404s
+        url, response = await gn_math_mirrors.race(game, base_urls, fetch)
+        if response is not None:
+            content_type = response.headers.get('content-type', 'text/html')
+                
+            if response.status_code == 200 and 'text/html' in content_type:
+                # Relative URLs go through the game file route, so they hit the store and caches
+                rewriter = HtmlUrlRewriter(url, relative_base=f"/api/gn-math/{game}")
+                return await memoized_rewritten_html(response, url, rewriter, accept_encoding, hints=True)
+            else:
+                return stream_upstream_response(response, accept_encoding)
                     
         raise HTTPException(status_code=404, detail=f"Game '{game}' not found in GN-Math repository")
         
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"GN-Math proxy error: {str(e)}")
 
+# GN-Math game files, from the local mirror store with upstream fallback
+@api_router.get("/gn-math/{game}/{path:path}")
+async def gn_math_file(http_request: Request, game: str, path: str):
+    """Serve one file of a GN-Math game; relative URLs in its pages resolve here"""
+    if not GN_MATH_GAME_RE.match(game):
+        raise HTTPException(status_code=404, detail="Unknown game")
+    path = store_path(path)
+    stored = await serve_gn_math_store(http_request, game, path)
+    if stored is not None:
+        return stored
+    gn_math_store.note_miss(game, path)
+
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+    }
+    if not path.endswith(HTML_PATH_EXTENSIONS):
+        # Byte ranges are for media and assets; pages are fetched whole so they can be rewritten
+        headers.update(forwarded_request_headers(http_request))
+    accept_encoding = http_request.headers.get('accept-encoding', '')
+    try:
+        mirror_url, response = await fetch_gn_math_file(game, path, headers, accept_encoding)
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"GN-Math proxy error: {str(e)}")
+    if response is None:
+        raise HTTPException(status_code=404, detail=f"'{path}' not found for game '{game}'")
+    if response.status_code == 200 and 'text/html' in response.headers.get('content-type', ''):
+        rewriter = HtmlUrlRewriter(mirror_url, relative_base=f"/api/gn-math/{game}/{posixpath.dirname(path)}")
+        return await memoized_rewritten_html(
+            response, mirror_file_url(mirror_url, path), rewriter, accept_encoding, hints=True
+        )
+    return stream_upstream_response(response, accept_encoding)
+
 # Get available GN-Math games
+# Seed catalog, used until the first discovery succeeds
+GN_MATH_GAMES = [
+    "undertale", "omori-fixed", "pizza-tower", "cuphead", "hotline-miami",
+    "buckshot-roulette", "baldi-plus", "ultrakill", "thats-not-my-neighbor", 
+    "people-playground", "amanda-the-adventurer", "andys-apple-farm", 
+    "baldi-remaster", "bendy", "bergentruck", "bloodmoney", "class-of-09",
+    "dead-plate", "deadseat", "donottakethiscathome", "fears-to-fathom",
+    "happy-sheepies", "jelly-drift", "karlson", "kindergarten",
+    "lacysflashgames", "milkman-karlson", "raft", "slender", "speed-stars",
+    "the-man-in-the-window", "undertale-yellow", "web-fishing", "yume-nikki"
+]
+GN_MATH_CATALOG_URL = os.environ.get(
+    'GN_MATH_CATALOG_URL', 'https://api.github.com/repos/genizy/web-port/contents/'
+)
+
+def parse_game_catalog(payload) -> List[dict]:
+    """Games from a repository directory listing, a list of names or ``{"games": [...]}``"""
+    if isinstance(payload, dict):
+        payload = payload.get('games', [])
+    games = []
+    for item in payload if isinstance(payload, list) else []:
+        if isinstance(item, str):
+            item = {'name': item}
+        elif not isinstance(item, dict) or item.get('type', 'dir') != 'dir':
+            continue
+        slug = item.get('name') or item.get('id') or ''
+        if GN_MATH_GAME_RE.match(slug):
+            games.append({'id': slug, 'title': item.get('title'), 'thumbnail': item.get('thumbnail')})
+    return games
+
+
+class GameCatalog:
+    """GN-Math game catalog, rediscovered from the upstream repository in the background.
+
+    Requests are served from an in-memory snapshot whose JSON body and ETag
+    are built once per change. Games persist in the ``gn_math_games``
+    collection so a restart serves the last known catalog immediately;
+    newly discovered games are announced to ``on_added`` listeners. The
+    first discovery after starting from the built-in seed list only seeds
+    the known set: announcing it would warm the whole catalog at once.
+    """
+
+    def __init__(self, source_url: str, refresh_interval: float = 3600.0):
+        self.source_url = source_url
+        self.refresh_interval = refresh_interval
+        self.games: Dict[str, dict] = {}
+        self.body = b''
+        self.etag = ''
+        self.refreshed_at: Optional[datetime] = None
+        self.counters: Dict[str, int] = defaultdict(int)
+        self._source_etag: Optional[str] = None
+        # Whether ``games`` came from a discovery (now or persisted by an earlier run)
+        self._discovered = False
+        self._listeners = []
+        self._task: Optional[asyncio.Task] = None
+
+    def on_added(self, callback):
+        """Register ``callback(games)`` for newly discovered game names"""
+        self._listeners.append(callback)
+
+    def names(self) -> List[str]:
+        return list(self.games)
+
+    async def start(self):
+        try:
+            docs = await db.gn_math_games.find().to_list(None)
+        except Exception as e:
+            logger.warning(f"Could not load the GN-Math catalog: {e}")
+            docs = []
+        if docs:
+            for doc in docs:
+                for field in ('added_at', 'seen_at'):
+                    doc[field] = doc[field].replace(tzinfo=timezone.utc)
+            self._publish({doc.pop('_id'): doc for doc in docs})
+            self._discovered = True
+        else:
+            now = datetime.now(timezone.utc)
+            self._publish({
+                slug: self._document(slug, None, None, {'added_at': now, 'seen_at': now})
+                for slug in GN_MATH_GAMES
+            })
+        if self._task is None and self.refresh_interval > 0:
+            self._task = asyncio.create_task(self._refresh_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _refresh_periodically(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.counters['failures'] += 1
+                logger.warning(f"GN-Math catalog refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    @staticmethod
+    def _document(slug: str, title: Optional[str], thumbnail: Optional[str], previous: dict) -> dict:
+        return {
+            'title': title or previous.get('title') or slug.replace('-', ' ').title(),
+            'thumbnail': thumbnail or previous.get('thumbnail'),
+            'url': GN_MATH_MIRRORS[0].format(game=slug),
+            'added_at': previous['added_at'],
+            'seen_at': previous['seen_at'],
+        }
+
+    async def refresh(self):
+        """Rediscover the catalog; unchanged upstream listings cost one conditional GET"""
+        headers = {'Accept': 'application/json'}
+        if self._source_etag:
+            headers['If-None-Match'] = self._source_etag
+        response = await upstream_pool.open(self.source_url, headers=headers, priority=PRIORITY_BACKGROUND)
+        try:
+            if response.status_code == 304:
+                self.counters['not_modified'] += 1
+                self.refreshed_at = datetime.now(timezone.utc)
+                return
+            if response.status_code != 200:
+                raise RuntimeError(f"catalog source answered {response.status_code}")
+            await response.aread()
+        finally:
+            await response.aclose()
+        discovered = parse_game_catalog(response.json())
+        if not discovered:
+            raise RuntimeError("catalog source listed no games")
+
+        now = datetime.now(timezone.utc)
+        games = {
+            game['id']: self._document(
+                game['id'], game['title'], game['thumbnail'],
+                {**self.games.get(game['id'], {'added_at': now}), 'seen_at': now},
+            )
+            for game in discovered
+        }
+        added = [slug for slug in games if slug not in self.games]
+        removed = [slug for slug in self.games if slug not in games]
+        try:
+            await db.gn_math_games.bulk_write(
+                [ReplaceOne({'_id': slug}, doc, upsert=True) for slug, doc in games.items()],
+                ordered=False,
+            )
+            if removed:
+                await db.gn_math_games.delete_many({'_id': {'$in': removed}})
+        except Exception as e:
+            logger.warning(f"Could not persist the GN-Math catalog: {e}")
+        self._source_etag = response.headers.get('etag')
+        self._publish(games)
+        self.refreshed_at = now
+        self.counters['refreshes'] += 1
+        self.counters['added'] += len(added)
+        self.counters['removed'] += len(removed)
+        if added and self._discovered:
+            for callback in self._listeners:
+                callback(added)
+        self._discovered = True
+
+    def _publish(self, games: Dict[str, dict]):
+        self.games = dict(sorted(games.items()))
+        catalog = [
+            {'id': slug, 'title': doc['title'], 'thumbnail': doc['thumbnail'],
+             'url': doc['url'], 'added_at': doc['added_at']}
+            for slug, doc in self.games.items()
+        ]
+        self.body = dumps_json({
+            "games": list(self.games),
+            "total": len(self.games),
+            "base_url": "https://gn-math.github.io",
+            "catalog": catalog,
+        })
+        self.etag = '"%s"' % hashlib.sha256(self.body).hexdigest()[:32]
+
+    def response(self) -> Response:
+        # Conditional requests are answered from ``etag`` by ConditionalGetMiddleware
+        headers = {'etag': self.etag} if self.etag else None
+        return Response(content=self.body, media_type='application/json', headers=headers)
+
+    def stats(self) -> dict:
+        return {
+            **{name: self.counters[name] for name in (
+                'refreshes', 'not_modified', 'failures', 'added', 'removed',
+            )},
+            "games": len(self.games),
+            "etag": self.etag,
+            "source": self.source_url,
+            "refreshed_at": self.refreshed_at.isoformat() if self.refreshed_at else None,
+        }
+
+
+class GameCacheWarmer:
+    """Prefetches the entry pages of newly announced games in the background.
+
+    With the local mirror store enabled a game is synced into it; otherwise
+    its entry page is fetched through ``fetch_upstream`` so the response
+    cache holds it before the first player asks.
+    """
+
+    def __init__(self, concurrency: int = 2):
+        self.concurrency = concurrency
+        self.pending: List[str] = []
+        self.counters: Dict[str, int] = defaultdict(int)
+        self._tasks: set = set()
+
+    def announce(self, games: List[str]):
+        self.pending.extend(game for game in games if game not in self.pending)
+        while self.pending and len(self._tasks) < self.concurrency:
+            task = asyncio.create_task(self._drain())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self):
+        while self.pending:
+            game = self.pending.pop(0)
+            try:
+                if await self.warm(game):
+                    self.counters['warmed'] += 1
+                else:
+                    self.counters['failed'] += 1
+            except Exception as e:
+                self.counters['failed'] += 1
+                logger.warning(f"Could not warm GN-Math game {game}: {e}")
+
+    async def warm(self, game: str) -> bool:
+        if gn_math_store.enabled:
+            return await gn_math_store.sync_game(game)
+
+        async def fetch(mirror_url):
+            return await fetch_upstream(mirror_url, endpoint='gn_math_proxy', priority=PRIORITY_BACKGROUND)
+
+        base_urls = [mirror.format(game=game) for mirror in GN_MATH_MIRRORS]
+        _, response = await gn_math_mirrors.race(game, base_urls, fetch)
+        if response is None:
+            return False
+        try:
+            await response.aread()
+        finally:
+            await response.aclose()
+        return True
+
+    async def stop(self):
+        self.pending.clear()
+        for task in list(self._tasks):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "warmed": self.counters['warmed'],
+            "failed": self.counters['failed'],
+            "pending": len(self.pending),
+            "running": len(self._tasks),
+        }
+
+
+gn_math_catalog = GameCatalog(
+    GN_MATH_CATALOG_URL,
+    refresh_interval=float(os.environ.get('GN_MATH_CATALOG_REFRESH_INTERVAL', 3600)),
+)
+gn_math_warmer = GameCacheWarmer(concurrency=int(os.environ.get('GN_MATH_WARM_CONCURRENCY', 2)))
+gn_math_catalog.on_added(gn_math_warmer.announce)
+
 @api_router.get("/gn-math-games")
 async def get_gn_math_games():
     """Get list of available GN-Math games from repository"""
-    gn_math_game_list = [
-        "undertale", "omori-fixed", "pizza-tower", "cuphead", "hotline-miami",
-        "buckshot-roulette", "baldi-plus", "ultrakill", "thats-not-my-neighbor", 
-        "people-playground", "amanda-the-adventurer", "andys-apple-farm", 
-        "baldi-remaster", "bendy", "bergentruck", "bloodmoney", "class-of-09",
-        "dead-plate", "deadseat", "donottakethiscathome", "fears-to-fathom",
-        "happy-sheepies", "jelly-drift", "karlson", "kindergarten",
-        "lacysflashgames", "milkman-karlson", "raft", "slender", "speed-stars",
-        "the-man-in-the-window", "undertale-yellow", "web-fishing", "yume-nikki"
-    ]
-    
+    return gn_math_catalog.response()
+
+cache_policies.add(
+    '/api/gn-math-games', 'public, max-age=60, stale-while-revalidate=600', etag=lambda scope: gn_math_catalog.etag
+)
+
+# Diagnostics
+@api_router.get("/diagnostics/upstream-pool")
+async def get_upstream_pool_stats():
+    """Connection pool stats for the shared upstream client"""
+    return upstream_pool.stats()
+
+@api_router.get("/diagnostics/circuit-breakers")
+async def get_circuit_breaker_stats():
+    """Per-host breaker state, rolling error rate and latency"""
+    return upstream_pool.breakers.stats()
+
+@api_router.get("/diagnostics/conditional-get")
+async def get_conditional_get_stats():
+    """Cache policy per route and how many responses ended as 304s"""
+    return cache_policies.stats()
+
+@api_router.get("/diagnostics/cache")
+async def get_response_cache_stats():
+    """Hit/miss/byte counters for the shared response cache"""
     return {
-        "games": gn_math_game_list,
-        "total": len(gn_math_game_list),
-        "base_url": "https://gn-math.github.io"
+        **response_cache.stats(),
+        "endpoints": sorted(CACHED_ENDPOINTS),
+        "rewritten_html": rewritten_html_cache.stats(),
     }
 
+@api_router.get("/diagnostics/gn-math-mirrors")
+async def get_gn_math_mirror_stats():
+    """Learned mirror preference and known-missing games"""
+    return gn_math_mirrors.stats()
+
+@api_router.get("/diagnostics/gn-math-catalog")
+async def get_gn_math_catalog_stats():
+    """GN-Math catalog refreshes and cache warming"""
+    return {**gn_math_catalog.stats(), "warmer": gn_math_warmer.stats()}
+
+@api_router.get("/diagnostics/prefetch")
+async def get_prefetch_stats():
+    """Background subresource prefetching for served game pages"""
+    return subresource_prefetcher.stats()
+
+@api_router.get("/diagnostics/gn-math-store")
+async def get_gn_math_store_stats():
+    """Local GN-Math mirror store: hits, sync progress, dedup"""
+    return gn_math_store.stats()
+
+@api_router.get("/diagnostics/suggestions")
+async def get_suggestion_cache_stats():
+    """Hit/coalesce counters for the search suggestion cache"""
+    return suggestion_service.stats()
+
+@api_router.get("/diagnostics/single-flight")
+async def get_single_flight_stats():
+    """How many upstream fetches were collapsed into an in-flight request"""
+    return single_flight.stats()
+
+@api_router.get("/diagnostics/status-writer")
+async def get_status_writer_stats():
+    """Write-behind buffer state for status checks"""
+    return status_writer.stats()
+
+@api_router.get("/diagnostics/game-search")
+async def get_game_search_stats():
+    """Size and freshness of the in-memory game search index"""
+    return game_search_index.stats()
+
+@api_router.get("/diagnostics/categories")
+async def get_category_count_stats():
+    """Materialized category count state and reconciliation drift"""
+    return category_counts.stats()
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus text exposition of request and per-stage latency metrics"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Status check write-behind buffer
+STATUS_RETENTION_SECONDS = int(float(os.environ.get('STATUS_RETENTION_DAYS', 30)) * 86400)
+
+async def ensure_status_indexes():
+    await db.status_checks.create_index([("client_name", 1), ("timestamp", -1)])
+    # TTL index: also serves time-range queries without a client filter
+    await db.status_checks.create_index(
+        [("timestamp", 1)], expireAfterSeconds=STATUS_RETENTION_SECONDS
+    )
+
+def utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored as naive UTC; normalize aware query bounds to match"""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class StatusCheckWriter:
+    """Write-behind buffer batching status check inserts.
+
+    Checks are acknowledged immediately and written with one ``insert_many``
+    per batch, flushed once ``max_batch`` are waiting, after ``max_delay``
+    seconds or at shutdown. The same flush bumps the per-client counters
+    in ``status_client_counts``. When ``max_pending`` checks are buffered,
+    new ones wait for a flush instead of growing the buffer.
+    """
+
+    def __init__(self, max_batch: int = 500, max_delay: float = 1.0, max_pending: int = 50000):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.pending: List[dict] = []
+        self.counters: Dict[str, int] = defaultdict(int)
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Dropping {len(self.pending)} unflushed status checks: {e}")
+
+    async def add(self, doc: dict):
+        if len(self.pending) >= self.max_pending:
+            await self.flush()
+        self.pending.append(doc)
+        self.counters['buffered'] += 1
+        if self._task is None:
+            # Not started (app used without lifespan events): write through
+            await self.flush()
+        elif len(self.pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Status check flush failed, will retry: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self.pending:
+                batch = self.pending[:self.max_batch]
+                del self.pending[:self.max_batch]
+                await self._write(batch)
+
+    async def _write(self, batch: List[dict]):
+        try:
+            with metrics.stage('mongo'):
+                await db.status_checks.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            self.counters['dropped'] += len(e.details.get('writeErrors', []))
+        except BaseException:
+            # Put the batch back (as far as the buffer allows) for the next flush,
+            # including when a flush is cancelled at shutdown
+            room = max(0, self.max_pending - len(self.pending))
+            self.pending[:0] = batch[:room]
+            self.counters['dropped'] += len(batch) - room
+            raise
+        self.counters['flushes'] += 1
+        self.counters['written'] += len(batch)
+
+        per_client: Dict[str, list] = {}
+        for doc in batch:
+            seen = per_client.setdefault(doc['client_name'], [0, doc['timestamp']])
+            seen[0] += 1
+            seen[1] = max(seen[1], doc['timestamp'])
+        await db.status_client_counts.bulk_write(
+            [UpdateOne({"_id": name}, {"$inc": {"count": count}, "$max": {"last_seen": last_seen}}, upsert=True)
+             for name, (count, last_seen) in per_client.items()],
+            ordered=False,
+        )
+
+    def buffered(self, client_name: Optional[str], since: Optional[datetime], until: Optional[datetime]) -> List[dict]:
+        """Not-yet-flushed checks matching a query, so reads see their own writes"""
+        return [
+            {key: value for key, value in doc.items() if key != '_id'}
+            for doc in self.pending
+            if (client_name is None or doc['client_name'] == client_name)
+            and (since is None or doc['timestamp'] >= since)
+            and (until is None or doc['timestamp'] < until)
+        ]
+
+    def stats(self) -> dict:
+        return {
+            **{name: self.counters[name] for name in ('buffered', 'written', 'flushes', 'dropped')},
+            "pending": len(self.pending),
+            "max_batch": self.max_batch,
+            "max_delay": self.max_delay,
+        }
+
+
+status_writer = StatusCheckWriter(
+    max_batch=int(os.environ.get('STATUS_FLUSH_SIZE', 500)),
+    max_delay=float(os.environ.get('STATUS_FLUSH_INTERVAL', 1.0)),
+    max_pending=int(os.environ.get('STATUS_BUFFER_LIMIT', 50000)),
+)
+
 # Original routes
 @api_router.get("/")
 async def root():
@@ -331,25 +4909,68 @@ async def root():
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
+    await status_writer.add(status_obj.dict())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+async def get_status_checks(
+    client_name: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=1000),
+):
+    """Newest status checks first, optionally for one client and/or a time window [since, until)"""
+    since, until = utc_naive(since), utc_naive(until)
+    query = {}
+    if client_name is not None:
+        query["client_name"] = client_name
+    if since is not None or until is not None:
+        query["timestamp"] = {
+            **({"$gte": since} if since is not None else {}),
+            **({"$lt": until} if until is not None else {}),
+        }
+    with metrics.stage('mongo'):
+        status_checks = await db.status_checks.find(query, {"_id": 0}) \
+            .sort("timestamp", -1).limit(limit).to_list(limit)
+    pending = status_writer.buffered(client_name, since, until)
+    if pending:
+        status_checks = sorted(pending + status_checks, key=lambda doc: doc['timestamp'], reverse=True)[:limit]
+    return FastJSONResponse(content=status_checks)
+
+@api_router.get("/status/counts")
+async def get_status_check_counts():
+    """Check-ins per client (all time, including pruned checks) and when each was last seen"""
+    with metrics.stage('mongo'):
+        docs = await db.status_client_counts.find().sort("_id", 1).to_list(None)
+    counts = {doc["_id"]: {"count": doc["count"], "last_seen": doc["last_seen"]} for doc in docs}
+    for doc in status_writer.pending:
+        entry = counts.setdefault(doc['client_name'], {"count": 0, "last_seen": doc['timestamp']})
+        entry["count"] += 1
+        entry["last_seen"] = max(entry["last_seen"], doc['timestamp'])
+    return [{"client_name": name, **entry} for name, entry in sorted(counts.items())]
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Innermost, so early 304s still get CORS headers and ETags are hashed before compression
+app.add_middleware(ConditionalGetMiddleware, policies=cache_policies)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Link", "ETag"],
 )
 
+# Inside the metrics middleware, so byte counts reflect what goes on the wire
+if os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true':
+    app.add_middleware(CompressionMiddleware)
+
+# Outermost, so request timings include every other middleware
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -357,6 +4978,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_upstream_client():
+    await upstream_pool.start()
+    response_cache.start()
+
+@app.on_event("startup")
+async def startup_gn_math_store():
+    await gn_math_catalog.start()
+    # Opt-in: enabling it mirrors every catalog game to local disk, up to GN_MATH_STORE_MAX_BYTES
+    if os.environ.get('GN_MATH_STORE', 'false').lower() == 'true':
+        try:
+            await gn_math_store.start(gn_math_catalog.names)
+        except OSError as e:
+            logger.warning(f"Could not open the GN-Math mirror store: {e}")
+
+@app.on_event("startup")
+async def startup_db_indexes():
+    try:
+        await ensure_game_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create game indexes: {e}")
+    try:
+        await ensure_status_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create status check indexes: {e}")
+    status_writer.start()
+    game_search_index.start()
+    try:
+        await category_counts.start()
+    except Exception as e:
+        logger.warning(f"Could not load category counts: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await subresource_prefetcher.stop()
+    await gn_math_catalog.stop()
+    await gn_math_warmer.stop()
+    await gn_math_store.stop()
+    await category_counts.stop()
+    await game_search_index.stop()
+    await status_writer.stop()
     client.close()
+    await upstream_pool.close()
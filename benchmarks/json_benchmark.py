@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for list endpoint serialization
+Compares the old path (one pydantic model per Mongo document, then
+response_model validation and jsonable_encoder in FastAPI) with the
+FastJSONResponse fast path, per item, for games and status checks
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+from server import ORJSON_AVAILABLE, FastJSONResponse, Game, StatusCheck, dumps_json  # noqa: E402
+
+# server.py configures INFO logging; per-request httpx lines would drown the table
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+def build_games(count):
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "title": f"Game number {n}",
+            "description": f"A short description of game {n} for the catalog listing page.",
+            "category": ("action", "puzzle", "racing", "arcade")[n % 4],
+            "game_url": f"https://games.example.com/{n}/index.html",
+            "thumbnail": f"https://games.example.com/{n}/thumb.png" if n % 3 else None,
+            "created_at": start + timedelta(seconds=n, milliseconds=n % 1000),
+        }
+        for n in range(count)
+    ]
+
+
+def build_status_checks(count):
+    start = datetime(2024, 1, 1)
+    return [
+        {"id": str(uuid.uuid4()), "client_name": f"client-{n % 50}", "timestamp": start + timedelta(seconds=n)}
+        for n in range(count)
+    ]
+
+
+def build_app(games, status_checks):
+    app = FastAPI()
+
+    @app.get("/model/games", response_model=List[Game])
+    async def model_games():
+        return [Game(**game) for game in games]
+
+    @app.get("/fast/games", response_model=List[Game])
+    async def fast_games():
+        return FastJSONResponse(content=games)
+
+    @app.get("/model/status", response_model=List[StatusCheck])
+    async def model_status():
+        return [StatusCheck(**check) for check in status_checks]
+
+    @app.get("/fast/status", response_model=List[StatusCheck])
+    async def fast_status():
+        return FastJSONResponse(content=status_checks)
+
+    return app
+
+
+async def time_requests(client, path, repeat):
+    timings = []
+    body = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = await client.get(path)
+        timings.append(time.perf_counter() - start)
+        body = response.content
+    return min(timings), body
+
+
+async def run(args):
+    print(f"orjson: {'yes' if ORJSON_AVAILABLE else 'no (stdlib json fallback)'}")
+    print(f"{'endpoint':>8} {'items':>7} {'model path':>14} {'fast path':>14} "
+          f"{'encode only':>14} {'speedup':>8}")
+    for count in (int(n) for n in args.items.split(',')):
+        games = build_games(count)
+        status_checks = build_status_checks(count)
+        app = build_app(games, status_checks)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            for name, docs in (('games', games), ('status', status_checks)):
+                model, model_body = await time_requests(client, f'/model/{name}', args.repeat)
+                fast, fast_body = await time_requests(client, f'/fast/{name}', args.repeat)
+                if model_body != fast_body:
+                    raise SystemExit(f"{name}: fast path body differs from the model path")
+                encode = min(
+                    _timed(lambda: dumps_json(docs)) for _ in range(args.repeat)
+                )
+                print(f"{name:>8} {count:>7} {model / count * 1e6:>12.2f}us {fast / count * 1e6:>12.2f}us "
+                      f"{encode / count * 1e6:>12.2f}us {model / fast:>7.2f}x")
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', default='100,1000,10000',
+                        help='comma separated list sizes')
+    parser.add_argument('--repeat', type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Async load test and latency benchmark for the AccessAnywhere API
+Starts backend/server.py against a local stand-in upstream (stub_upstream.py)
+and a real or mocked MongoDB, drives each endpoint with configurable
+concurrency and reports throughput, p50/p95/p99 latency and peak server RSS.
+Results are written as JSON so runs can be compared between commits.
+
+Examples:
+    python benchmarks/load_test.py --mock-mongo --output results.json
+    python benchmarks/load_test.py --mongo-url mongodb://localhost:27017 \\
+        --scenarios proxy-html,games-list --concurrency 64 --compare results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_DIR = ROOT / 'benchmarks'
+
+# name -> (method, path, json body factory or None); {stub} is the upstream base URL
+SCENARIOS = {
+    'root': ('GET', '/api/', None),
+    'status-write': ('POST', '/api/status', lambda: {"client_name": f"bench-{uuid.uuid4().hex[:8]}"}),
+    'status-read': ('GET', '/api/status', None),
+    'games-list': ('GET', '/api/games', None),
+    'game-categories': ('GET', '/api/games/categories', None),
+    'gn-math-games': ('GET', '/api/gn-math-games', None),
+    'proxy-html': ('GET', '/api/proxy-direct?url={stub}/page.html', None),
+    'proxy-binary': ('GET', '/api/proxy-direct?url={stub}/asset.bin', None),
+    'proxy-slow': ('GET', '/api/proxy-direct?url={stub}/slow?delay=0.2', None),
+    'proxy-post': ('POST', '/api/proxy', lambda: {"url": STUB_URL + '/page.html'}),
+    'smart-proxy': ('POST', '/api/smart-proxy', lambda: {"url": STUB_URL + '/page.html'}),
+    'smart-proxy-page': ('GET', '/api/smart-proxy?q={stub}/page.html', None),
+    'gnmath-portal': ('GET', '/api/gnmath-proxy', None),
+    'gn-math-game': ('GET', '/api/gn-math-proxy?game=demo', None),
+    'search-suggestions': ('GET', '/api/search-suggestions?q=minecraft', None),
+    # BULK_BATCH new games per request, then the same fixed batch again and again
+    'games-bulk-import': ('POST', '/api/games/bulk', lambda: bulk_games(uuid.uuid4().hex)),
+    'games-bulk-reimport': ('POST', '/api/games/bulk', lambda: bulk_games('reimport')),
+}
+
+STUB_URL = ''
+BULK_BATCH = 1000
+
+
+def bulk_games(prefix):
+    categories = ['action', 'puzzle', 'horror', 'racing', 'platformer']
+    return [
+        {
+            "title": f"Bulk game {prefix} {n}",
+            "description": f"Bulk imported benchmark game number {n}",
+            "category": categories[n % len(categories)],
+            "game_url": f"https://example.com/bulk/{prefix}/{n}",
+        }
+        for n in range(BULK_BATCH)
+    ]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def peak_rss_mb(pid):
+    """Peak resident set size of a process (VmHWM) in MB, Linux only"""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss(pid):
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Environment:
+    """Stub upstream, optional mongod and the API server as child processes"""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = []
+        self.tmp = Path(tempfile.mkdtemp(prefix='betterplay-bench-'))
+        self.server_pid = None
+        self.server_url = None
+        self.stub_url = None
+
+    def spawn(self, name, cmd, env=None):
+        # Child output (the API server logs every upstream request) goes to a file
+        log = open(self.tmp / f'{name}.log', 'wb')
+        proc = subprocess.Popen(cmd, env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(proc)
+        return proc
+
+    def start(self):
+        args = self.args
+        stub_port = free_port()
+        stub_env = dict(
+            os.environ,
+            STUB_PAGE_BYTES=str(args.page_bytes),
+            STUB_ASSET_BYTES=str(args.asset_bytes),
+            STUB_CACHE_CONTROL=args.upstream_cache_control,
+        )
+        self.spawn('upstream', [
+            sys.executable, '-m', 'uvicorn', 'stub_upstream:app', '--app-dir', str(BENCH_DIR),
+            '--port', str(stub_port), '--log-level', 'warning',
+        ], env=stub_env)
+        self.stub_url = f"http://127.0.0.1:{stub_port}"
+        wait_for(self.stub_url + '/')
+
+        mongo_url = args.mongo_url
+        if mongo_url is None and not args.mock_mongo and shutil.which('mongod'):
+            mongo_port = free_port()
+            (self.tmp / 'db').mkdir()
+            self.spawn('mongod', [
+                'mongod', '--dbpath', str(self.tmp / 'db'), '--port', str(mongo_port),
+                '--bind_ip', '127.0.0.1', '--quiet',
+            ])
+            mongo_url = f"mongodb://127.0.0.1:{mongo_port}"
+            time.sleep(2)
+
+        server_port = free_port()
+        server_env = dict(
+            os.environ,
+            MONGO_URL=mongo_url or 'mongodb://127.0.0.1:1',
+            DB_NAME=f"bench_{uuid.uuid4().hex[:8]}",
+            GN_MATH_PORTAL_URL=self.stub_url + '/',
+            GN_MATH_MIRRORS=f"{self.stub_url}/games/{{game}}/",
+            SUGGESTION_API_URL=f"{self.stub_url}/complete/search?q={{query}}",
+            PROXY_CACHE_DIR=str(self.tmp / 'proxy-cache'),
+            # Nothing may outlive the run or reach the real catalog: runs must stay comparable
+            GN_MATH_STORE='false',
+            GN_MATH_STORE_DIR=str(self.tmp / 'gn-math-store'),
+            GN_MATH_CATALOG_URL=f"{self.stub_url}/catalog/",
+            GN_MATH_CATALOG_REFRESH_INTERVAL='0',
+        )
+        if mongo_url is None:
+            print("Using in-memory mongomock-motor database")
+            proc = self.spawn('server', [
+                sys.executable, str(BENCH_DIR / 'mock_mongo_server.py'), '--port', str(server_port),
+            ], env=server_env)
+        else:
+            proc = self.spawn('server', [
+                sys.executable, '-m', 'uvicorn', 'server:app', '--app-dir', str(ROOT / 'backend'),
+                '--port', str(server_port), '--log-level', 'warning',
+            ], env=server_env)
+        self.server_pid = proc.pid
+        self.server_url = f"http://127.0.0.1:{server_port}"
+        wait_for(self.server_url + '/api/')
+
+    def stop(self):
+        for proc in reversed(self.processes):
+            proc.terminate()
+        for proc in reversed(self.processes):
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+async def seed_games(client, count):
+    categories = ['action', 'puzzle', 'horror', 'racing', 'platformer']
+    semaphore = asyncio.Semaphore(32)
+
+    async def create(n):
+        async with semaphore:
+            await client.post('/api/games', json={
+                "title": f"Game {n}",
+                "description": f"Benchmark game number {n}",
+                "category": categories[n % len(categories)],
+                "game_url": f"https://example.com/games/{n}",
+            })
+
+    await asyncio.gather(*(create(n) for n in range(count)))
+
+
+async def run_scenario(client, name, requests, concurrency):
+    method, path, body = SCENARIOS[name]
+    path = path.format(stub=STUB_URL)
+    latencies = []
+    errors = 0
+    received = 0
+    issued = 0
+
+    async def worker():
+        nonlocal errors, received, issued
+        while issued < requests:
+            issued += 1
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body() if body else None)
+                received += len(response.content)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "bytes_received": received,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            "p50": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+            "p95": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+            "p99": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+            "max": round(latencies[-1] * 1000, 2) if latencies else None,
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, baseline_path):
+    baseline = json.loads(Path(baseline_path).read_text())
+    print(f"\nCompared with {baseline_path} ({(baseline.get('commit') or '?')[:10]}):")
+    print(f"{'scenario':<20} {'rps':>16} {'p50 ms':>16} {'p99 ms':>16} {'peak RSS MB':>16}")
+
+    def delta(new, old):
+        if new is None or old in (None, 0):
+            return f"{new}"
+        return f"{new} ({(new - old) / old * 100:+.0f}%)"
+
+    for name, result in results['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if not old:
+            continue
+        print(f"{name:<20} {delta(result['throughput_rps'], old['throughput_rps']):>16} "
+              f"{delta(result['latency_ms']['p50'], old['latency_ms']['p50']):>16} "
+              f"{delta(result['latency_ms']['p99'], old['latency_ms']['p99']):>16} "
+              f"{delta(result.get('server_peak_rss_mb'), old.get('server_peak_rss_mb')):>16}")
+
+
+async def main_async(args, env):
+    global STUB_URL, BULK_BATCH
+    STUB_URL = env.stub_url
+    BULK_BATCH = args.bulk_batch
+    scenarios = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat() + 'Z',
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "page_bytes": args.page_bytes,
+            "asset_bytes": args.asset_bytes,
+            "upstream_cache_control": args.upstream_cache_control,
+            "seed_games": args.seed_games,
+            "bulk_batch": args.bulk_batch,
+        },
+        "scenarios": {},
+    }
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=env.server_url, timeout=120.0, limits=limits) as client:
+        await seed_games(client, args.seed_games)
+        print(f"{'scenario':<20} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'peak RSS MB':>12}")
+        for name in scenarios:
+            requests = args.requests
+            if name == 'proxy-binary' or name.startswith('games-bulk'):
+                requests = max(1, requests // 10)
+            await run_scenario(client, name, args.warmup, min(args.concurrency, args.warmup or 1))
+            rss_reset = reset_peak_rss(env.server_pid)
+            result = await run_scenario(client, name, requests, args.concurrency)
+            result['server_peak_rss_mb'] = peak_rss_mb(env.server_pid)
+            result['server_peak_rss_scope'] = 'scenario' if rss_reset else 'process'
+            if name.startswith('games-bulk'):
+                result['games_per_s'] = round(result['requests'] * args.bulk_batch / result['duration_s'])
+            results['scenarios'][name] = result
+            latency = result['latency_ms']
+            print(f"{name:<20} {result['throughput_rps']:>9} {latency['p50']:>9} {latency['p95']:>9} "
+                  f"{latency['p99']:>9} {result['errors']:>7} {result['server_peak_rss_mb'] or '-':>12}"
+                  + (f"  ({result['games_per_s']} games/s)" if 'games_per_s' in result else ''))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', help=f"comma separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests before each scenario')
+    parser.add_argument('--seed-games', type=int, default=500)
+    parser.add_argument('--bulk-batch', type=int, default=BULK_BATCH,
+                        help='games per request in the games-bulk-* scenarios')
+    parser.add_argument('--page-bytes', type=int, default=200_000)
+    parser.add_argument('--asset-bytes', type=int, default=32 * 1024 * 1024)
+    parser.add_argument('--upstream-cache-control', default='no-cache',
+                        help='Cache-Control sent by the stand-in upstream')
+    parser.add_argument('--mongo-url', help='use an existing MongoDB instead of starting one')
+    parser.add_argument('--mock-mongo', action='store_true',
+                        help='use mongomock-motor even if mongod is installed')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run to diff against')
+    args = parser.parse_args()
+
+    env = Environment(args)
+    try:
+        env.start()
+        results = asyncio.run(main_async(args, env))
+    finally:
+        env.stop()
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
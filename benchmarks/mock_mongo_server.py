@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Runs backend/server.py against an in-memory mongomock-motor database
+Used by load_test.py when no real MongoDB is available
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import motor.motor_asyncio
+import uvicorn
+from mongomock_motor import AsyncMongoMockClient
+
+motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+import server  # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    args = parser.parse_args()
+    uvicorn.run(server.app, host=args.host, port=args.port, log_level='warning')
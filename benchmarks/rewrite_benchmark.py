@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for HTML URL rewriting
+Compares the old chained re.sub passes from smart_proxy with the
+single-pass HtmlUrlRewriter, both on whole documents and on streamed chunks,
+and the decode + rewrite + encode path with rewriting the raw bytes, including
+the peak memory each of those two allocates
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from server import HtmlUrlRewriter  # noqa: E402
+
+BASE_URL = "https://example.com"
+
+SNIPPETS = [
+    '<a href="/wiki/Article_{n}" title="Article {n}">Article {n}</a>\n',
+    '<link rel="stylesheet" href="/static/css/site-{n}.css">\n',
+    "<script src='/static/js/bundle-{n}.js'></script>\n",
+    '<img src="//upload.example.org/thumb/{n}.jpg" alt="thumb {n}" width="220">\n',
+    '<a href="https://external.example.net/{n}">external link {n}</a>\n',
+    '<form action="/search" method="get"><input name="q" value="{n}"></form>\n',
+    '<p>Plain paragraph text number {n} with no URLs at all, just filler to '
+    'mimic the prose that makes up most of a real page.</p>\n',
+    '<div class="card"><span>{n}</span><a href="#section-{n}">jump</a></div>\n',
+]
+
+
+def legacy_rewrite(content, base_url):
+    """The seven-pass chain smart_proxy used before HtmlUrlRewriter"""
+    content = re.sub(r'href="(/[^"]*)"', f'href="{base_url}\\1"', content)
+    content = re.sub(r'src="(/[^"]*)"', f'src="{base_url}\\1"', content)
+    content = re.sub(r"href='(/[^']*)'", f"href='{base_url}\\1'", content)
+    content = re.sub(r"src='(/[^']*)'", f"src='{base_url}\\1'", content)
+    content = re.sub(r'action="(/[^"]*)"', f'action="{base_url}\\1"', content)
+    content = re.sub(r'href="//', 'href="https://', content)
+    content = re.sub(r'src="//', 'src="https://', content)
+    return content
+
+
+def build_page(size_bytes, seed=0):
+    rng = random.Random(seed)
+    parts = ['<!DOCTYPE html><html><head><title>Benchmark</title></head><body>\n']
+    total = len(parts[0])
+    n = 0
+    while total < size_bytes:
+        snippet = rng.choice(SNIPPETS).format(n=n)
+        parts.append(snippet)
+        total += len(snippet)
+        n += 1
+    parts.append('</body></html>\n')
+    return ''.join(parts)
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def peak_allocated(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='100000,1000000,5000000',
+                        help='comma separated page sizes in bytes')
+    parser.add_argument('--chunk-size', type=int, default=65536)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'legacy chain':>14} {'single pass':>14} {'streamed':>14} {'speedup':>8} "
+          f"{'text path':>14} {'bytes path':>14} {'text peak':>11} {'bytes peak':>11}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        page = build_page(size)
+        raw = page.encode('utf-8')
+        chunks = [page[i:i + args.chunk_size] for i in range(0, len(page), args.chunk_size)]
+
+        def streamed():
+            rewriter = HtmlUrlRewriter(BASE_URL)
+            out = [rewriter.feed(chunk) for chunk in chunks]
+            out.append(rewriter.flush())
+            return ''.join(out)
+
+        def text_path():
+            return HtmlUrlRewriter(BASE_URL).rewrite(raw.decode('utf-8')).encode('utf-8')
+
+        def bytes_path():
+            return HtmlUrlRewriter(BASE_URL).rewrite_bytes(raw)
+
+        if text_path() != bytes_path():
+            raise SystemExit("bytes path output differs from the text path")
+        legacy = best_of(lambda: legacy_rewrite(page, BASE_URL), args.repeat)
+        single = best_of(lambda: HtmlUrlRewriter(BASE_URL).rewrite(page), args.repeat)
+        stream = best_of(streamed, args.repeat)
+        text = best_of(text_path, args.repeat)
+        binary = best_of(bytes_path, args.repeat)
+        print(f"{len(page):>10} {legacy * 1000:>12.2f}ms {single * 1000:>12.2f}ms "
+              f"{stream * 1000:>12.2f}ms {legacy / single:>7.2f}x "
+              f"{text * 1000:>12.2f}ms {binary * 1000:>12.2f}ms "
+              f"{peak_allocated(text_path) / 1e6:>9.1f}MB {peak_allocated(bytes_path) / 1e6:>9.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the in-memory game search index
+Builds GameSearchIndex over a synthetic catalog (100k games by default) and
+reports build time, memory and per-query latency for exact, multi-word,
+prefix, typo and category-filtered queries, with the query result memo off
+so every query walks the index
+"""
+
+import argparse
+import gc
+import os
+import random
+import resource
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from server import GameSearchIndex  # noqa: E402
+
+CATEGORIES = ['action', 'puzzle', 'racing', 'arcade', 'horror', 'platformer', 'strategy', 'sports']
+SYLLABLES = ['ka', 'ro', 'mi', 'zen', 'tor', 'bla', 'qu', 'est', 'dra', 'gon', 'pix', 'el', 'nin', 'ja',
+             'sha', 'dow', 'tur', 'bo', 'cas', 'tle', 'ly', 'ne', 'vor', 'ix']
+
+
+def build_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words, key=lambda word: rng.random())
+
+
+def build_games(count, vocabulary_size=5000, seed=0):
+    """Games whose words follow a Zipf-like distribution, as real catalogs do"""
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary(vocabulary_size, rng)
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    start = datetime(2024, 1, 1)
+    games = []
+    for n in range(count):
+        title = ' '.join(rng.choices(vocabulary, weights, k=rng.randint(2, 4)))
+        description = ' '.join(rng.choices(vocabulary, weights, k=rng.randint(10, 25)))
+        games.append({
+            "id": str(uuid.uuid4()),
+            "title": title.title(),
+            "description": f"{description.capitalize()}.",
+            "category": CATEGORIES[n % len(CATEGORIES)],
+            "game_url": f"https://games.example.com/{n}/index.html",
+            "thumbnail": None,
+            "created_at": start + timedelta(seconds=n),
+        })
+    return vocabulary, games
+
+
+def typo(word):
+    return word[1] + word[0] + word[2:]
+
+
+def build_queries(vocabulary):
+    """name -> [(text, category or None)], over very common (rank 1), common and rare words"""
+    common, mid, rare = vocabulary[0], vocabulary[20], vocabulary[800]
+    return {
+        'exact': [(common, None), (mid, None), (rare, None)],
+        'multi-word': [(f'{common} {mid}', None), (f'{mid} {rare}', None), (f'{common} {vocabulary[1]}', None)],
+        'prefix': [(mid[:3], None), (f'{common} {rare[:3]}', None), (rare[:4], None)],
+        'typo': [(typo(mid), None), (typo(rare), None), (typo(vocabulary[5]), None)],
+        'category': [(common, 'action'), (mid, 'puzzle'), (f'{mid} {rare}', 'racing')],
+    }
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--games', type=int, default=100_000)
+    parser.add_argument('--vocabulary', type=int, default=5000, help='distinct words in the catalog')
+    parser.add_argument('--repeat', type=int, default=200, help='runs of each query')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    vocabulary, games = build_games(args.games, args.vocabulary)
+    index = GameSearchIndex(max_cached_queries=0)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for game in games:
+        index.add(game)
+    build = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Start timing with the build's garbage out of the way
+    gc.collect()
+    print(f"{args.games} games indexed in {build:.2f}s, peak RSS +{(rss_after - rss_before) / 1024:.0f}MB, "
+          f"{index.stats()['terms']} terms")
+
+    print(f"{'queries':<12} {'matches':>9} {'p50 us':>9} {'p99 us':>9} {'max us':>9}")
+    for name, queries in build_queries(vocabulary).items():
+        timings = []
+        matches = 0
+        for text, category in queries:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                total, _ = index.search(text, args.limit, category)
+                timings.append(time.perf_counter() - started)
+            matches += total
+        timings.sort()
+        print(f"{name:<12} {matches // len(queries):>9} {percentile(timings, 0.5) * 1e6:>9.1f} "
+              f"{percentile(timings, 0.99) * 1e6:>9.1f} {timings[-1] * 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Stand-in upstream for the load-test harness
+Serves fixed HTML pages, a large binary, slow responses, GN-Math style game
+pages and a suggestion API so the proxy endpoints never leave the machine
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+PAGE_BYTES = int(os.environ.get('STUB_PAGE_BYTES', 200_000))
+ASSET_BYTES = int(os.environ.get('STUB_ASSET_BYTES', 32 * 1024 * 1024))
+CACHE_CONTROL = os.environ.get('STUB_CACHE_CONTROL', 'no-cache')
+CHUNK_SIZE = 64 * 1024
+
+SNIPPETS = [
+    '<a href="/wiki/Article_{n}" title="Article {n}">Article {n}</a>\n',
+    '<link rel="stylesheet" href="/static/css/site-{n}.css">\n',
+    "<script src='/static/js/bundle-{n}.js'></script>\n",
+    '<img src="//upload.example.org/thumb/{n}.jpg" alt="thumb {n}">\n',
+    '<img src="img/sprite-{n}.png" alt="relative {n}">\n',
+    '<a href="https://external.example.net/{n}">external link {n}</a>\n',
+    '<p>Plain paragraph text number {n} with no URLs at all, just filler to '
+    'mimic the prose that makes up most of a real page.</p>\n',
+]
+
+
+def build_page(size_bytes, seed=0):
+    rng = random.Random(seed)
+    parts = ['<!DOCTYPE html><html><head><title>Stub page</title></head><body>\n']
+    total = len(parts[0])
+    n = 0
+    while total < size_bytes:
+        snippet = rng.choice(SNIPPETS).format(n=n)
+        parts.append(snippet)
+        total += len(snippet)
+        n += 1
+    parts.append('</body></html>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+PAGE = build_page(PAGE_BYTES)
+PAGE_ETAG = '"%s"' % hashlib.sha1(PAGE).hexdigest()
+ASSET_BLOCK = os.urandom(CHUNK_SIZE)
+ASSET_ETAG = '"asset-%d"' % ASSET_BYTES
+
+
+def cacheable(request, body, etag, media_type):
+    headers = {'Cache-Control': CACHE_CONTROL, 'ETag': etag}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+
+async def page(request):
+    return cacheable(request, PAGE, PAGE_ETAG, 'text/html; charset=utf-8')
+
+
+async def slow(request):
+    await asyncio.sleep(float(request.query_params.get('delay', 0.5)))
+    return cacheable(request, PAGE, PAGE_ETAG, 'text/html; charset=utf-8')
+
+
+async def asset(request):
+    headers = {
+        'Cache-Control': CACHE_CONTROL,
+        'ETag': ASSET_ETAG,
+        'Content-Length': str(ASSET_BYTES),
+    }
+    if request.headers.get('if-none-match') == ASSET_ETAG:
+        return Response(status_code=304, headers=headers)
+
+    async def body():
+        remaining = ASSET_BYTES
+        while remaining > 0:
+            chunk = ASSET_BLOCK[:min(CHUNK_SIZE, remaining)]
+            remaining -= len(chunk)
+            yield chunk
+
+    return StreamingResponse(body(), media_type='application/octet-stream', headers=headers)
+
+
+async def game(request):
+    if request.path_params['game'] == 'missing':
+        return Response(status_code=404)
+    return cacheable(request, PAGE, PAGE_ETAG, 'text/html; charset=utf-8')
+
+
+async def suggestions(request):
+    query = request.query_params.get('q', '')
+    body = json.dumps([query, [f"{query} {n}" for n in range(10)]])
+    return Response(body, media_type='application/json')
+
+
+app = Starlette(routes=[
+    Route('/', page),
+    Route('/page.html', page),
+    Route('/slow', slow),
+    Route('/asset.bin', asset),
+    Route('/complete/search', suggestions),
+    Route('/games/{game}/', game),
+])
@@ -1,19 +1,40 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import "./App.css";
 import axios from "axios";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const SUGGESTION_DEBOUNCE_MS = 250;
+// 'frame' loads GET /api/smart-proxy into an iframe so the page renders while it
+// streams in; 'inline' is the older fetch-then-inject fallback
+const DEFAULT_RENDER_MODE = 'frame';
 
 // Smart Search/Proxy Component (Google-like)
 const SmartProxy = () => {
   const [query, setQuery] = useState('');
   const [loading, setLoading] = useState(false);
   const [proxyContent, setProxyContent] = useState('');
+  const [renderMode, setRenderMode] = useState(DEFAULT_RENDER_MODE);
+  const [frameUrl, setFrameUrl] = useState('');
+  const [frameKey, setFrameKey] = useState(0);
   const [error, setError] = useState('');
   const [suggestions, setSuggestions] = useState([]);
   const [showSuggestions, setShowSuggestions] = useState(false);
   const [isUrl, setIsUrl] = useState(false);
+  const suggestionTimer = useRef(null);
+  const suggestionRequest = useRef(null);
+
+  // Drop any scheduled or in-flight suggestion lookup
+  const cancelSuggestions = () => {
+    clearTimeout(suggestionTimer.current);
+    if (suggestionRequest.current) {
+      suggestionRequest.current.abort();
+      suggestionRequest.current = null;
+    }
+  };
+
+  // Nothing should resolve after the component is gone
+  useEffect(() => cancelSuggestions, []);
 
   // Detect if input is URL or search query
   const detectInputType = (input) => {
@@ -33,9 +54,10 @@ const SmartProxy = () => {
     setQuery(value);
     detectInputType(value);
     
-    // Get suggestions for search queries (not URLs)
+    // Get suggestions for search queries (not URLs) once typing pauses
+    cancelSuggestions();
     if (value.length > 2 && !detectInputType(value)) {
-      fetchSuggestions(value);
+      suggestionTimer.current = setTimeout(() => fetchSuggestions(value), SUGGESTION_DEBOUNCE_MS);
     } else {
       setSuggestions([]);
       setShowSuggestions(false);
@@ -43,12 +65,21 @@ const SmartProxy = () => {
   };
 
   const fetchSuggestions = async (searchQuery) => {
+    const controller = new AbortController();
+    suggestionRequest.current = controller;
     try {
-      const response = await axios.get(`${API}/search-suggestions?q=${encodeURIComponent(searchQuery)}`);
+      const response = await axios.get(`${API}/search-suggestions?q=${encodeURIComponent(searchQuery)}`, {
+        signal: controller.signal
+      });
       setSuggestions(response.data.suggestions || []);
       setShowSuggestions(true);
     } catch (err) {
+      if (axios.isCancel(err)) return;
       setSuggestions([]);
+    } finally {
+      if (suggestionRequest.current === controller) {
+        suggestionRequest.current = null;
+      }
     }
   };
 
@@ -56,13 +87,26 @@ const SmartProxy = () => {
     e.preventDefault();
     if (!query.trim()) return;
     
+    cancelSuggestions();
+    setShowSuggestions(false);
+    await loadResult(query.trim(), renderMode);
+  };
+
+  const loadResult = async (target, mode) => {
     setLoading(true);
     setError('');
     setProxyContent('');
-    setShowSuggestions(false);
-    
+    setFrameUrl('');
+
+    if (mode === 'frame') {
+      // The iframe's onLoad clears the spinner; a new key reloads repeated searches
+      setFrameUrl(`${API}/smart-proxy?q=${encodeURIComponent(target)}`);
+      setFrameKey((key) => key + 1);
+      return;
+    }
+
     try {
-      const response = await axios.post(`${API}/smart-proxy`, { url: query.trim() });
+      const response = await axios.post(`${API}/smart-proxy`, { url: target });
       setProxyContent(response.data);
     } catch (err) {
       setError(err.response?.data?.detail || 'Failed to process request');
@@ -71,15 +115,27 @@ const SmartProxy = () => {
     }
   };
 
+  const switchRenderMode = () => {
+    const mode = renderMode === 'frame' ? 'inline' : 'frame';
+    setRenderMode(mode);
+    if (query.trim() && (proxyContent || frameUrl)) {
+      loadResult(query.trim(), mode);
+    }
+  };
+
   const handleSuggestionClick = (suggestion) => {
+    cancelSuggestions();
     setQuery(suggestion);
     setShowSuggestions(false);
     detectInputType(suggestion);
   };
 
   const clearSearch = () => {
+    cancelSuggestions();
     setQuery('');
     setProxyContent('');
+    setFrameUrl('');
+    setLoading(false);
     setError('');
     setSuggestions([]);
     setShowSuggestions(false);
@@ -209,27 +265,47 @@ const SmartProxy = () => {
           </div>
         )}
 
-        {proxyContent && (
+        {(proxyContent || frameUrl) && (
           <div className="bg-white rounded-lg border border-gray-200 overflow-hidden">
             <div className="bg-gray-100 px-4 py-2 border-b border-gray-200 flex items-center justify-between">
               <p className="text-sm text-gray-600">
                 {isUrl ? `Viewing: ${query}` : `Search results for: "${query}"`}
               </p>
-              <button
-                onClick={clearSearch}
-                className="text-gray-500 hover:text-gray-700 text-sm"
-              >
-                ✕ Close
-              </button>
-            </div>
-            <div className="h-96 overflow-auto">
-              <div dangerouslySetInnerHTML={{ __html: proxyContent }} />
+              <div className="flex items-center gap-4">
+                <button
+                  onClick={switchRenderMode}
+                  className="text-gray-500 hover:text-gray-700 text-sm"
+                >
+                  {renderMode === 'frame' ? 'Show inline' : 'Show in frame'}
+                </button>
+                <button
+                  onClick={clearSearch}
+                  className="text-gray-500 hover:text-gray-700 text-sm"
+                >
+                  ✕ Close
+                </button>
+              </div>
             </div>
+            {frameUrl ? (
+              // No allow-same-origin: proxied scripts must not reach this app's origin
+              <iframe
+                key={frameKey}
+                src={frameUrl}
+                onLoad={() => setLoading(false)}
+                className="w-full h-[600px] border-0"
+                title={isUrl ? `Viewing ${query}` : `Search results for ${query}`}
+                sandbox="allow-scripts allow-popups allow-forms"
+              />
+            ) : (
+              <div className="h-96 overflow-auto">
+                <div dangerouslySetInnerHTML={{ __html: proxyContent }} />
+              </div>
+            )}
           </div>
         )}
 
         {/* Tips section */}
-        {!proxyContent && (
+        {!proxyContent && !frameUrl && (
           <div className="mt-8 bg-white/5 backdrop-blur-sm rounded-xl p-6 border border-white/10">
             <h3 className="text-white font-semibold text-lg mb-4">💡 How to use:</h3>
             <div className="grid md:grid-cols-2 gap-4 text-white/80 text-sm">
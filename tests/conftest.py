@@ -0,0 +1,132 @@
+"""
+Shared fixtures: the ASGI app behind httpx.ASGITransport, with a stub
+upstream (httpx.MockTransport) and fresh caches for every test
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+os.environ.setdefault('MONGO_URL', 'mongodb://127.0.0.1:1')
+os.environ.setdefault('DB_NAME', 'tests')
+_SCRATCH = tempfile.mkdtemp(prefix='betterplay-tests-')
+os.environ.setdefault('PROXY_CACHE_DIR', os.path.join(_SCRATCH, 'proxy-cache'))
+os.environ.setdefault('GN_MATH_STORE_DIR', os.path.join(_SCRATCH, 'gn-math-store'))
+
+import server  # noqa: E402
+
+UPSTREAM = 'http://upstream.test'
+UPSTREAM_HOST = 'upstream.test'
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+class StubUpstream:
+    """Routes upstream GETs by path to handlers and records every request.
+
+    A handler takes the ``httpx.Request`` and returns an ``httpx.Response``,
+    or raises ``httpx.TransportError`` subclasses to simulate network failures.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+
+    def route(self, path, handler=None, **response):
+        """Register ``handler``, or a fixed response built from ``response`` kwargs"""
+        if handler is None:
+            def handler(request):
+                return httpx.Response(**{'status_code': 200, **response})
+        self.routes[path] = handler
+        return handler
+
+    def hits(self, path):
+        return [request for request in self.requests if request.url.path == path]
+
+    async def handle(self, request):
+        self.requests.append(request)
+        handler = self.routes.get(request.url.path)
+        if handler is None:
+            return httpx.Response(404)
+        response = handler(request)
+        if hasattr(response, '__await__'):
+            response = await response
+        return response
+
+
+def ranged(body, content_type, etag='"ranged"'):
+    """A handler serving ``body``, or the single ``bytes=a-b`` range asked for as a 206"""
+
+    def handler(request):
+        headers = {'content-type': content_type, 'etag': etag, 'accept-ranges': 'bytes'}
+        byte_range = request.headers.get('range', '')
+        if byte_range.startswith('bytes='):
+            first, _, last = byte_range[6:].partition('-')
+            last = min(int(last) if last else len(body) - 1, len(body) - 1)
+            headers['content-range'] = f'bytes {first}-{last}/{len(body)}'
+            return httpx.Response(206, headers=headers, content=body[int(first):last + 1])
+        return httpx.Response(200, headers=headers, content=body)
+
+    return handler
+
+
+@pytest.fixture
+def stub(monkeypatch, tmp_path):
+    """A stub upstream wired into fresh upstream pool, cache and coalescing state"""
+    upstream = StubUpstream()
+    pool = server.UpstreamClientManager(
+        breakers=server.CircuitBreakers(),
+        admission=server.AdmissionController(),
+    )
+    pool._client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handle), follow_redirects=True)
+    cache = server.ResponseCache(disk_dir=tmp_path / 'proxy-cache')
+    cache.start()
+    rewritten = server.RewrittenHtmlCache()
+    cache.on_change(rewritten.invalidate)
+    monkeypatch.setattr(server, 'upstream_pool', pool)
+    monkeypatch.setattr(server, 'response_cache', cache)
+    monkeypatch.setattr(server, 'rewritten_html_cache', rewritten)
+    monkeypatch.setattr(server, 'single_flight', server.SingleFlight())
+    monkeypatch.setattr(server, 'gn_math_mirrors', server.MirrorSelector())
+    monkeypatch.setattr(server, 'PREFETCH_ENABLED', False)
+    return upstream
+
+
+@pytest.fixture
+async def client():
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as http_client:
+        yield http_client
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    """A GN-Math catalog published from the built-in seed list, as on a first start"""
+    games = server.GameCatalog(server.GN_MATH_CATALOG_URL, refresh_interval=0)
+    now = datetime.now(timezone.utc)
+    games._publish({
+        slug: games._document(slug, None, None, {'added_at': now, 'seen_at': now})
+        for slug in server.GN_MATH_GAMES
+    })
+    monkeypatch.setattr(server, 'gn_math_catalog', games)
+    return games
+
+
+@pytest.fixture
+def games_db(monkeypatch):
+    """An in-memory database behind the games routes, with fresh counts and search index"""
+    mongomock_motor = pytest.importorskip('mongomock_motor')
+    database = mongomock_motor.AsyncMongoMockClient()['tests']
+    monkeypatch.setattr(server, 'db', database)
+    monkeypatch.setattr(server, 'category_counts', server.CategoryCounts(reconcile_interval=0))
+    monkeypatch.setattr(server, 'game_search_index', server.GameSearchIndex())
+    return database
@@ -0,0 +1,150 @@
+import asyncio
+
+import httpx
+import pytest
+
+import server
+from .conftest import UPSTREAM, UPSTREAM_HOST
+
+pytestmark = pytest.mark.anyio
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def test_requests_queue_behind_the_host_cap():
+    admission = server.AdmissionController(max_in_flight=10, max_per_host=1)
+    first = await admission.acquire('a')
+    other_host = await admission.acquire('b')
+    waiting = asyncio.create_task(admission.acquire('a'))
+    await settle()
+    assert not waiting.done()
+    assert admission.stats()['hosts']['a'] == {'in_flight': 1, 'queued': 1, 'streaming': 0}
+    first()
+    second = await asyncio.wait_for(waiting, 1)
+    assert admission.host_in_flight == {'a': 1, 'b': 1}
+    second()
+    second()  # releasing twice is harmless
+    other_host()
+    assert admission.in_flight == 0
+
+
+async def test_freed_slot_goes_to_the_most_urgent_waiter():
+    admission = server.AdmissionController(max_in_flight=1)
+    holder = await admission.acquire('a')
+    granted = []
+
+    async def wait(name, priority):
+        release = await admission.acquire('a', priority)
+        granted.append(name)
+        release()
+
+    tasks = [
+        asyncio.create_task(wait('background', server.PRIORITY_BACKGROUND)),
+        asyncio.create_task(wait('bulk', server.PRIORITY_BULK)),
+        asyncio.create_task(wait('interactive', server.PRIORITY_INTERACTIVE)),
+        asyncio.create_task(wait('interactive 2', server.PRIORITY_INTERACTIVE)),
+    ]
+    await settle()
+    holder()
+    await asyncio.wait_for(asyncio.gather(*tasks), 1)
+    assert granted == ['interactive', 'interactive 2', 'bulk', 'background']
+
+
+async def test_wait_is_bounded_by_the_queue_timeout():
+    admission = server.AdmissionController(max_in_flight=1, queue_timeout=0.05)
+    await admission.acquire('a')
+    with pytest.raises(server.UpstreamOverloaded) as raised:
+        await admission.acquire('a')
+    assert raised.value.status_code == 503
+    assert int(raised.value.headers['Retry-After']) >= 1
+    assert admission.stats()['timed_out'] == 1
+    assert admission.stats()['queued_now'] == 0
+
+
+async def test_full_queue_sheds_the_least_urgent_request():
+    admission = server.AdmissionController(max_in_flight=1, max_queued=1)
+    holder = await admission.acquire('a')
+    background = asyncio.create_task(admission.acquire('a', server.PRIORITY_BACKGROUND))
+    await settle()
+
+    # An equally or less urgent request is turned away...
+    with pytest.raises(server.UpstreamOverloaded):
+        await admission.acquire('a', server.PRIORITY_BACKGROUND)
+    assert admission.stats()['rejected'] == 1
+
+    # ...a more urgent one takes the queued request's place
+    interactive = asyncio.create_task(admission.acquire('a', server.PRIORITY_INTERACTIVE))
+    await settle()
+    with pytest.raises(server.UpstreamOverloaded):
+        await background
+    assert admission.stats()['displaced'] == 1
+    holder()
+    (await asyncio.wait_for(interactive, 1))()
+    assert admission.in_flight == 0
+
+
+async def test_hand_off_frees_the_slot_for_waiting_fetches():
+    admission = server.AdmissionController(max_in_flight=1, max_streams_per_host=1)
+    bulk = await admission.acquire('a', server.PRIORITY_BULK)
+    waiting = asyncio.create_task(admission.acquire('a'))
+    await settle()
+    streaming = admission.hand_off('a', bulk)
+    release = await asyncio.wait_for(waiting, 1)
+    assert admission.stats()['hosts']['a'] == {'in_flight': 1, 'queued': 0, 'streaming': 1}
+
+    # With the streaming budget used up the fetch keeps its slot
+    assert admission.hand_off('a', release) is release
+    assert admission.stats()['hand_off_full'] == 1
+    release()
+    streaming()
+    assert admission.stats()['hosts'] == {}
+
+
+async def test_low_priority_body_does_not_hold_an_admission_slot(stub, monkeypatch):
+    admission = server.AdmissionController(max_per_host=1, queue_timeout=0.5)
+    monkeypatch.setattr(server.upstream_pool, 'admission', admission)
+    more = asyncio.Event()
+
+    def asset(request):
+        async def body():
+            yield b'first'
+            await more.wait()
+            yield b'rest'
+
+        return httpx.Response(200, headers={'content-type': 'application/octet-stream'}, content=body())
+
+    stub.route('/asset.bin', asset)
+    stub.route('/page.html', content=b'<html></html>', headers={'content-type': 'text/html'})
+    response = await server.upstream_pool.open(UPSTREAM + '/asset.bin')
+    assert admission.in_flight == 0
+    assert admission.host_streaming == {UPSTREAM_HOST: 1}
+    page = await server.upstream_pool.get(UPSTREAM + '/page.html')
+    assert page.status_code == 200
+    more.set()
+    assert await response.aread() == b'firstrest'
+    await response.aclose()
+    assert admission.host_streaming == {}
+
+
+async def test_overloaded_proxy_answers_503_with_retry_after(stub, client, monkeypatch):
+    admission = server.AdmissionController(max_in_flight=1, max_queued=0)
+    monkeypatch.setattr(server.upstream_pool, 'admission', admission)
+    gate = asyncio.Event()
+
+    async def slow(request):
+        await gate.wait()
+        return httpx.Response(200, headers={'content-type': 'text/html'}, content=b'<html></html>')
+
+    stub.route('/slow', slow)
+    first = asyncio.create_task(client.get('/api/proxy-direct', params={'url': UPSTREAM + '/slow'}))
+    while not admission.in_flight:
+        await asyncio.sleep(0.01)
+    shed = await client.get('/api/proxy-direct', params={'url': UPSTREAM + '/slow?other'})
+    assert shed.status_code == 503
+    assert int(shed.headers['retry-after']) >= 1
+    assert 'overloaded' in shed.json()['detail']
+    gate.set()
+    assert (await first).status_code == 200
@@ -0,0 +1,143 @@
+import asyncio
+
+import httpx
+import pytest
+
+import server
+from .conftest import UPSTREAM, UPSTREAM_HOST
+
+
+def fail(breakers, host='a', times=1):
+    for _ in range(times):
+        breakers.record(host, breakers.before_request(host), 0.01, 'ConnectError')
+
+
+def succeed(breakers, host='a', times=1, latency=0.01):
+    for _ in range(times):
+        breakers.record(host, breakers.before_request(host), latency, None)
+
+
+def test_breaker_opens_at_the_failure_rate():
+    breakers = server.CircuitBreakers(min_requests=4, failure_rate=0.5)
+    fail(breakers, times=2)
+    assert breakers.state('a') == 'closed'  # too few requests to judge
+    breakers = server.CircuitBreakers(min_requests=4, failure_rate=0.5)
+    succeed(breakers, times=3)
+    fail(breakers, times=2)
+    assert breakers.state('a') == 'closed'  # 2 of 5 failed...
+    fail(breakers)
+    assert breakers.state('a') == 'open'  # ...3 of 6 reaches the rate
+    assert breakers.state('b') == 'closed'
+
+
+def test_breaker_opens_on_slow_calls():
+    breakers = server.CircuitBreakers(min_requests=2, slow_call=1.0, slow_rate=0.8)
+    succeed(breakers, times=2, latency=2.0)
+    assert breakers.state('a') == 'open'
+
+
+def test_open_breaker_fails_fast_with_retry_after():
+    breakers = server.CircuitBreakers(min_requests=1, open_duration=15)
+    fail(breakers)
+    with pytest.raises(server.UpstreamUnavailable) as raised:
+        breakers.before_request('a')
+    assert raised.value.status_code == 503
+    assert raised.value.headers['Retry-After'] == '15'
+    assert breakers.stats()['hosts']['a']['rejected'] == 1
+
+
+@pytest.mark.anyio
+async def test_half_open_probe_closes_or_reopens():
+    breakers = server.CircuitBreakers(min_requests=1, open_duration=0.1, max_open_duration=0.3)
+    fail(breakers)
+    await asyncio.sleep(0.12)
+    probe = breakers.before_request('a')
+    assert probe is True
+    assert breakers.state('a') == 'half_open'
+    with pytest.raises(server.UpstreamUnavailable):
+        breakers.before_request('a')  # one probe at a time
+    breakers.record('a', probe, 0.01, 'HTTP 503')
+    assert breakers.state('a') == 'open'
+    assert breakers.stats()['hosts']['a']['times_opened'] == 2
+
+    # Reopened for twice as long
+    await asyncio.sleep(0.12)
+    with pytest.raises(server.UpstreamUnavailable):
+        breakers.before_request('a')
+    await asyncio.sleep(0.1)
+    succeed(breakers)
+    assert breakers.state('a') == 'closed'
+    assert breakers.stats()['hosts']['a']['requests'] == 0
+
+
+def test_cancelled_probe_frees_its_turn():
+    breakers = server.CircuitBreakers(min_requests=1, open_duration=0)
+    fail(breakers)
+    breakers.cancelled('a', breakers.before_request('a'))
+    assert breakers.before_request('a') is True
+
+
+def test_body_error_turns_a_success_into_a_failure():
+    breakers = server.CircuitBreakers(min_requests=2, failure_rate=0.5)
+    succeed(breakers)
+    sample = breakers.record('a', breakers.before_request('a'), 0.01, None)
+    assert breakers.state('a') == 'closed'
+    breakers.record_body_error('a', sample, 'ReadError')
+    assert breakers.state('a') == 'open'
+    assert breakers.stats()['hosts']['a']['last_error'] == 'ReadError'
+
+
+@pytest.mark.anyio
+class TestThroughTheProxy:
+
+    @pytest.fixture
+    def breakers(self, stub, monkeypatch):
+        breakers = server.CircuitBreakers(min_requests=3, failure_rate=0.5, open_duration=30)
+        monkeypatch.setattr(server.upstream_pool, 'breakers', breakers)
+        return breakers
+
+    async def test_failing_upstream_is_cut_off(self, stub, breakers, client):
+        stub.route('/asset.bin', status_code=500, headers={'content-type': 'text/plain'}, content=b'error')
+        for n in range(3):
+            response = await client.get('/api/proxy-direct', params={'url': f'{UPSTREAM}/asset.bin?{n}'})
+            assert response.status_code == 500
+        assert breakers.state(UPSTREAM_HOST) == 'open'
+
+        response = await client.get('/api/proxy-direct', params={'url': UPSTREAM + '/asset.bin?3'})
+        assert response.status_code == 503
+        assert response.headers['retry-after'] == '30'
+        assert 'circuit open' in response.json()['detail']
+        assert len(stub.requests) == 3
+
+        stats = (await client.get('/api/diagnostics/circuit-breakers')).json()
+        assert stats['hosts'][UPSTREAM_HOST]['state'] == 'open'
+
+    async def test_open_circuit_serves_a_stale_copy(self, stub, breakers, client):
+        stub.route('/asset.bin', headers={
+            'cache-control': 'no-cache', 'etag': '"v1"', 'content-type': 'application/octet-stream',
+        }, content=b'cached body')
+        url = {'url': UPSTREAM + '/asset.bin'}
+        await client.get('/api/proxy-direct', params=url)
+        while breakers.state(UPSTREAM_HOST) == 'closed':
+            fail(breakers, UPSTREAM_HOST)
+        response = await client.get('/api/proxy-direct', params=url)
+        assert response.status_code == 200
+        assert response.headers['x-cache'] == 'STALE'
+        assert response.content == b'cached body'
+        assert len(stub.requests) == 1
+
+    async def test_broken_bodies_count_as_failures(self, stub, breakers):
+        def truncated(request):
+            async def body():
+                yield b'partial'
+                raise httpx.ReadError('connection reset', request=request)
+
+            return httpx.Response(200, headers={'content-type': 'application/octet-stream'}, content=body())
+
+        stub.route('/asset.bin', truncated)
+        for _ in range(3):
+            response = await server.upstream_pool.open(UPSTREAM + '/asset.bin')
+            with pytest.raises(httpx.ReadError):
+                await response.aread()
+        assert breakers.state(UPSTREAM_HOST) == 'open'
+        assert breakers.stats()['hosts'][UPSTREAM_HOST]['last_error'] == 'ReadError'
@@ -0,0 +1,121 @@
+import gzip
+
+import httpx
+import pytest
+
+import server
+from .conftest import UPSTREAM
+
+# Brotli is optional; without it gzip is the best coding on offer
+BEST = 'br' if server.BROTLI_AVAILABLE else 'gzip'
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip, deflate, br', BEST),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('gzip;q=0, br;q=0', None),
+    ('identity', None),
+    ('*', BEST),
+    ('*, br;q=0', 'gzip'),
+    ('', None),
+    (None, None),
+])
+def test_negotiate_encoding(header, expected):
+    assert server.negotiate_encoding(header) == expected
+
+
+@pytest.mark.parametrize('header, coding, accepted', [
+    ('gzip', 'gzip', True),
+    ('x-gzip', 'gzip', True),
+    ('br', 'gzip', False),
+    ('gzip;q=0, *', 'gzip', False),
+    ('*', 'br', True),
+    ('gzip, br', 'br, gzip', True),
+    ('gzip', 'br, gzip', False),
+])
+def test_encoding_accepted(header, coding, accepted):
+    assert server.encoding_accepted(header, coding) is accepted
+
+
+@pytest.mark.anyio
+class TestOwnResponses:
+
+    async def test_preferred_coding_is_used(self, catalog, client):
+        for accept, coding in (('gzip', 'gzip'), ('gzip, br', BEST)):
+            response = await client.get('/api/gn-math-games', headers={'accept-encoding': accept})
+            assert response.headers['content-encoding'] == coding
+            assert response.headers['vary'] == 'Accept-Encoding'
+            assert response.content == catalog.body
+
+    async def test_identity_is_sent_when_nothing_is_accepted(self, catalog, client):
+        response = await client.get('/api/gn-math-games', headers={'accept-encoding': 'identity'})
+        assert 'content-encoding' not in response.headers
+        assert response.headers['etag'] == catalog.etag
+        assert response.content == catalog.body
+
+    async def test_compressed_representation_has_its_own_etag(self, catalog, client):
+        response = await client.get('/api/gn-math-games', headers={'accept-encoding': 'gzip'})
+        assert response.headers['etag'] == catalog.etag[:-1] + '-gzip"'
+
+        revalidated = await client.get('/api/gn-math-games', headers={
+            'accept-encoding': 'gzip', 'if-none-match': response.headers['etag'],
+        })
+        assert revalidated.status_code == 304
+        assert revalidated.headers['etag'] == response.headers['etag']
+        assert revalidated.content == b''
+
+    async def test_small_bodies_are_not_compressed(self, client):
+        response = await client.get('/api/', headers={'accept-encoding': 'gzip'})
+        assert response.status_code == 200
+        assert 'content-encoding' not in response.headers
+
+
+@pytest.mark.anyio
+class TestProxiedResponses:
+
+    async def test_cached_body_is_compressed_once(self, stub, client):
+        body = b'{"items": [' + b', '.join(b'"item %d"' % n for n in range(500)) + b']}'
+        stub.route('/data.json', headers={'content-type': 'application/json', 'cache-control': 'max-age=60'},
+                   content=body)
+        url = {'url': UPSTREAM + '/data.json'}
+        await client.get('/api/proxy-direct', params=url, headers={'accept-encoding': 'identity'})
+        for _ in range(2):
+            response = await client.get('/api/proxy-direct', params=url, headers={'accept-encoding': 'gzip'})
+            assert response.headers['x-cache'] == 'HIT'
+            assert response.headers['content-encoding'] == 'gzip'
+            assert response.content == body
+        stats = server.response_cache.stats()
+        assert stats['variant_compressions'] == 1
+        assert stats['variant_hits'] == 2
+
+    async def test_upstream_coding_is_passed_through_when_accepted(self, stub, client):
+        body = b'console.log("hello");\n' * 100
+        stub.route('/app.js', headers={
+            'content-type': 'application/javascript', 'content-encoding': 'gzip', 'cache-control': 'no-store',
+        }, content=gzip.compress(body))
+        url = {'url': UPSTREAM + '/app.js'}
+        passed = await client.get('/api/proxy-direct', params=url, headers={'accept-encoding': 'gzip'})
+        assert passed.headers['content-encoding'] == 'gzip'
+        assert passed.content == body
+
+        decoded = await client.get('/api/proxy-direct', params=url, headers={'accept-encoding': 'identity'})
+        assert 'content-encoding' not in decoded.headers
+        assert decoded.content == body
+
+    async def test_streamed_body_is_compressed_chunk_by_chunk(self, stub, client):
+        chunks = [b'line %d of a long plain text document\n' % n for n in range(2000)]
+
+        def streamed(request):
+            async def body():
+                for chunk in chunks:
+                    yield chunk
+
+            return httpx.Response(200, headers={'content-type': 'text/plain', 'cache-control': 'no-store'},
+                                  content=body())
+
+        stub.route('/log.txt', streamed)
+        response = await client.get('/api/proxy-direct', params={'url': UPSTREAM + '/log.txt'},
+                                    headers={'accept-encoding': 'gzip'})
+        assert response.headers['content-encoding'] == 'gzip'
+        assert 'content-length' not in response.headers
+        assert response.content == b''.join(chunks)
@@ -0,0 +1,100 @@
+from collections import defaultdict
+
+import pytest
+
+import server
+from .conftest import UPSTREAM
+
+pytestmark = pytest.mark.anyio
+
+IDENTITY = {'accept-encoding': 'identity'}
+
+
+@pytest.fixture
+def categories(monkeypatch):
+    counts = server.CategoryCounts(reconcile_interval=0)
+    counts.counts = {'action': 3, 'puzzle': 1}
+    monkeypatch.setattr(server, 'category_counts', counts)
+    return counts
+
+
+@pytest.fixture
+def policies(monkeypatch):
+    """The app's route policies, with fresh counters"""
+    monkeypatch.setattr(server.cache_policies, 'counters', defaultdict(lambda: defaultdict(int)))
+    return server.cache_policies
+
+
+async def test_catalog_carries_validators_and_caching_headers(catalog, client):
+    response = await client.get('/api/gn-math-games', headers=IDENTITY)
+    assert response.status_code == 200
+    assert response.headers['etag'] == catalog.etag
+    assert response.headers['cache-control'] == 'public, max-age=60, stale-while-revalidate=600'
+    assert response.headers['vary'] == 'Accept-Encoding'
+
+
+@pytest.mark.parametrize('if_none_match', [
+    '{etag}', 'W/{etag}', '"other", {etag}', '*', '{coded}',
+])
+async def test_known_etag_is_answered_before_the_handler(catalog, client, policies, monkeypatch, if_none_match):
+    monkeypatch.setattr(catalog, 'response', None)  # the handler must not run
+    header = if_none_match.format(etag=catalog.etag, coded=catalog.etag[:-1] + '-br"')
+    response = await client.get('/api/gn-math-games', headers={'if-none-match': header, **IDENTITY})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['cache-control'] == 'public, max-age=60, stale-while-revalidate=600'
+    assert 'content-type' not in response.headers
+    assert policies.counters['/api/gn-math-games']['not_modified_early'] == 1
+
+
+async def test_changed_catalog_is_sent_in_full(catalog, client):
+    old_etag = catalog.etag
+    catalog._publish({})
+    response = await client.get('/api/gn-math-games', headers={'if-none-match': old_etag, **IDENTITY})
+    assert response.status_code == 200
+    assert response.headers['etag'] == catalog.etag != old_etag
+
+
+async def test_not_modified_keeps_cors_headers(catalog, client):
+    response = await client.get('/api/gn-math-games', headers={
+        'if-none-match': catalog.etag, 'origin': 'https://example.org', **IDENTITY,
+    })
+    assert response.status_code == 304
+    assert response.headers['access-control-allow-origin'] == '*'
+
+
+async def test_category_etag_follows_the_counts(categories, client):
+    response = await client.get('/api/games/categories', headers=IDENTITY)
+    assert response.json() == [{'category': 'action', 'count': 3}, {'category': 'puzzle', 'count': 1}]
+    assert response.headers['cache-control'] == 'public, max-age=30'
+    etag = response.headers['etag']
+    assert etag == server.content_etag(response.content)
+
+    response = await client.get('/api/games/categories', headers={'if-none-match': etag})
+    assert response.status_code == 304
+
+    categories.counts['puzzle'] = 2
+    categories._etag = None
+    response = await client.get('/api/games/categories', headers={'if-none-match': etag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+
+
+async def test_handler_etag_is_validated_after_the_handler(stub, client, policies, monkeypatch):
+    monkeypatch.setattr(server, 'GN_MATH_PORTAL_URL', UPSTREAM + '/')
+    stub.route('/', headers={'content-type': 'text/html', 'etag': '"p1"', 'cache-control': 'max-age=60'},
+               content=b'<a href="/x">x</a>')
+    first = await client.get('/api/gnmath-proxy', headers=IDENTITY)
+    assert first.headers['cache-control'] == 'public, max-age=60, stale-while-revalidate=600'
+    response = await client.get('/api/gnmath-proxy', headers={'if-none-match': first.headers['etag'], **IDENTITY})
+    assert response.status_code == 304
+    assert response.headers['etag'] == first.headers['etag']
+    assert policies.counters['/api/gnmath-proxy']['not_modified'] == 1
+
+
+async def test_other_routes_and_methods_are_untouched(client):
+    response = await client.get('/api/', headers={'if-none-match': '*'})
+    assert response.status_code == 200
+    assert 'etag' not in response.headers
+    response = await client.post('/api/gn-math-games', headers={'if-none-match': '*'})
+    assert response.status_code == 405
@@ -0,0 +1,99 @@
+from datetime import datetime
+
+import pytest
+
+import server
+
+GAMES = [
+    ('1', 'Karlson', 'action', 'A parkour shooter with milk.'),
+    ('2', 'Milkman Karlson', 'action', 'Deliver milk as Karlson.'),
+    ('3', 'Slope', 'arcade', 'Roll a ball down an endless slope; karlson fans like it.'),
+    ('4', 'Pizza Tower', 'platformer', 'Fast platforming through a tower of pizza.'),
+    ('5', 'Tower Defense', 'strategy', 'Build towers to stop the waves.'),
+]
+
+
+def game(game_id, title, category, description):
+    return {
+        'id': game_id,
+        'title': title,
+        'category': category,
+        'description': description,
+        'game_url': f'https://games.example.com/{game_id}/',
+        'thumbnail': None,
+        'created_at': datetime(2024, 1, int(game_id)),
+    }
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = server.GameSearchIndex()
+    for row in GAMES:
+        index.add(game(*row))
+    monkeypatch.setattr(server, 'game_search_index', index)
+    return index
+
+
+def ids(index, query, limit=20, category=None):
+    return [doc['id'] for doc, _ in index.search(query, limit, category)[1]]
+
+
+def test_title_matches_rank_above_description_matches(index):
+    total, hits = index.search('karlson')
+    assert total == 3
+    assert [doc['id'] for doc, _ in hits][-1] == '3'
+    assert hits[0][1] > hits[-1][1]
+
+
+def test_every_word_must_match(index):
+    assert ids(index, 'milk karlson') == ['2', '1']
+    assert ids(index, 'karlson pizza') == []
+
+
+@pytest.mark.parametrize('query', ['karslon', 'karlsen', 'karlsonn', 'karson'])
+def test_one_typo_is_tolerated(index, query):
+    assert set(ids(index, query)) == {'1', '2', '3'}
+
+
+def test_short_words_need_to_be_exact(index):
+    assert ids(index, 'tovr') == []
+
+
+def test_last_word_matches_as_a_prefix(index):
+    assert set(ids(index, 'tow')) == {'4', '5'}
+    assert ids(index, 'pizza tow') == ['4']
+    assert ids(index, 'tow pizza') == []
+
+
+def test_category_filter(index):
+    assert ids(index, 'tower', category='strategy') == ['5']
+    assert ids(index, 'karlson', category='puzzle') == []
+
+
+def test_limit_keeps_the_best_and_counts_all(index):
+    total, hits = index.search('karlson', limit=1)
+    assert total == 3
+    assert [doc['id'] for doc, _ in hits] == ids(index, 'karlson')[:1]
+
+
+def test_changes_are_visible_to_memoized_queries(index):
+    assert ids(index, 'slope') == ['3']
+    index.remove('3')
+    assert ids(index, 'slope') == []
+    index.add(game('3', 'Slope 2', 'arcade', 'The sequel.'))
+    assert ids(index, 'slope') == ['3']
+    assert index.document('https://games.example.com/3/')['title'] == 'Slope 2'
+
+
+@pytest.mark.anyio
+async def test_search_endpoint(index, client):
+    response = await client.get('/api/games/search', params={'q': 'pizza towr', 'limit': 5})
+    assert response.status_code == 200
+    body = response.json()
+    assert body['query'] == 'pizza towr'
+    assert body['total'] == 1
+    assert [hit['id'] for hit in body['results']] == ['4']
+    assert body['results'][0]['score'] > 0
+
+    response = await client.get('/api/games/search', params={'q': ''})
+    assert response.status_code == 422
@@ -0,0 +1,55 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def game(n, category='action', **fields):
+    return {
+        'title': f'Game {n}', 'description': f'Game number {n}', 'category': category,
+        'game_url': f'https://games.example.org/{n}/', **fields,
+    }
+
+
+async def test_reimport_is_idempotent(games_db, client):
+    games = [game(n) for n in range(5)]
+    first = (await client.post('/api/games/bulk', json=games)).json()
+    again = (await client.post('/api/games/bulk', json=games)).json()
+    assert (first['inserted'], again['inserted'], again['unchanged']) == (5, 0, 5)
+    assert await games_db.games.count_documents({}) == 5
+
+
+async def test_category_change_updates_the_game_in_place(games_db, client):
+    await client.post('/api/games/bulk', json=[game(1), game(2)])
+    result = (await client.post('/api/games/bulk', json=[game(1, 'puzzle')])).json()
+    assert (result['inserted'], result['updated']) == (0, 1)
+    assert await games_db.games.count_documents({'game_url': game(1)['game_url']}) == 1
+    assert server.category_counts.counts == {'action': 1, 'puzzle': 1}
+    assert server.game_search_index.document(game(1)['game_url'])['category'] == 'puzzle'
+
+
+async def test_create_game_allows_an_existing_game_url(games_db, client):
+    assert (await client.post('/api/games', json=game(1))).status_code == 200
+    assert (await client.post('/api/games', json=game(1, 'puzzle'))).status_code == 200
+    assert await games_db.games.count_documents({}) == 2
+
+
+async def test_listing_etag_is_answered_without_the_query(games_db, client, monkeypatch):
+    await client.post('/api/games/bulk', json=[game(n) for n in range(3)])
+    listing = await client.get('/api/games', params={'limit': 2})
+    assert len(listing.json()) == 2
+    etag = listing.headers['etag']
+    assert etag == server.games_version.etag(b'limit=2')
+
+    with monkeypatch.context() as patched:
+        patched.setattr(server, 'db', None)  # the handler must not run
+        response = await client.get('/api/games', params={'limit': 2}, headers={'if-none-match': etag})
+    assert response.status_code == 304
+
+    other_query = await client.get('/api/games', params={'limit': 3}, headers={'if-none-match': etag})
+    assert other_query.status_code == 200
+    await client.post('/api/games', json=game(9))
+    changed = await client.get('/api/games', params={'limit': 2}, headers={'if-none-match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['etag'] != etag
@@ -0,0 +1,74 @@
+import random
+
+import httpx
+import pytest
+
+import server
+from .conftest import UPSTREAM
+
+PAGE = (
+    '<!DOCTYPE html><html><head>'
+    '<link rel="stylesheet" href="/static/site.css">'
+    "<script src='//cdn.example.org/lib.js'></script>"
+    '</head><body>'
+    '<a href="/wiki/Main" title="Main">Main</a>'
+    '<img src="img/sprite.png" alt="relative">'
+    '<form action="/search"><input name="q"></form>'
+    '<a href="https://external.example.net/x">external</a>'
+    '<a href="#top">top</a><a href="mailto:someone@example.org">mail</a>'
+    '<p>Café — text with href and src= words but no attributes</p>'
+    '</body></html>'
+) * 20
+
+
+def random_splits(data, rng, max_chunk=40):
+    chunks, start = [], 0
+    while start < len(data):
+        end = start + rng.randint(1, max_chunk)
+        chunks.append(data[start:end])
+        start = end
+    return chunks
+
+
+@pytest.mark.parametrize('relative_base', [None, '/api/gn-math/game'])
+def test_text_output_is_independent_of_chunking(relative_base):
+    expected = server.HtmlUrlRewriter(UPSTREAM + '/page.html', relative_base).rewrite(PAGE)
+    assert 'href="http://upstream.test/static/site.css"' in expected
+    assert "src='https://cdn.example.org/lib.js'" in expected
+    rng = random.Random(3)
+    for _ in range(200):
+        rewriter = server.HtmlUrlRewriter(UPSTREAM + '/page.html', relative_base)
+        out = ''.join(rewriter.feed(chunk) for chunk in random_splits(PAGE, rng)) + rewriter.flush()
+        assert out == expected
+
+
+@pytest.mark.parametrize('relative_base', [None, '/api/gn-math/game'])
+def test_bytes_output_matches_text_output(relative_base):
+    expected = server.HtmlUrlRewriter(UPSTREAM + '/page.html', relative_base).rewrite(PAGE).encode('utf-8')
+    data = PAGE.encode('utf-8')
+    rng = random.Random(4)
+    for _ in range(200):
+        rewriter = server.HtmlUrlRewriter(UPSTREAM + '/page.html', relative_base)
+        out = b''.join(rewriter.feed_bytes(chunk) for chunk in random_splits(data, rng)) + rewriter.flush_bytes()
+        assert out == expected
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize('charset', ['utf-8', 'shift_jis'])
+async def test_proxied_page_is_rewritten_the_same_however_it_arrives(stub, client, charset):
+    data = PAGE.encode(charset, errors='replace')
+    expected = server.HtmlUrlRewriter(UPSTREAM + '/page.html').rewrite(data.decode(charset))
+    rng = random.Random(5)
+
+    def page(request):
+        async def body():
+            for chunk in random_splits(data, rng, max_chunk=300):
+                yield chunk
+
+        return httpx.Response(200, headers={'content-type': f'text/html; charset={charset}'}, content=body())
+
+    stub.route('/page.html', page)
+    for _ in range(5):
+        response = await client.get('/api/proxy-direct', params={'url': UPSTREAM + '/page.html'})
+        assert response.status_code == 200
+        assert response.text == expected
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import server
+from .conftest import UPSTREAM
+
+pytestmark = pytest.mark.anyio
+
+GAME_PAGE = b'<html><body><script src="game.js"></script></body></html>'
+
+
+@pytest.fixture
+def mirrors(stub, monkeypatch):
+    monkeypatch.setattr(server, 'GN_MATH_MIRRORS', [UPSTREAM + '/a/{game}/', UPSTREAM + '/b/{game}/'])
+    monkeypatch.setattr(server, 'gn_math_mirrors', server.MirrorSelector(hedge_delay=0.1, min_hedge_delay=0.1))
+    return stub
+
+
+def game_page(request):
+    return httpx.Response(200, headers={'content-type': 'text/html', 'cache-control': 'no-store'}, content=GAME_PAGE)
+
+
+def mirror_hits(stub, mirror):
+    return [request for request in stub.requests if request.url.path.startswith(f'/{mirror}/')]
+
+
+async def test_missing_game_is_skipped_on_that_mirror(mirrors, client):
+    mirrors.route('/b/karlson/', game_page)
+    first = await client.get('/api/gn-math-proxy', params={'game': 'karlson'})
+    second = await client.get('/api/gn-math-proxy', params={'game': 'karlson'})
+    assert first.status_code == second.status_code == 200
+    assert 'src="/api/gn-math/karlson/game.js"' in second.text
+    assert len(mirror_hits(mirrors, 'a')) == 1
+    assert len(mirror_hits(mirrors, 'b')) == 2
+    assert server.gn_math_mirrors.stats()['not_found'] == [f'karlson @ {UPSTREAM}/a/karlson/']
+
+
+async def test_slow_mirror_is_hedged_and_cancelled(mirrors, client):
+    cancelled = asyncio.Event()
+
+    async def stalled(request):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return game_page(request)
+
+    mirrors.route('/a/karlson/', stalled)
+    mirrors.route('/b/karlson/', game_page)
+    started = time.monotonic()
+    response = await client.get('/api/gn-math-proxy', params={'game': 'karlson'})
+    assert response.status_code == 200
+    assert time.monotonic() - started < 2
+    assert server.gn_math_mirrors.stats()['hedged'] == 1
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+    # The mirror that answered is tried first next time
+    assert server.gn_math_mirrors.order('karlson', [UPSTREAM + '/a/karlson/', UPSTREAM + '/b/karlson/']) == [
+        UPSTREAM + '/b/karlson/', UPSTREAM + '/a/karlson/',
+    ]
+    await client.get('/api/gn-math-proxy', params={'game': 'karlson'})
+    assert len(mirror_hits(mirrors, 'a')) == 1
+    assert len(mirror_hits(mirrors, 'b')) == 2
+
+
+async def test_game_missing_everywhere_is_reported(mirrors, client):
+    response = await client.get('/api/gn-math-proxy', params={'game': 'missing'})
+    # The route wraps every failure, its own 404 included, in a 400
+    assert response.status_code == 400
+    assert "Game 'missing' not found" in response.json()['detail']
+    assert len(mirrors.requests) == 2
+
+
+async def test_partial_response_wins_only_when_a_range_was_asked_for():
+    async def fetch(mirror):
+        if mirror == 'a':
+            return httpx.Response(206, headers={'content-range': 'bytes 0-9/100'}, content=b'0123456789')
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, content=b'x' * 100)
+
+    selector = server.MirrorSelector(hedge_delay=0.1, min_hedge_delay=0.1)
+    mirror, response = await selector.race('karlson', ['a', 'b'], fetch)
+    assert (mirror, response.status_code) == ('b', 200)
+    mirror, response = await selector.race('other', ['a', 'b'], fetch, partial=True)
+    assert (mirror, response.status_code) == ('a', 206)
@@ -0,0 +1,125 @@
+import os
+import time
+
+import httpx
+import pytest
+
+import server
+from .conftest import UPSTREAM
+
+pytestmark = pytest.mark.anyio
+
+SCRIPT = b'function tick(frame) { return frame + 1; }\n' * 100
+PAGE = b'<html><body><script src="game.js"></script></body></html>'
+
+
+def validated(body, content_type, etag):
+    def handler(request):
+        headers = {'content-type': content_type, 'etag': etag}
+        if request.headers.get('if-none-match') == etag:
+            return httpx.Response(304, headers=headers)
+        return httpx.Response(200, headers=headers, content=body)
+
+    return handler
+
+
+@pytest.fixture
+async def store(stub, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, 'GN_MATH_MIRRORS', [UPSTREAM + '/a/{game}/'])
+    store = server.GameMirrorStore(root=tmp_path / 'store', sync_interval=0)
+    store.manifests = store._load_manifests()
+    monkeypatch.setattr(server, 'gn_math_store', store)
+    stub.route('/a/karlson/', validated(PAGE, 'text/html', '"page"'))
+    stub.route('/a/karlson/game.js', validated(SCRIPT, 'application/javascript', '"script"'))
+    assert await store.sync_game('karlson')
+    return store
+
+
+def script_etag(store, coding=None):
+    digest = store.lookup('karlson', 'game.js')['sha256']
+    return f'"{digest}-{coding}"' if coding else f'"{digest}"'
+
+
+async def test_game_files_are_mirrored_with_their_references(store, stub):
+    assert sorted(store.manifests['karlson']['files']) == ['game.js', 'index.html']
+    codings = ['br', 'gzip'] if server.BROTLI_AVAILABLE else ['gzip']
+    assert store.lookup('karlson', 'game.js')['encodings'] == codings
+
+    # A resync revalidates instead of downloading again
+    assert await store.sync_game('karlson')
+    assert store.stats()['not_modified'] == 2
+    assert stub.hits('/a/karlson/game.js')[-1].headers['if-none-match'] == '"script"'
+
+
+async def test_each_variant_has_its_own_etag(store, client):
+    plain = await client.get('/api/gn-math/karlson/game.js', headers={'accept-encoding': 'identity'})
+    compressed = await client.get('/api/gn-math/karlson/game.js', headers={'accept-encoding': 'gzip'})
+    assert plain.headers['etag'] == script_etag(store)
+    assert compressed.headers['etag'] == script_etag(store, 'gzip')
+    assert compressed.headers['content-encoding'] == 'gzip'
+    assert compressed.headers['vary'] == 'Accept-Encoding'
+    assert plain.content == compressed.content == SCRIPT
+
+    revalidated = await client.get('/api/gn-math/karlson/game.js', headers={
+        'accept-encoding': 'gzip', 'if-none-match': compressed.headers['etag'],
+    })
+    assert revalidated.status_code == 304
+    assert revalidated.headers['etag'] == compressed.headers['etag']
+
+
+async def test_ranges_come_from_the_identity_blob(store, client):
+    response = await client.get('/api/gn-math/karlson/game.js', headers={
+        'accept-encoding': 'gzip', 'range': 'bytes=0-7', 'if-range': script_etag(store),
+    })
+    assert response.status_code == 206
+    assert response.content == SCRIPT[:8]
+    assert response.headers['content-range'] == f'bytes 0-7/{len(SCRIPT)}'
+    assert response.headers['etag'] == script_etag(store)
+    assert 'content-encoding' not in response.headers
+
+
+@pytest.mark.parametrize('if_range', ['"stale"', 'W/{etag}', '{coded}'])
+async def test_if_range_mismatch_sends_the_whole_file(store, client, if_range):
+    header = if_range.format(etag=script_etag(store), coded=script_etag(store, 'gzip'))
+    response = await client.get('/api/gn-math/karlson/game.js', headers={
+        'accept-encoding': 'identity', 'range': 'bytes=0-7', 'if-range': header,
+    })
+    assert response.status_code == 200
+    assert response.content == SCRIPT
+
+
+async def test_unsatisfiable_range(store, client):
+    response = await client.get('/api/gn-math/karlson/game.js', headers={
+        'accept-encoding': 'identity', 'range': f'bytes={len(SCRIPT)}-',
+    })
+    assert response.status_code == 416
+    assert response.headers['content-range'] == f'bytes */{len(SCRIPT)}'
+
+
+async def test_stored_page_is_rewritten_to_the_store_route(store, client):
+    response = await client.get('/api/gn-math-proxy', params={'game': 'karlson'},
+                                headers={'accept-encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.headers['x-cache'] == 'STORE'
+    assert 'src="/api/gn-math/karlson/game.js"' in response.text
+
+
+async def test_least_recently_used_games_are_evicted_over_budget(store, stub, tmp_path):
+    for game in ('celeste', 'portal'):
+        stub.route(f'/a/{game}/', validated(PAGE.replace(b'<body>', f'<body>{game}'.encode()), 'text/html', f'"{game}"'))
+        stub.route(f'/a/{game}/game.js', validated(SCRIPT + game.encode() * 200, 'application/javascript', f'"{game}.js"'))
+    assert await store.sync_game('celeste')
+    store.lookup('karlson', 'index.html')  # karlson is used again, so celeste is now the oldest
+    for path in store.blob_dir.glob('*/*'):
+        os.utime(path, (time.time() - 60,) * 2)
+
+    store.max_bytes = store.stored_bytes()
+    assert await store.sync_game('portal')
+    assert sorted(store.manifests) == ['karlson', 'portal']
+    assert store.stored_bytes() <= store.max_bytes
+    assert not (store.manifest_dir / 'celeste.json').exists()
+    stats = store.stats()
+    assert stats['games_evicted'] == 1
+    assert stats['blobs_collected'] > 0
+    referenced = {entry['sha256'] for manifest in store.manifests.values() for entry in manifest['files'].values()}
+    assert {path.name.split('.', 1)[0] for path in store.blob_dir.glob('*/*')} == referenced
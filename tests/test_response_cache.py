@@ -0,0 +1,101 @@
+import httpx
+import pytest
+
+from .conftest import UPSTREAM
+
+pytestmark = pytest.mark.anyio
+
+ASSET = UPSTREAM + '/asset.bin'
+BODY = bytes(range(256)) * 16
+
+
+def proxied(client, url=ASSET):
+    return client.get('/api/proxy-direct', params={'url': url})
+
+
+def validated(etag='"v1"', body=BODY, cache_control='no-cache'):
+    """An upstream that answers If-None-Match with 304 while ``etag`` is current"""
+
+    def handler(request):
+        headers = {'cache-control': cache_control, 'etag': etag, 'content-type': 'application/octet-stream'}
+        if request.headers.get('if-none-match') == etag:
+            return httpx.Response(304, headers=headers)
+        return httpx.Response(200, headers=headers, content=body)
+
+    return handler
+
+
+async def test_fresh_response_is_served_from_cache(stub, client):
+    stub.route('/asset.bin', headers={'cache-control': 'max-age=60', 'content-type': 'application/octet-stream'},
+               content=BODY)
+    first = await proxied(client)
+    second = await proxied(client)
+    assert first.headers['x-cache'] == 'MISS'
+    assert second.headers['x-cache'] == 'HIT'
+    assert first.content == second.content == BODY
+    assert len(stub.hits('/asset.bin')) == 1
+
+
+async def test_no_store_is_never_cached(stub, client):
+    stub.route('/asset.bin', headers={'cache-control': 'no-store', 'content-type': 'application/octet-stream'},
+               content=BODY)
+    await proxied(client)
+    second = await proxied(client)
+    assert second.headers['x-cache'] == 'MISS'
+    assert len(stub.hits('/asset.bin')) == 2
+
+
+async def test_stale_entry_is_revalidated_with_its_etag(stub, client):
+    stub.route('/asset.bin', validated())
+    first = await proxied(client)
+    second = await proxied(client)
+    assert first.headers['x-cache'] == 'MISS'
+    assert second.headers['x-cache'] == 'REVALIDATED'
+    assert second.content == BODY
+    conditional = stub.hits('/asset.bin')[1]
+    assert conditional.headers['if-none-match'] == '"v1"'
+
+
+async def test_changed_upstream_replaces_the_entry(stub, client):
+    stub.route('/asset.bin', validated())
+    await proxied(client)
+    stub.route('/asset.bin', validated(etag='"v2"', body=b'new body'))
+    changed = await proxied(client)
+    assert changed.headers['x-cache'] == 'MISS'
+    assert changed.content == b'new body'
+    again = await proxied(client)
+    assert again.headers['x-cache'] == 'REVALIDATED'
+    assert again.content == b'new body'
+
+
+async def test_stale_copy_is_served_when_upstream_errors(stub, client):
+    stub.route('/asset.bin', validated())
+    await proxied(client)
+    stub.route('/asset.bin', status_code=502, content=b'bad gateway')
+    response = await proxied(client)
+    assert response.status_code == 200
+    assert response.headers['x-cache'] == 'STALE'
+    assert response.content == BODY
+
+
+async def test_stale_copy_is_served_when_upstream_is_unreachable(stub, client):
+    stub.route('/asset.bin', validated())
+    await proxied(client)
+
+    def unreachable(request):
+        raise httpx.ConnectError('connection refused', request=request)
+
+    stub.route('/asset.bin', unreachable)
+    response = await proxied(client)
+    assert response.status_code == 200
+    assert response.headers['x-cache'] == 'STALE'
+    assert response.content == BODY
+
+
+async def test_unreachable_upstream_without_a_copy_fails(stub, client):
+    def unreachable(request):
+        raise httpx.ConnectError('connection refused', request=request)
+
+    stub.route('/asset.bin', unreachable)
+    response = await proxied(client)
+    assert response.status_code == 400
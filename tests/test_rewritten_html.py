@@ -0,0 +1,124 @@
+import httpx
+import pytest
+
+import server
+from .conftest import UPSTREAM, ranged
+
+pytestmark = pytest.mark.anyio
+
+PAGE = ''.join(f'<a href="/games/{n}/">Game {n}</a><img src="//cdn.example.org/{n}.png">\n' for n in range(50))
+IDENTITY = {'accept-encoding': 'identity'}
+
+
+@pytest.fixture
+def portal(stub, monkeypatch):
+    monkeypatch.setattr(server, 'GN_MATH_PORTAL_URL', UPSTREAM + '/')
+    return stub
+
+
+def page(body=PAGE, etag='"p1"'):
+    def handler(request):
+        headers = {'cache-control': 'no-cache', 'content-type': 'text/html; charset=utf-8'}
+        if etag:
+            headers['etag'] = etag
+            if request.headers.get('if-none-match') == etag:
+                return httpx.Response(304, headers=headers)
+        return httpx.Response(200, headers=headers, content=body.encode('utf-8'))
+
+    return handler
+
+
+async def test_unchanged_page_is_rewritten_once(portal, client):
+    portal.route('/', page())
+    first = await client.get('/api/gnmath-proxy', headers=IDENTITY)
+    second = await client.get('/api/gnmath-proxy', headers=IDENTITY)
+    assert first.headers['x-rewrite-cache'] == 'MISS'
+    assert second.headers['x-rewrite-cache'] == 'HIT'
+    assert second.headers['x-cache'] == 'REVALIDATED'
+    assert first.text == second.text
+    assert 'href="http://upstream.test/games/0/"' in first.text
+    assert 'src="https://cdn.example.org/0.png"' in first.text
+    assert first.headers['etag'] == second.headers['etag']
+
+
+async def test_changed_page_is_rewritten_again(portal, client):
+    portal.route('/', page())
+    first = await client.get('/api/gnmath-proxy', headers=IDENTITY)
+    portal.route('/', page(PAGE.replace('Game', 'Level'), etag='"p2"'))
+    changed = await client.get('/api/gnmath-proxy', headers=IDENTITY)
+    assert changed.headers['x-rewrite-cache'] == 'MISS'
+    assert 'Level 0' in changed.text
+    assert changed.headers['etag'] != first.headers['etag']
+
+
+async def test_page_without_etag_is_memoized_by_content(portal, client):
+    portal.route('/', page(etag=None))
+    await client.get('/api/gnmath-proxy', headers=IDENTITY)
+    second = await client.get('/api/gnmath-proxy', headers=IDENTITY)
+    assert second.headers['x-rewrite-cache'] == 'HIT'
+    assert len(portal.hits('/')) == 2
+
+
+async def test_compressed_variant_is_its_own_representation(portal, client):
+    portal.route('/', page())
+    plain = await client.get('/api/gnmath-proxy', headers=IDENTITY)
+    compressed = await client.get('/api/gnmath-proxy', headers={'accept-encoding': 'gzip'})
+    assert compressed.headers['content-encoding'] == 'gzip'
+    assert compressed.headers['vary'] == 'Accept-Encoding'
+    assert compressed.text == plain.text
+    assert compressed.headers['etag'] != plain.headers['etag']
+    again = await client.get('/api/gnmath-proxy', headers={'accept-encoding': 'gzip'})
+    assert again.headers['etag'] == compressed.headers['etag']
+    assert server.rewritten_html_cache.stats()['variant_compressions'] == 1
+    assert server.rewritten_html_cache.stats()['variant_hits'] == 1
+
+
+@pytest.fixture
+def game_mirror(stub, monkeypatch):
+    monkeypatch.setattr(server, 'GN_MATH_MIRRORS', [UPSTREAM + '/a/{game}/'])
+    stub.route('/a/undertale/', ranged(PAGE.encode('utf-8'), 'text/html; charset=utf-8', '"game"'))
+    return stub
+
+
+async def test_range_request_cannot_truncate_the_memoized_page(game_mirror, client):
+    ranged_response = await client.get('/api/gn-math-proxy', params={'game': 'undertale'},
+                                       headers={'range': 'bytes=0-9', **IDENTITY})
+    assert 'range' not in game_mirror.requests[-1].headers
+    full = await client.get('/api/gn-math-proxy', params={'game': 'undertale'}, headers=IDENTITY)
+    assert ranged_response.status_code == full.status_code == 200
+    assert ranged_response.text == full.text
+    assert 'Game 49' in full.text
+
+
+async def test_game_page_file_is_fetched_whole(game_mirror, client):
+    game_mirror.route('/a/undertale/level.html', ranged(PAGE.encode('utf-8'), 'text/html; charset=utf-8'))
+    response = await client.get('/api/gn-math/undertale/level.html', headers={'range': 'bytes=0-9', **IDENTITY})
+    assert 'range' not in game_mirror.requests[-1].headers
+    assert response.status_code == 200
+    assert 'Game 49' in response.text
+
+
+async def test_partial_response_is_passed_through_unrewritten(game_mirror, client):
+    # An asset path gets its range forwarded; a partial body is never rewritten, whatever its type
+    game_mirror.route('/a/undertale/intro.bin', ranged(PAGE.encode('utf-8'), 'text/html; charset=utf-8'))
+    response = await client.get('/api/gn-math/undertale/intro.bin', headers={'range': 'bytes=0-9', **IDENTITY})
+    assert response.status_code == 206
+    assert response.headers['content-range'] == f'bytes 0-9/{len(PAGE)}'
+    assert response.content == PAGE.encode('utf-8')[:10]
+    assert server.rewritten_html_cache.stats()['entries'] == 0
+
+
+@pytest.mark.parametrize('method, route, params', [
+    ('GET', '/api/proxy-direct', {'url': UPSTREAM + '/page.html'}),
+    ('GET', '/api/smart-proxy', {'q': UPSTREAM + '/page.html'}),
+    ('POST', '/api/proxy', None),
+])
+async def test_partial_page_keeps_its_status_and_content_range(stub, client, method, route, params):
+    stub.route('/page.html', ranged(PAGE.encode('utf-8'), 'text/html; charset=utf-8'))
+    response = await client.request(
+        method, route, params=params, json={'url': UPSTREAM + '/page.html'} if method == 'POST' else None,
+        headers={'range': 'bytes=0-9', **IDENTITY},
+    )
+    assert response.status_code == 206
+    assert response.headers['content-range'] == f'bytes 0-9/{len(PAGE)}'
+    assert response.content == PAGE.encode('utf-8')[:10]
@@ -0,0 +1,150 @@
+import asyncio
+
+import httpx
+import pytest
+
+import server
+from .conftest import UPSTREAM
+
+pytestmark = pytest.mark.anyio
+
+
+class BlockingStream(httpx.AsyncByteStream):
+    """Yields ``chunks`` and then waits for more until closed"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.more = asyncio.Event()
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        await self.more.wait()
+        yield b'tail'
+
+    async def aclose(self):
+        self.closed = True
+
+
+async def test_concurrent_requests_share_one_upstream_fetch(stub, client):
+    gate = asyncio.Event()
+
+    async def slow(request):
+        await gate.wait()
+        return httpx.Response(200, headers={'cache-control': 'no-store', 'content-type': 'application/octet-stream'},
+                              content=b'x' * 10000)
+
+    stub.route('/slow', slow)
+    requests = [
+        asyncio.create_task(client.get('/api/proxy-direct', params={'url': UPSTREAM + '/slow'}))
+        for _ in range(10)
+    ]
+    while server.single_flight.stats()['collapsed'] < 9:
+        await asyncio.sleep(0.01)
+    gate.set()
+    responses = await asyncio.gather(*requests)
+    assert [response.status_code for response in responses] == [200] * 10
+    assert all(response.content == b'x' * 10000 for response in responses)
+    assert len(stub.hits('/slow')) == 1
+    assert server.single_flight.stats() == {'flights': 1, 'collapsed': 9, 'paused': 0, 'in_flight': 0}
+
+
+async def test_failure_reaches_every_waiter(stub, client):
+    gate = asyncio.Event()
+
+    async def unreachable(request):
+        await gate.wait()
+        raise httpx.ConnectError('connection refused', request=request)
+
+    stub.route('/slow', unreachable)
+    requests = [
+        asyncio.create_task(client.get('/api/proxy-direct', params={'url': UPSTREAM + '/slow'}))
+        for _ in range(3)
+    ]
+    while server.single_flight.stats()['collapsed'] < 2:
+        await asyncio.sleep(0.01)
+    gate.set()
+    responses = await asyncio.gather(*requests)
+    assert [response.status_code for response in responses] == [400] * 3
+    assert len(stub.hits('/slow')) == 1
+
+
+async def test_fetch_is_cancelled_when_every_reader_leaves():
+    group = server.SingleFlight()
+    stream = BlockingStream([b'head'])
+
+    async def opener():
+        return httpx.Response(200, stream=stream)
+
+    response = await group.fetch('k', opener)
+    chunks = response.aiter_raw()
+    assert await chunks.__anext__() == b'head'
+    await response.aclose()
+    await asyncio.sleep(0.01)
+    assert stream.closed
+    assert group.stats()['in_flight'] == 0
+
+
+async def test_fetch_continues_while_one_reader_remains():
+    group = server.SingleFlight()
+    stream = BlockingStream([b'head'])
+
+    async def opener():
+        return httpx.Response(200, stream=stream)
+
+    leaving = await group.fetch('k', opener)
+    staying = await group.fetch('k', opener)
+    assert await leaving.aiter_raw().__anext__() == b'head'
+    await leaving.aclose()
+    stream.more.set()
+    assert await staying.aread() == b'headtail'
+    assert group.stats() == {'flights': 1, 'collapsed': 1, 'paused': 0, 'in_flight': 0}
+
+
+async def test_caller_cancelled_before_headers_cancels_the_fetch():
+    group = server.SingleFlight()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def opener():
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    waiter = asyncio.create_task(group.fetch('k', opener))
+    await started.wait()
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert group.stats()['in_flight'] == 0
+
+
+async def test_slow_reader_holds_back_the_upstream():
+    group = server.SingleFlight(join_limit=64 * 1024, read_ahead=256 * 1024)
+    chunk = b'x' * 16 * 1024
+    produced = 0
+
+    async def body():
+        nonlocal produced
+        for _ in range(200):
+            produced += len(chunk)
+            yield chunk
+
+    async def opener():
+        return httpx.Response(200, content=body())
+
+    response = await group.fetch('k', opener)
+    flight = response.stream._flight
+    consumed = 0
+    async for received in response.aiter_raw():
+        consumed += len(received)
+        await asyncio.sleep(0)
+        assert produced - consumed <= group.read_ahead + group.join_limit
+        assert flight.held <= group.read_ahead + len(chunk)
+    assert consumed == produced == 200 * len(chunk)
+    assert group.stats()['paused'] > 0